@@ -1,5 +1,5 @@
 from __future__ import annotations
-import os, torch
+import logging, os, threading, time, torch
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from pydantic import BaseModel
 
@@ -7,8 +7,14 @@ from email_security_pipeline.parsers import parse_email_from_bytes
 from email_security_pipeline.features import build_feature_vector, FEATURE_COLUMNS
 from email_security_pipeline.bert_model import DistilBERTEncoder
 from email_security_pipeline.fusion_model import FusionClassifier
+# Stdlib-only module shared with the Sortify model service
+from model_service.profiling import install_profiling, stage
+from model_service.local_models import MODEL_OFFLINE
+
+logger = logging.getLogger(__name__)
 
 APP = FastAPI(title="EmailGuard Fusion Classifier")
+install_profiling(APP)  # PROFILING_ENDPOINTS / STAGE_TIMING_SAMPLE_RATE; nothing is added when unset
 
 class Resp(BaseModel):
     label: str
@@ -18,31 +24,84 @@ class Resp(BaseModel):
 CKPT_DIR = os.environ.get("CKPT_DIR", "artifacts/latest")
 MODEL_NAME = os.environ.get("MODEL_NAME", "distilbert-base-uncased")
 _encoder = None; _model = None; _label_names = None
+# One load per process: the startup task and early requests wait on the same lock
+_load_lock = threading.Lock()
+_readiness = {"status": "starting", "error": None, "started_at": time.time(), "ready_seconds": None}
+_load_task = None
 
 def _load():
     global _encoder, _model, _label_names
     if _model is not None: return
-    ckpt = torch.load(os.path.join(CKPT_DIR, "model.pt"), map_location="cpu")
-    _label_names = ckpt["label_names"]
-    _encoder = DistilBERTEncoder(model_name=MODEL_NAME)
-    _model = FusionClassifier(bert_hidden=768, feat_dim=len(FEATURE_COLUMNS), num_classes=len(_label_names))
-    _model.load_state_dict(ckpt["state_dict"]); _model.eval()
+    with _load_lock:
+        if _model is not None: return
+        # mmap: tensors are paged in from the checkpoint instead of unpickled into fresh memory
+        ckpt = torch.load(os.path.join(CKPT_DIR, "model.pt"), map_location="cpu", mmap=True, weights_only=True)
+        # MODEL_NAME may be a local directory; with MODEL_OFFLINE the hub is never contacted
+        encoder = DistilBERTEncoder(model_name=MODEL_NAME, local_files_only=MODEL_OFFLINE or os.path.isdir(MODEL_NAME))
+        model = FusionClassifier(bert_hidden=768, feat_dim=len(FEATURE_COLUMNS), num_classes=len(ckpt["label_names"]))
+        model.load_state_dict(ckpt["state_dict"]); model.eval()
+        # _model last: it is what the unlocked check above looks at
+        _label_names = ckpt["label_names"]; _encoder = encoder; _model = model
+
+def _load_and_warm():
+    _load()
+    tv = _encoder.encode("warm-up", "warm-up " * 400).unsqueeze(0)
+    with torch.no_grad():
+        _model(tv, torch.zeros(1, len(FEATURE_COLUMNS)))
+    _readiness.update(status="ready", error=None, ready_seconds=time.time() - _readiness["started_at"])
+    logger.info(f"Model ready in {_readiness['ready_seconds']:.1f}s")
+
+async def _load_in_background():
+    import asyncio
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _load_and_warm)
+    except Exception as e:
+        logger.exception("Failed to load model")
+        _readiness.update(status="failed", error=str(e))
+
+@APP.on_event("startup")
+async def _startup():
+    # Load before traffic arrives rather than on the first request; /ready reports when done
+    import asyncio
+    global _load_task
+    _load_task = asyncio.create_task(_load_in_background())
+
+@APP.get("/health")
+async def health():
+    # Liveness: only a failed load makes the process unhealthy
+    if _readiness["status"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Model load failed: {_readiness['error']}")
+    return {"status": "ok", "model": _readiness["status"]}
+
+@APP.get("/ready")
+async def ready():
+    if _readiness["status"] != "ready":
+        raise HTTPException(status_code=503, detail=_readiness)
+    return {"status": "ready", "labels": _label_names, "ready_seconds": _readiness["ready_seconds"]}
 
 @APP.post("/classify_email", response_model=Resp)
 async def classify_email(file: UploadFile = File(...)):
-    _load()
+    if _readiness["status"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Model load failed: {_readiness['error']}")
+    if _model is None:
+        # Waits for the startup load (or does it) on a worker thread, not the event loop
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, _load)
     if hasattr(file, "size") and file.size and file.size > 10_000_000:
         raise HTTPException(status_code=413, detail="Email too large")
     raw = await file.read()
     try:
-        p = parse_email_from_bytes(raw)
+        with stage("parse"):
+            p = parse_email_from_bytes(raw)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Parse error: {e}")
-    tv = _encoder.encode(p.subject, p.body_text, p.compact_header_text).unsqueeze(0)
+    with stage("transformer_forward"):
+        tv = _encoder.encode(p.subject, p.body_text, p.compact_header_text).unsqueeze(0)
     import numpy as np
-    fv_np, _ = build_feature_vector(p)
+    with stage("feature_extraction"):
+        fv_np, _ = build_feature_vector(p)
     fv = torch.from_numpy(fv_np).float().unsqueeze(0)
-    with torch.no_grad():
+    with torch.no_grad(), stage("fusion"):
         logits = _model(tv, fv)
         probs = torch.softmax(logits, dim=-1).squeeze(0)
         topk = torch.topk(probs, k=min(3, probs.numel()))
@@ -3,10 +3,11 @@ import torch
 from transformers import AutoTokenizer, AutoModel
 
 class DistilBERTEncoder(torch.nn.Module):
-    def __init__(self, model_name: str = "distilbert-base-uncased", max_length: int = 512, use_mean_pool: bool = True):
+    def __init__(self, model_name: str = "distilbert-base-uncased", max_length: int = 512, use_mean_pool: bool = True,
+                 local_files_only: bool = False):
         super().__init__()
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
-        self.encoder = AutoModel.from_pretrained(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, local_files_only=local_files_only)
+        self.encoder = AutoModel.from_pretrained(model_name, local_files_only=local_files_only)
         self.max_length = max_length
         self.use_mean_pool = use_mean_pool
 
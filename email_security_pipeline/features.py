@@ -1,4 +1,5 @@
 from __future__ import annotations
+from functools import lru_cache
 from typing import List, Tuple
 import numpy as np
 from .parsers import ParsedEmail
@@ -18,6 +19,7 @@ SHORTENER_HOSTS = {"bit.ly","t.co","tinyurl.com","goo.gl"}
 def _onehot(value: str, choices: List[str]) -> List[int]:
     return [1 if value == c else 0 for c in choices]
 
+@lru_cache(maxsize=65536)
 def _domain(host: str) -> str:
     host = host.lower().strip()
     return host.split("/")[2] if "//" in host else host.split("/")[0]
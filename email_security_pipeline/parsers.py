@@ -4,6 +4,7 @@ import re
 from dataclasses import dataclass
 from email import policy
 from email.parser import BytesParser
+from html.parser import HTMLParser
 from typing import Dict, List, Optional, Tuple
 
 try:
@@ -11,10 +12,6 @@ try:
 except Exception:
     magic = None
 
-try:
-    from bs4 import BeautifulSoup
-except Exception:
-    BeautifulSoup = None
 
 URL_REGEX = re.compile(r"https?://[^\s)>'\"]+", re.IGNORECASE)
 SHORTENER_HOSTS = {"bit.ly", "t.co", "tinyurl.com", "goo.gl"}
@@ -52,16 +49,80 @@ def _levenshtein(a: str, b: str) -> int:
         prev = curr
     return prev[-1]
 
+# Text inside these is dropped; noscript is what the old BeautifulSoup path decomposed
+_SKIP_TEXT_TAGS = {"script", "style", "noscript", "template", "rt", "rp"}
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+              "param", "source", "track", "wbr"}
+
+class _TextCollector(HTMLParser):
+    """One streaming pass over the HTML; no tree is built"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._pending: List[str] = []
+        self._open: List[str] = []
+        self._skip_depth = 0
+
+    def _flush(self):
+        if self._pending:
+            if not self._skip_depth:
+                text = "".join(self._pending).strip()
+                if text:
+                    self.chunks.append(text)
+            self._pending = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in _VOID_TAGS:
+            return
+        self._open.append(tag)
+        if tag in _SKIP_TEXT_TAGS:
+            self._skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag not in self._open:
+            return
+        while True:
+            closed = self._open.pop()
+            if closed in _SKIP_TEXT_TAGS:
+                self._skip_depth -= 1
+            if closed == tag:
+                return
+
+    def handle_data(self, data):
+        self._pending.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.startswith("CDATA[") and not self._skip_depth:
+            self._pending.append(data[len("CDATA["):])
+            self._flush()
+
 def _html_to_text(html: str) -> str:
     if not html:
         return ""
-    if BeautifulSoup is None:
-        return re.sub(r"<[^>]+>", " ", html)
-    soup = BeautifulSoup(html, "html.parser")
-    for t in soup(["script", "style", "noscript"]):
-        t.decompose()
-    text = soup.get_text(" ", strip=True)
-    return re.sub(r"\s+", " ", text).strip()
+    collector = _TextCollector()
+    try:
+        collector.feed(html)
+        collector.close()
+        collector._flush()
+    except Exception:
+        return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", html)).strip()
+    return re.sub(r"\s+", " ", " ".join(collector.chunks)).strip()
 
 def _extract_text_from_part(part) -> str:
     try:
@@ -5,7 +5,6 @@ import os
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from inference import EmailCategorizer
-from train_model import ModelTrainer
 import asyncio
 import threading
 from datetime import datetime
@@ -43,13 +42,22 @@ except Exception as e:
     print(f"Warning: Failed to initialize model: {e}")
     categorizer = None
 
-# Initialize the model trainer
-try:
-    trainer = ModelTrainer()
-    print("✅ Model trainer initialized successfully")
-except Exception as e:
-    print(f"⚠️ Warning: Failed to initialize trainer: {e}")
-    trainer = None
+# The model trainer (and the training stack it imports) is created on the first /train request
+trainer = None
+trainer_lock = threading.Lock()
+
+def get_trainer():
+    """Import and initialize the model trainer once; None if it cannot be initialized"""
+    global trainer
+    with trainer_lock:
+        if trainer is None:
+            try:
+                from train_model import ModelTrainer
+                trainer = ModelTrainer()
+                print("✅ Model trainer initialized successfully")
+            except Exception as e:
+                print(f"⚠️ Warning: Failed to initialize trainer: {e}")
+        return trainer
 
 # Pydantic models for request/response
 class EmailInput(BaseModel):
@@ -231,9 +239,10 @@ async def train_model(training_data: TrainingData, background_tasks: BackgroundT
     Input: { emails: [{subject, body, label}, ...], epochs, learning_rate, batch_size }
     Returns: { status, message, training_id }
     """
-    global training_status, trainer
+    global training_status
     
-    if trainer is None:
+    # Loading the trainer takes seconds; keep the event loop serving meanwhile
+    if await asyncio.get_running_loop().run_in_executor(None, get_trainer) is None:
         raise HTTPException(status_code=503, detail="Trainer not initialized")
     
     if training_status["is_training"]:
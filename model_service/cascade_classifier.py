@@ -0,0 +1,312 @@
+"""
+Cascaded Email Classification
+Cheap hashing-vectorizer linear model that answers easy emails before DistilBERT
+"""
+
+import numpy as np
+import logging
+import json
+import os
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime
+import argparse
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Threshold that can never be reached, used for categories the tier may not answer
+NEVER_ANSWER = 1.01
+
+def load_jsonl_examples(data_file: str) -> Tuple[List[str], List[str]]:
+    """
+    Load (subject, body) texts and label names from the DistilBERTTrainer JSONL format
+
+    Args:
+        data_file: Path to JSONL file
+
+    Returns:
+        Tuple of (texts, label_names)
+    """
+    if not os.path.exists(data_file):
+        raise FileNotFoundError(f"Dataset file {data_file} not found")
+
+    texts = []
+    labels = []
+    with open(data_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            example = json.loads(line)
+
+            label = example.get('trueLabel') or example.get('label')
+            subject = example.get('header_subject') or example.get('subject') or ''
+            body = example.get('body_text') or example.get('body') or example.get('text') or ''
+            if not label or not (subject or body):
+                continue
+
+            # Same text layout DynamicEmailClassifier.preprocess_text uses at serving time
+            texts.append(f"{subject} [SEP] {body}".strip())
+            labels.append(label)
+
+    logger.info(f"Loaded {len(texts)} examples from {data_file}")
+    return texts, labels
+
+class LinearFirstTier:
+    """Calibrated hashing-vectorizer linear model with per-category confidence thresholds"""
+
+    def __init__(
+        self,
+        n_features: int = 2 ** 20,
+        target_precision: float = 0.98,
+        min_support: int = 20
+    ):
+        self.n_features = n_features
+        self.target_precision = target_precision
+        self.min_support = min_support
+
+        self.vectorizer = None
+        self.model = None
+        self.classes_ = []
+        self.thresholds = {}
+        self.metrics = {}
+        self.is_trained = False
+
+        self._initialize_vectorizer()
+
+    def _initialize_vectorizer(self):
+        """Initialize the stateless hashing vectorizer"""
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.vectorizer = HashingVectorizer(
+            n_features=self.n_features,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm='l2',
+            lowercase=True
+        )
+
+    def train(self, texts: List[str], labels: List[str], validation_split: float = 0.2) -> Dict[str, Any]:
+        """
+        Train the linear model and tune per-category thresholds on a held-out split
+
+        Args:
+            texts: Email texts ("subject [SEP] body")
+            labels: Label names
+            validation_split: Fraction of data used for threshold tuning
+
+        Returns:
+            Training metrics including the expected escalation rate
+        """
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.calibration import CalibratedClassifierCV
+        from sklearn.model_selection import train_test_split
+
+        logger.info(f"Training linear first tier with {len(texts)} examples")
+
+        labels = np.asarray(labels)
+        _, counts = np.unique(labels, return_counts=True)
+        stratify = labels if counts.min() >= 2 else None
+        train_texts, val_texts, train_labels, val_labels = train_test_split(
+            texts, labels, test_size=validation_split, random_state=42, stratify=stratify
+        )
+
+        X_train = self.vectorizer.transform(train_texts)
+        base = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=50, tol=1e-4, random_state=42)
+
+        _, train_counts = np.unique(train_labels, return_counts=True)
+        if train_counts.min() >= 3:
+            method = 'isotonic' if len(train_texts) > 5000 else 'sigmoid'
+            self.model = CalibratedClassifierCV(base, method=method, cv=3)
+        else:
+            logger.warning("Too few examples per category for calibration; using raw log-loss probabilities")
+            self.model = base
+
+        self.model.fit(X_train, train_labels)
+        self.classes_ = [str(c) for c in self.model.classes_]
+
+        val_probabilities = self.model.predict_proba(self.vectorizer.transform(val_texts))
+        self.thresholds = self._tune_thresholds(val_probabilities, np.asarray(val_labels))
+        self.metrics = self._evaluate(val_probabilities, np.asarray(val_labels))
+        self.metrics['trained_at'] = datetime.now().isoformat()
+        self.metrics['train_size'] = len(train_texts)
+        self.is_trained = True
+
+        logger.info(f"First tier trained: accuracy on answered {self.metrics['answered_accuracy']:.4f}, "
+                    f"expected escalation rate {self.metrics['escalation_rate']:.2%}")
+        return self.metrics
+
+    def train_from_jsonl(self, data_file: str, validation_split: float = 0.2) -> Dict[str, Any]:
+        """Train from the same JSONL dataset used by DistilBERTTrainer"""
+        texts, labels = load_jsonl_examples(data_file)
+        if not texts:
+            raise ValueError("No valid training examples found")
+        return self.train(texts, labels, validation_split)
+
+    def _tune_thresholds(self, probabilities: np.ndarray, y_true: np.ndarray) -> Dict[str, float]:
+        """Pick, per category, the lowest confidence at which precision meets the target"""
+        predicted_idx = np.argmax(probabilities, axis=1)
+        confidences = probabilities[np.arange(len(predicted_idx)), predicted_idx]
+
+        thresholds = {}
+        for class_idx, label in enumerate(self.classes_):
+            mask = predicted_idx == class_idx
+            if mask.sum() < self.min_support:
+                thresholds[label] = NEVER_ANSWER
+                continue
+
+            order = np.argsort(-confidences[mask])
+            sorted_conf = confidences[mask][order]
+            sorted_correct = (y_true[mask][order] == label).astype(float)
+            precision_at_k = np.cumsum(sorted_correct) / np.arange(1, len(sorted_correct) + 1)
+
+            # Largest prefix (highest-confidence predictions) that still meets the target
+            ok = np.where(precision_at_k >= self.target_precision)[0]
+            ok = ok[ok + 1 >= self.min_support]
+            thresholds[label] = float(sorted_conf[ok[-1]]) if len(ok) else NEVER_ANSWER
+
+        return thresholds
+
+    def _evaluate(self, probabilities: np.ndarray, y_true: np.ndarray) -> Dict[str, Any]:
+        """Estimate escalation rate and accuracy of the emails the tier would answer"""
+        answered, labels = self._answer_mask(probabilities)
+        answered_count = int(answered.sum())
+        correct = int((labels[answered] == y_true[answered]).sum()) if answered_count else 0
+
+        return {
+            'validation_size': int(len(y_true)),
+            'answered': answered_count,
+            'escalation_rate': 1.0 - answered_count / max(len(y_true), 1),
+            'answered_accuracy': correct / max(answered_count, 1),
+            'thresholds': self.thresholds
+        }
+
+    def _answer_mask(self, probabilities: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return which rows clear their category threshold, and the predicted labels"""
+        predicted_idx = np.argmax(probabilities, axis=1)
+        confidences = probabilities[np.arange(len(predicted_idx)), predicted_idx]
+        threshold_by_idx = np.array([self.thresholds.get(label, NEVER_ANSWER) for label in self.classes_])
+        answered = confidences >= threshold_by_idx[predicted_idx]
+        return answered, np.asarray(self.classes_)[predicted_idx]
+
+    def decide(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Answer confident emails and defer the rest
+
+        Returns:
+            One entry per text: {'label', 'confidence', 'scores'} when answered, None to escalate
+        """
+        if not self.is_trained or not texts:
+            return [None] * len(texts)
+
+        probabilities = self.model.predict_proba(self.vectorizer.transform(texts))
+        answered, labels = self._answer_mask(probabilities)
+
+        decisions = []
+        for i in range(len(texts)):
+            if not answered[i]:
+                decisions.append(None)
+                continue
+            scores = {label: float(probabilities[i][j]) for j, label in enumerate(self.classes_)}
+            decisions.append({
+                'label': str(labels[i]),
+                'confidence': float(probabilities[i].max()),
+                'scores': scores
+            })
+        return decisions
+
+    def save(self, save_dir: str):
+        """Save the first tier to a directory"""
+        import joblib
+
+        os.makedirs(save_dir, exist_ok=True)
+        joblib.dump({
+            'model': self.model,
+            'classes': self.classes_,
+            'thresholds': self.thresholds,
+            'n_features': self.n_features,
+            'target_precision': self.target_precision,
+            'min_support': self.min_support,
+            'metrics': self.metrics,
+            'is_trained': self.is_trained
+        }, os.path.join(save_dir, "first_tier.joblib"))
+
+        with open(os.path.join(save_dir, "first_tier_metrics.json"), 'w') as f:
+            json.dump(self.metrics, f, indent=2)
+
+        logger.info(f"First tier saved to {save_dir}")
+
+    @classmethod
+    def load(cls, save_dir: str) -> 'LinearFirstTier':
+        """Load a first tier saved with save()"""
+        import joblib
+
+        data = joblib.load(os.path.join(save_dir, "first_tier.joblib"))
+        tier = cls(
+            n_features=data['n_features'],
+            target_precision=data['target_precision'],
+            min_support=data['min_support']
+        )
+        tier.model = data['model']
+        tier.classes_ = data['classes']
+        tier.thresholds = data['thresholds']
+        tier.metrics = data.get('metrics', {})
+        tier.is_trained = data['is_trained']
+
+        logger.info(f"First tier loaded from {save_dir} ({len(tier.classes_)} categories)")
+        return tier
+
+class CascadeStats:
+    """Thread-safe counters for first-tier answers vs. transformer escalations"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.answered = 0
+        self.per_category = {}
+
+    def record(self, answered_labels: List[Optional[str]]):
+        with self.lock:
+            for label in answered_labels:
+                self.total += 1
+                if label is not None:
+                    self.answered += 1
+                    self.per_category[label] = self.per_category.get(label, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            escalated = self.total - self.answered
+            return {
+                "total": self.total,
+                "answered_by_first_tier": self.answered,
+                "escalated_to_transformer": escalated,
+                "escalation_rate": escalated / self.total if self.total else 0.0,
+                "answered_per_category": dict(self.per_category)
+            }
+
+def main():
+    """Train the linear first tier"""
+    parser = argparse.ArgumentParser(description="Train the cascade's linear first tier")
+    parser.add_argument("--data_file", type=str, default="train_dataset.jsonl",
+                       help="Path to training dataset JSONL file")
+    parser.add_argument("--output_dir", type=str, default="cascade_models",
+                       help="Output directory for the first tier")
+    parser.add_argument("--target_precision", type=float, default=0.98,
+                       help="Per-category precision required before the tier answers")
+    parser.add_argument("--min_support", type=int, default=20,
+                       help="Minimum validation predictions per category to enable answering")
+    parser.add_argument("--validation_split", type=float, default=0.2,
+                       help="Validation split ratio")
+
+    args = parser.parse_args()
+
+    tier = LinearFirstTier(target_precision=args.target_precision, min_support=args.min_support)
+    metrics = tier.train_from_jsonl(args.data_file, validation_split=args.validation_split)
+    tier.save(args.output_dir)
+
+    logger.info(json.dumps(metrics, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Compiled Tree Inference for the Feature-Based Model
+Flattens a trained XGBoost booster into numpy arrays with the StandardScaler folded into the split thresholds
+"""
+
+import json
+import logging
+import threading
+import numpy as np
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Compiled probabilities must match predict_proba this closely or the compiled path is not used
+VERIFY_TOLERANCE = 1e-4
+
+class CompiledTreeEnsemble:
+    """
+    Array form of a gradient-boosted tree ensemble
+
+    Every node of every tree lives in flat arrays (feature, threshold, children,
+    default direction, leaf value). Leaves point to themselves, so all trees are
+    advanced one level per step with a handful of vectorized numpy operations.
+    Thresholds are moved into raw feature space, so no scaler runs at predict time.
+    """
+
+    def __init__(self, feature, threshold, left, right, default_left, value, roots, tree_class,
+                 num_classes: int, max_depth: int, bias: np.ndarray, binary: bool):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.tree_class = tree_class
+        self.num_classes = num_classes
+        self.max_depth = max_depth
+        self.bias = bias
+        self.binary = binary
+        self.num_trees = len(roots)
+        self.children = np.stack([left, right], axis=1).reshape(-1)
+        self._local = threading.local()
+
+    @classmethod
+    def from_xgboost(cls, model, scaler=None) -> 'CompiledTreeEnsemble':
+        """
+        Compile a fitted XGBClassifier (and the StandardScaler feeding it)
+
+        Args:
+            model: Fitted xgboost.XGBClassifier with a gbtree booster
+            scaler: Fitted StandardScaler whose transform precedes the model, or None
+        """
+        booster = model.get_booster()
+        learner = json.loads(booster.save_raw('json'))['learner']
+        gbm = learner['gradient_booster']
+        if gbm.get('name') != 'gbtree':
+            raise ValueError(f"Only gbtree boosters can be compiled, got {gbm.get('name')}")
+
+        trees = gbm['model']['trees']
+        tree_info = gbm['model']['tree_info']
+        objective = learner['objective']['name']
+        binary = objective.startswith('binary:')
+        num_classes = 1 if binary else int(learner['learner_model_param']['num_class'])
+
+        features, thresholds, lefts, rights, defaults, values, roots = [], [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for tree in trees:
+            left = np.asarray(tree['left_children'], dtype=np.int64)
+            right = np.asarray(tree['right_children'], dtype=np.int64)
+            split = np.asarray(tree['split_indices'], dtype=np.int64)
+            cond = np.asarray(tree['split_conditions'], dtype=np.float32)
+            if any(tree.get('split_type', [])):
+                raise ValueError("Categorical splits cannot be compiled")
+
+            is_leaf = left == -1
+            node_ids = np.arange(len(left))
+
+            features.append(np.where(is_leaf, 0, split))
+            thresholds.append(np.where(is_leaf, np.float32(0), cond))
+            lefts.append(np.where(is_leaf, node_ids, left) + offset)
+            rights.append(np.where(is_leaf, node_ids, right) + offset)
+            defaults.append(np.asarray(tree['default_left'], dtype=bool))
+            values.append(np.where(is_leaf, cond.astype(np.float64), 0.0))
+            roots.append(offset)
+            max_depth = max(max_depth, _tree_depth(left, right))
+            offset += len(left)
+
+        feature = np.concatenate(features)
+        threshold = np.concatenate(thresholds)
+        if scaler is not None:
+            inner = np.concatenate(lefts) != np.arange(offset)
+            threshold[inner] = _fold_scaler(scaler, feature[inner], threshold[inner])
+
+        compiled = cls(
+            feature=feature,
+            threshold=threshold,
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            default_left=np.concatenate(defaults),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int64),
+            tree_class=np.asarray(tree_info, dtype=np.int64),
+            num_classes=num_classes,
+            max_depth=max_depth,
+            bias=np.zeros(num_classes),
+            binary=binary
+        )
+        compiled.bias = compiled._calibrate_bias(booster, scaler)
+        return compiled
+
+    def _calibrate_bias(self, booster, scaler) -> np.ndarray:
+        """Base margin per class, read back from the booster instead of parsing base_score"""
+        import xgboost as xgb
+
+        probe = np.zeros((1, int(booster.num_features())), dtype=np.float32)
+        scaled = scaler.transform(probe) if scaler is not None else probe
+        margin = booster.predict(xgb.DMatrix(scaled), output_margin=True).reshape(-1)
+        return margin.astype(np.float64) - self._leaf_sums(probe)[0]
+
+    def _leaf_sums(self, X: np.ndarray) -> np.ndarray:
+        """(n_rows, num_classes) sum of leaf values, before bias and link function"""
+        X = np.asarray(X, dtype=np.float32)
+        n = len(X)
+        rows = np.arange(n)[:, None]
+        node = np.broadcast_to(self.roots, (n, self.num_trees)).copy()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        sums = np.zeros((n, self.num_classes))
+        np.add.at(sums, (rows, self.tree_class[None, :]), self.value[node])
+        return sums
+
+    def _scratch(self):
+        """Per-thread buffers for single-row prediction"""
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = {
+                'node': np.empty(self.num_trees, dtype=np.int64),
+                'child': np.empty(self.num_trees, dtype=np.int64),
+                'feature': np.empty(self.num_trees, dtype=np.int64),
+                'x': np.empty(self.num_trees, dtype=np.float32),
+                'threshold': np.empty(self.num_trees, dtype=np.float32),
+                'go_right': np.empty(self.num_trees, dtype=bool),
+                'leaf': np.empty(self.num_trees, dtype=np.float64),
+                'row': np.empty(self.feature.max() + 1, dtype=np.float32)
+            }
+            self._local.scratch = scratch
+        return scratch
+
+    def _link(self, margin: np.ndarray) -> np.ndarray:
+        """Margins -> class probabilities, shaped like XGBClassifier.predict_proba"""
+        if self.binary:
+            positive = 1.0 / (1.0 + np.exp(-margin[..., 0]))
+            return np.stack([1.0 - positive, positive], axis=-1)
+        shifted = np.exp(margin - margin.max(axis=-1, keepdims=True))
+        return shifted / shifted.sum(axis=-1, keepdims=True)
+
+    def predict_proba_row(self, x: np.ndarray) -> np.ndarray:
+        """Probabilities for one raw (unscaled) feature vector, reusing per-thread buffers"""
+        x = np.asarray(x).reshape(-1)
+        if np.isnan(x).any():
+            # Missing values need the per-node default direction; take the general path
+            return self._link(self._leaf_sums(x[None, :])[0] + self.bias)
+
+        s = self._scratch()
+        row, node, child = s['row'], s['node'], s['child']
+        row[:] = x[:len(row)]
+        node[:] = self.roots
+        for _ in range(self.max_depth):
+            np.take(self.feature, node, out=s['feature'], mode='clip')
+            np.take(row, s['feature'], out=s['x'], mode='clip')
+            np.take(self.threshold, node, out=s['threshold'], mode='clip')
+            np.greater_equal(s['x'], s['threshold'], out=s['go_right'])
+            # children holds (left, right) pairs: index 2 * node + go_right
+            np.multiply(node, 2, out=child)
+            np.add(child, s['go_right'], out=child)
+            np.take(self.children, child, out=node, mode='clip')
+
+        np.take(self.value, node, out=s['leaf'], mode='clip')
+        margin = np.bincount(self.tree_class, weights=s['leaf'], minlength=self.num_classes) + self.bias
+        return self._link(margin)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probabilities for a (n_rows, n_features) matrix of raw feature vectors"""
+        X = np.asarray(X)
+        if X.ndim == 1 or len(X) == 1:
+            return self.predict_proba_row(X.reshape(-1))[None, :]
+        return self._link(self._leaf_sums(X) + self.bias)
+
+def _fold_scaler(scaler, feature: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+    """
+    Move split thresholds from scaled space into raw feature space
+
+    For every split this finds the smallest float32 raw value T with
+    scaler.transform(T) >= t, so raw x < T exactly when scaled x < t. The
+    transform is monotone but many raw floats round to the same scaled one,
+    and XGBoost places thresholds exactly on histogram cuts, so T is found
+    by bisection over the ordered float32 bit patterns rather than by
+    inverting the scaling in float64.
+    """
+    num_features = len(scaler.mean_)
+    rows = np.arange(len(feature))
+    probe = np.zeros((len(feature), num_features), dtype=np.float32)
+
+    def transformed(values):
+        probe[rows, feature] = values
+        return scaler.transform(probe)[rows, feature]
+
+    # Invariant: transform(lo) < t <= transform(hi)
+    lo = np.full(len(feature), _ordered_key(np.float32(-np.inf)), dtype=np.int64)
+    hi = np.full(len(feature), _ordered_key(np.float32(np.inf)), dtype=np.int64)
+    while (hi - lo > 1).any():
+        mid = (lo + hi) // 2
+        reaches = transformed(_from_ordered_key(mid)) >= threshold
+        hi = np.where(reaches, mid, hi)
+        lo = np.where(reaches, lo, mid)
+    return _from_ordered_key(hi)
+
+def _ordered_key(values) -> np.ndarray:
+    """float32 -> int64 keys that sort the same way as the floats"""
+    bits = np.asarray(values, dtype=np.float32).view(np.int32).astype(np.int64)
+    return np.where(bits < 0, -(bits & 0x7FFFFFFF) - 1, bits)
+
+def _from_ordered_key(keys: np.ndarray) -> np.ndarray:
+    """Inverse of _ordered_key"""
+    bits = np.where(keys < 0, (-(keys + 1)) | -0x80000000, keys)
+    return bits.astype(np.int32).view(np.float32)
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    """Number of splits on the longest root-to-leaf path"""
+    depth = 0
+    frontier = [0]
+    while True:
+        children = [c for n in frontier for c in (left[n], right[n]) if c != -1]
+        if not children:
+            return depth
+        depth += 1
+        frontier = children
+
+def compile_feature_model(model, scaler, probe: Optional[np.ndarray] = None) -> Optional[CompiledTreeEnsemble]:
+    """
+    Compile an XGBoost feature model and check it against the reference predict_proba
+
+    Args:
+        model: Fitted classifier; anything but XGBClassifier is left alone
+        scaler: Fitted StandardScaler in front of the model
+        probe: Raw feature rows to verify on (random rows around the scaler mean if None)
+
+    Returns:
+        CompiledTreeEnsemble, or None if the model cannot be compiled or disagrees with predict_proba
+    """
+    try:
+        import xgboost as xgb
+        if not isinstance(model, xgb.XGBClassifier):
+            return None
+
+        compiled = CompiledTreeEnsemble.from_xgboost(model, scaler)
+
+        if probe is None:
+            rng = np.random.RandomState(0)
+            probe = (scaler.mean_ + rng.randn(64, len(scaler.mean_)) * scaler.scale_).astype(np.float32)
+        probe = np.asarray(probe, dtype=np.float32)
+
+        expected = model.predict_proba(scaler.transform(probe))
+        batch_error = np.abs(compiled.predict_proba(probe) - expected).max()
+        row_error = np.abs(compiled.predict_proba_row(probe[0]) - expected[0]).max()
+        if max(batch_error, row_error) > VERIFY_TOLERANCE:
+            logger.warning(f"Compiled trees disagree with predict_proba (max error {max(batch_error, row_error):.2e}); not using them")
+            return None
+
+        logger.info(f"Compiled {compiled.num_trees} trees ({len(compiled.feature)} nodes, depth {compiled.max_depth})")
+        return compiled
+
+    except Exception as e:
+        logger.warning(f"Could not compile feature model: {e}")
+        return None
@@ -10,7 +10,8 @@ from datetime import datetime, timedelta
 import pandas as pd
 from pathlib import Path
 
-from feature_extractor import EmailFeatureExtractor, normalize_features
+from feature_extractor import EmailFeatureExtractor
+from feature_schema import FEATURE_SCHEMA
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -127,11 +128,9 @@ class TrainingDataCollector:
         for i, sample in enumerate(training_samples):
             try:
                 features = sample.get('features', {})
-                normalized_features = normalize_features(features)
                 
-                # Convert to array in consistent order
-                feature_vector = self._features_to_vector(normalized_features)
-                X.append(feature_vector)
+                # Convert to array in the shared schema order
+                X.append(FEATURE_SCHEMA.vectorize(features).tolist())
                 y.append(sample['trueLabel'])
                 sample_ids.append(i)
                 
@@ -147,32 +146,6 @@ class TrainingDataCollector:
         
         return X, y
     
-    def _features_to_vector(self, features: Dict[str, Any]) -> List[float]:
-        """Convert feature dictionary to ordered vector"""
-        # This should match the feature order in ensemble_classifier.py
-        expected_features = [
-            'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
-            'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
-            'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
-            'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
-            'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
-            'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
-            'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
-            'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
-            'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
-            'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
-            'subject_question_count', 'subject_number_count', 'body_paragraph_count',
-            'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
-            'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header',
-            'sender_domain_hash', 'sender_tld_hash'
-        ]
-        
-        feature_vector = []
-        for feature_name in expected_features:
-            feature_vector.append(features.get(feature_name, 0.0))
-        
-        return feature_vector
-    
     def export_training_data(
         self, 
         training_samples: List[Dict[str, Any]], 
@@ -331,6 +331,17 @@ class DatabaseManager:
         finally:
             session.close()
     
+    def get_model_version(self, version: str):
+        """Get a model version by its version string"""
+        session = self.get_session()
+        try:
+            model_version = session.query(ModelVersion).filter(ModelVersion.version == version).first()
+            return model_version.to_dict() if model_version else None
+        except Exception as e:
+            return None
+        finally:
+            session.close()
+    
     def save_performance_metrics(self, metrics: dict):
         """Save performance metrics"""
         session = self.get_session()
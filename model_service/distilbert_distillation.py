@@ -0,0 +1,445 @@
+"""
+Knowledge Distillation for DistilBERT Email Classification
+Trains a compact student model from a fine-tuned teacher for CPU serving
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers import (
+    DistilBertForSequenceClassification,
+    DistilBertConfig,
+    TrainingArguments,
+    Trainer
+)
+import numpy as np
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+import logging
+import json
+import os
+import time
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+import argparse
+
+from distilbert_trainer import DistilBERTTrainer, EmailDataset
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DistillationDataset(EmailDataset):
+    """EmailDataset that also yields the teacher's logits for each example"""
+
+    def __init__(self, texts: List[str], labels: List[int], teacher_logits: np.ndarray, tokenizer, max_length: int = 128):
+        super().__init__(texts, labels, tokenizer, max_length)
+        self.teacher_logits = teacher_logits
+
+    def __getitem__(self, idx):
+        item = super().__getitem__(idx)
+        item['teacher_logits'] = torch.tensor(self.teacher_logits[idx], dtype=torch.float)
+        return item
+
+class DistillationTrainer(Trainer):
+    """HF Trainer that mixes soft teacher targets with the hard-label loss"""
+
+    def __init__(self, *args, temperature: float = 2.0, alpha: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        teacher_logits = inputs.pop('teacher_logits', None)
+        outputs = model(**inputs)
+        hard_loss = outputs.loss
+
+        if teacher_logits is None:
+            # Evaluation batches carry no teacher targets
+            loss = hard_loss
+        else:
+            t = self.temperature
+            soft_loss = F.kl_div(
+                F.log_softmax(outputs.logits / t, dim=-1),
+                F.softmax(teacher_logits / t, dim=-1),
+                reduction='batchmean'
+            ) * (t * t)
+            loss = self.alpha * soft_loss + (1.0 - self.alpha) * hard_loss
+
+        return (loss, outputs) if return_outputs else loss
+
+class DistilBERTDistiller(DistilBERTTrainer):
+    """Distill a fine-tuned DistilBERT teacher into a smaller student"""
+
+    def __init__(
+        self,
+        teacher_path: str,
+        student_layers: int = 3,
+        student_dim: Optional[int] = None,
+        student_heads: Optional[int] = None,
+        max_length: int = 128,
+        output_dir: str = "distilbert_student"
+    ):
+        super().__init__(model_name=teacher_path, max_length=max_length, output_dir=output_dir)
+        self.teacher_path = teacher_path
+        self.student_layers = student_layers
+        self.student_dim = student_dim
+        self.student_heads = student_heads
+
+        self.teacher_model = None
+        self.teacher_tokenizer = None
+        self.teacher_max_length = 256
+
+    def load_teacher(self):
+        """Load the fine-tuned teacher and reuse its label mappings"""
+        logger.info(f"Loading teacher model from {self.teacher_path}")
+
+        self.load_trained_model(self.teacher_path)
+        self.teacher_model = self.model
+        self.teacher_tokenizer = self.tokenizer
+        self.teacher_max_length = min(
+            getattr(self.teacher_tokenizer, 'model_max_length', 512) or 512,
+            self.teacher_model.config.max_position_embeddings
+        )
+
+        # Student must predict over the same label space as the teacher
+        if not self.label2id:
+            self.id2label = {int(k): v for k, v in self.teacher_model.config.id2label.items()}
+            self.label2id = {v: k for k, v in self.id2label.items()}
+
+        self.model = None
+        logger.info(f"Teacher loaded: {self.teacher_model.config.n_layers} layers, dim {self.teacher_model.config.dim}")
+
+    def build_student(self) -> DistilBertForSequenceClassification:
+        """Create the student, copying teacher weights where shapes allow"""
+        if self.teacher_model is None:
+            self.load_teacher()
+
+        teacher_config = self.teacher_model.config
+        dim = self.student_dim or teacher_config.dim
+        n_heads = self.student_heads or (teacher_config.n_heads if dim == teacher_config.dim else max(1, dim // 64))
+        if dim % n_heads != 0:
+            raise ValueError(f"Student dim {dim} must be divisible by number of heads {n_heads}")
+
+        student_config = DistilBertConfig(
+            vocab_size=teacher_config.vocab_size,
+            max_position_embeddings=teacher_config.max_position_embeddings,
+            n_layers=self.student_layers,
+            n_heads=n_heads,
+            dim=dim,
+            hidden_dim=4 * dim,
+            dropout=teacher_config.dropout,
+            attention_dropout=teacher_config.attention_dropout,
+            seq_classif_dropout=teacher_config.seq_classif_dropout,
+            num_labels=len(self.label2id),
+            id2label=self.id2label,
+            label2id=self.label2id
+        )
+        student = DistilBertForSequenceClassification(student_config)
+
+        if dim == teacher_config.dim and n_heads == teacher_config.n_heads:
+            # Same width: start from evenly spaced teacher layers
+            layer_map = np.linspace(0, teacher_config.n_layers - 1, self.student_layers).round().astype(int).tolist()
+            student.distilbert.embeddings.load_state_dict(self.teacher_model.distilbert.embeddings.state_dict())
+            for student_idx, teacher_idx in enumerate(layer_map):
+                student.distilbert.transformer.layer[student_idx].load_state_dict(
+                    self.teacher_model.distilbert.transformer.layer[teacher_idx].state_dict()
+                )
+            student.pre_classifier.load_state_dict(self.teacher_model.pre_classifier.state_dict())
+            student.classifier.load_state_dict(self.teacher_model.classifier.state_dict())
+            logger.info(f"Student initialized from teacher layers {layer_map}")
+        else:
+            logger.warning(
+                f"Student dim {dim} differs from teacher dim {teacher_config.dim}; "
+                "student starts from random weights and may need more epochs"
+            )
+
+        logger.info(f"Student parameters: {count_parameters(student):,} (teacher: {count_parameters(self.teacher_model):,})")
+        return student
+
+    def compute_teacher_logits(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Run the teacher once over all texts and keep its logits"""
+        if self.teacher_model is None:
+            self.load_teacher()
+
+        logger.info(f"Computing teacher logits for {len(texts)} examples")
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.teacher_model.to(device)
+        self.teacher_model.eval()
+
+        all_logits = []
+        with torch.no_grad():
+            for i in range(0, len(texts), batch_size):
+                encodings = self.teacher_tokenizer(
+                    texts[i:i + batch_size],
+                    truncation=True,
+                    padding=True,
+                    max_length=self.teacher_max_length,
+                    return_tensors="pt"
+                )
+                encodings = {k: v.to(device) for k, v in encodings.items()}
+                all_logits.append(self.teacher_model(**encodings).logits.cpu().numpy())
+
+        return np.concatenate(all_logits, axis=0)
+
+    def distill(
+        self,
+        texts: List[str],
+        labels: List[int],
+        validation_split: float = 0.2,
+        train_batch_size: int = 32,
+        eval_batch_size: int = 64,
+        num_epochs: int = 4,
+        learning_rate: float = 5e-5,
+        temperature: float = 2.0,
+        alpha: float = 0.5
+    ) -> Dict[str, Any]:
+        """
+        Train the student on teacher logits and hard labels
+
+        Args:
+            texts: List of training texts
+            labels: List of corresponding label ids (teacher label space)
+            validation_split: Fraction of data to use for validation
+            train_batch_size: Training batch size
+            eval_batch_size: Evaluation batch size
+            num_epochs: Number of training epochs
+            learning_rate: Learning rate
+            temperature: Softmax temperature for the soft targets
+            alpha: Weight of the distillation loss vs. the hard-label loss
+
+        Returns:
+            Distillation results, including the teacher/student benchmark
+        """
+        if self.teacher_model is None:
+            self.load_teacher()
+
+        split_idx = int(len(texts) * (1 - validation_split))
+        train_texts, train_labels = texts[:split_idx], labels[:split_idx]
+        val_texts, val_labels = texts[split_idx:], labels[split_idx:]
+        logger.info(f"Distillation set: {len(train_texts)} train, {len(val_texts)} validation")
+
+        teacher_logits = self.compute_teacher_logits(train_texts, batch_size=eval_batch_size)
+
+        self.model = self.build_student()
+        self.tokenizer = self.teacher_tokenizer
+
+        train_dataset = DistillationDataset(train_texts, train_labels, teacher_logits, self.tokenizer, self.max_length)
+        val_dataset = EmailDataset(val_texts, val_labels, self.tokenizer, self.max_length)
+
+        training_args = TrainingArguments(
+            output_dir=self.output_dir,
+            num_train_epochs=num_epochs,
+            per_device_train_batch_size=train_batch_size,
+            per_device_eval_batch_size=eval_batch_size,
+            warmup_ratio=0.1,
+            weight_decay=0.01,
+            learning_rate=learning_rate,
+            logging_dir=f"{self.output_dir}/logs",
+            logging_steps=100,
+            evaluation_strategy="epoch",
+            save_strategy="epoch",
+            save_total_limit=2,
+            load_best_model_at_end=True,
+            metric_for_best_model="f1",
+            greater_is_better=True,
+            report_to=None,
+            seed=42,
+        )
+
+        trainer = DistillationTrainer(
+            model=self.model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=val_dataset,
+            compute_metrics=self.compute_metrics,
+            temperature=temperature,
+            alpha=alpha
+        )
+
+        logger.info("Starting distillation...")
+        train_result = trainer.train()
+        eval_result = trainer.evaluate()
+
+        # Same layout as DistilBERTTrainer.train_model so load_model_from_path can use it;
+        # the tokenizer records the student's shorter max_length for serving
+        trainer.save_model()
+        self.tokenizer.model_max_length = self.max_length
+        self.tokenizer.save_pretrained(self.output_dir)
+        with open(os.path.join(self.output_dir, "label_mappings.json"), "w") as f:
+            json.dump({
+                "label2id": self.label2id,
+                "id2label": self.id2label
+            }, f, indent=2)
+
+        comparison = self.compare_with_teacher(val_texts, val_labels)
+
+        results = {
+            "training_loss": train_result.training_loss,
+            "eval_results": eval_result,
+            "model_path": self.output_dir,
+            "teacher_path": self.teacher_path,
+            "comparison": comparison,
+            "label_mappings": {
+                "label2id": self.label2id,
+                "id2label": self.id2label
+            },
+            "distillation_config": {
+                "student_layers": self.student_layers,
+                "student_dim": self.model.config.dim,
+                "student_heads": self.model.config.n_heads,
+                "max_length": self.max_length,
+                "teacher_max_length": self.teacher_max_length,
+                "temperature": temperature,
+                "alpha": alpha,
+                "num_epochs": num_epochs,
+                "learning_rate": learning_rate,
+                "batch_size": train_batch_size
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+
+        with open(os.path.join(self.output_dir, "distillation_report.json"), "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+        logger.info(f"Distillation completed! Student accuracy {comparison['student']['accuracy']:.4f} "
+                    f"vs teacher {comparison['teacher']['accuracy']:.4f}, "
+                    f"speedup {comparison['speedup']:.2f}x")
+
+        return results
+
+    def compare_with_teacher(self, texts: List[str], labels: List[int], batch_size: int = 32) -> Dict[str, Any]:
+        """Report accuracy and CPU latency of teacher vs. student on the same texts"""
+        teacher_stats = benchmark_model(self.teacher_model, self.teacher_tokenizer, texts, labels,
+                                        self.teacher_max_length, batch_size)
+        student_stats = benchmark_model(self.model, self.tokenizer, texts, labels,
+                                        self.max_length, batch_size)
+
+        return {
+            "teacher": teacher_stats,
+            "student": student_stats,
+            "accuracy_delta": student_stats["accuracy"] - teacher_stats["accuracy"],
+            "speedup": teacher_stats["ms_per_email"] / max(student_stats["ms_per_email"], 1e-9)
+        }
+
+def count_parameters(model: nn.Module) -> int:
+    """Count model parameters"""
+    return sum(p.numel() for p in model.parameters())
+
+def benchmark_model(model, tokenizer, texts: List[str], labels: List[int], max_length: int,
+                    batch_size: int = 32) -> Dict[str, Any]:
+    """Measure accuracy and CPU inference latency for a sequence classifier"""
+    device = torch.device("cpu")
+    model.to(device)
+    model.eval()
+
+    predictions = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            encodings = tokenizer(
+                texts[i:i + batch_size],
+                truncation=True,
+                padding=True,
+                max_length=max_length,
+                return_tensors="pt"
+            )
+            logits = model(**encodings).logits
+            predictions.extend(torch.argmax(logits, dim=-1).tolist())
+    elapsed = time.perf_counter() - start
+
+    accuracy = accuracy_score(labels, predictions) if labels else 0.0
+    _, _, f1, _ = precision_recall_fscore_support(labels, predictions, average='weighted', zero_division=0)
+
+    return {
+        "accuracy": float(accuracy),
+        "f1": float(f1),
+        "parameters": count_parameters(model),
+        "layers": getattr(model.config, "n_layers", None),
+        "max_length": max_length,
+        "ms_per_email": (elapsed * 1000.0) / max(len(texts), 1),
+        "emails_per_second": len(texts) / max(elapsed, 1e-9)
+    }
+
+def main():
+    """Main distillation function"""
+    parser = argparse.ArgumentParser(description="Distill a fine-tuned DistilBERT into a compact student")
+    parser.add_argument("--teacher_path", type=str, default="distilbert_models",
+                       help="Directory of the fine-tuned teacher model")
+    parser.add_argument("--data_file", type=str, default="train_dataset.jsonl",
+                       help="Path to training dataset JSONL file")
+    parser.add_argument("--output_dir", type=str, default="distilbert_student",
+                       help="Output directory for the student model")
+    parser.add_argument("--student_layers", type=int, default=3,
+                       help="Number of transformer layers in the student")
+    parser.add_argument("--student_dim", type=int, default=None,
+                       help="Hidden size of the student (defaults to the teacher's)")
+    parser.add_argument("--student_heads", type=int, default=None,
+                       help="Attention heads in the student")
+    parser.add_argument("--max_length", type=int, default=128,
+                       help="Maximum token sequence length for the student")
+    parser.add_argument("--num_epochs", type=int, default=4,
+                       help="Number of training epochs")
+    parser.add_argument("--batch_size", type=int, default=32,
+                       help="Training batch size")
+    parser.add_argument("--learning_rate", type=float, default=5e-5,
+                       help="Learning rate")
+    parser.add_argument("--temperature", type=float, default=2.0,
+                       help="Distillation temperature")
+    parser.add_argument("--alpha", type=float, default=0.5,
+                       help="Weight of the distillation loss")
+    parser.add_argument("--validation_split", type=float, default=0.2,
+                       help="Validation split ratio")
+
+    args = parser.parse_args()
+
+    distiller = DistilBERTDistiller(
+        teacher_path=args.teacher_path,
+        student_layers=args.student_layers,
+        student_dim=args.student_dim,
+        student_heads=args.student_heads,
+        max_length=args.max_length,
+        output_dir=args.output_dir
+    )
+
+    try:
+        distiller.load_teacher()
+
+        # Keep the teacher's label ids so the teacher logits line up
+        teacher_label2id = dict(distiller.label2id)
+        texts, labels, _ = distiller.load_and_preprocess_dataset(args.data_file)
+        dataset_id2label = dict(distiller.id2label)
+        distiller.label2id = teacher_label2id
+        distiller.id2label = {idx: label for label, idx in teacher_label2id.items()}
+
+        remapped_texts, remapped_labels = [], []
+        for text, label_id in zip(texts, labels):
+            label_name = dataset_id2label[label_id]
+            if label_name in teacher_label2id:
+                remapped_texts.append(text)
+                remapped_labels.append(teacher_label2id[label_name])
+
+        if not remapped_texts:
+            logger.error("No training examples share labels with the teacher!")
+            return
+
+        results = distiller.distill(
+            texts=remapped_texts,
+            labels=remapped_labels,
+            validation_split=args.validation_split,
+            train_batch_size=args.batch_size,
+            num_epochs=args.num_epochs,
+            learning_rate=args.learning_rate,
+            temperature=args.temperature,
+            alpha=args.alpha
+        )
+
+        logger.info(f"Distillation completed! Report saved to "
+                    f"{os.path.join(args.output_dir, 'distillation_report.json')}")
+        logger.info(json.dumps(results["comparison"], indent=2))
+
+    except Exception as e:
+        logger.error(f"Distillation failed: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,9 @@ import os
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import argparse
+import time
+
+from label_compatibility import load_label_mappings, extend_label_mapping, compare_mappings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -82,12 +85,17 @@ class DistilBERTTrainer:
         self.label2id = {}
         self.id2label = {}
         
-    def load_and_preprocess_dataset(self, data_file: str) -> Tuple[List[str], List[int], Dict[str, int]]:
+    def load_and_preprocess_dataset(
+        self,
+        data_file: str,
+        base_label2id: Optional[Dict[str, int]] = None
+    ) -> Tuple[List[str], List[int], Dict[str, int]]:
         """
         Load dataset from JSONL file and preprocess it
         
         Args:
             data_file: Path to JSONL file
+            base_label2id: Existing mapping to keep; unseen labels are appended after it
             
         Returns:
             Tuple of (texts, labels, label_mapping)
@@ -113,7 +121,10 @@ class DistilBERTTrainer:
                 unique_labels.add(example['label'])
         
         # Create label mapping
-        self.label2id = {label: idx for idx, label in enumerate(sorted(unique_labels))}
+        if base_label2id is not None:
+            self.label2id = extend_label_mapping(base_label2id, unique_labels)
+        else:
+            self.label2id = {label: idx for idx, label in enumerate(sorted(unique_labels))}
         self.id2label = {idx: label for label, idx in self.label2id.items()}
         
         logger.info(f"Found {len(unique_labels)} unique labels: {list(unique_labels)}")
@@ -206,7 +217,11 @@ class DistilBERTTrainer:
         eval_batch_size: int = 32,
         num_epochs: int = 3,
         learning_rate: float = 2e-5,
-        warmup_steps: int = 500
+        warmup_steps: int = 500,
+        ddp_backend: Optional[str] = None,
+        use_cpu: bool = False,
+        max_steps: int = -1,
+        callbacks: Optional[List[Any]] = None
     ) -> Dict[str, Any]:
         """
         Train the DistilBERT model
@@ -220,6 +235,11 @@ class DistilBERTTrainer:
             num_epochs: Number of training epochs
             learning_rate: Learning rate
             warmup_steps: Number of warmup steps
+            ddp_backend: torch.distributed backend when launched as one of several
+                workers (see distributed_training.py), e.g. "gloo" for CPU nodes
+            use_cpu: Train on CPU even if CUDA is available
+            max_steps: Stop after this many optimizer steps (-1 trains for num_epochs)
+            callbacks: Extra transformers TrainerCallbacks (e.g. job progress reporting)
             
         Returns:
             Training results and metrics
@@ -258,6 +278,11 @@ class DistilBERTTrainer:
             greater_is_better=True,
             report_to=None,  # Disable wandb/tensorboard
             seed=42,
+            max_steps=max_steps,
+            use_cpu=use_cpu,
+            # Picks up RANK/WORLD_SIZE/LOCAL_RANK from the launcher; the Trainer
+            # shards batches with a DistributedSampler and all-reduces gradients
+            ddp_backend=ddp_backend,
         )
         
         # Initialize trainer
@@ -267,6 +292,7 @@ class DistilBERTTrainer:
             train_dataset=train_dataset,
             eval_dataset=val_dataset,
             compute_metrics=self.compute_metrics,
+            callbacks=callbacks,
         )
         
         # Train the model
@@ -276,21 +302,31 @@ class DistilBERTTrainer:
         # Evaluate
         eval_result = trainer.evaluate()
         
-        # Save the model
+        # Save the model (Trainer only writes from the main process)
         trainer.save_model()
-        self.tokenizer.save_pretrained(self.output_dir)
         
-        # Save label mappings
-        with open(os.path.join(self.output_dir, "label_mappings.json"), "w") as f:
-            json.dump({
-                "label2id": self.label2id,
-                "id2label": self.id2label
-            }, f, indent=2)
+        # In distributed mode only rank 0 writes, so there is exactly one checkpoint
+        if trainer.is_world_process_zero():
+            self.tokenizer.save_pretrained(self.output_dir)
+            
+            # Save label mappings
+            with open(os.path.join(self.output_dir, "label_mappings.json"), "w") as f:
+                json.dump({
+                    "label2id": self.label2id,
+                    "id2label": self.id2label
+                }, f, indent=2)
         
         # Prepare results
         results = {
             "training_loss": train_result.training_loss,
             "eval_results": eval_result,
+            "throughput": {
+                "world_size": training_args.world_size,
+                "train_runtime": train_result.metrics.get("train_runtime"),
+                "train_samples_per_second": train_result.metrics.get("train_samples_per_second"),
+                "train_steps_per_second": train_result.metrics.get("train_steps_per_second")
+            },
+            "is_main_process": trainer.is_world_process_zero(),
             "model_path": self.output_dir,
             "label_mappings": {
                 "label2id": self.label2id,
@@ -313,6 +349,320 @@ class DistilBERTTrainer:
         
         return results
     
+    def initialize_from_checkpoint(self, model_dir: str):
+        """Load a fine-tuned model and widen its head for labels appended to self.label2id"""
+        logger.info(f"Initializing from checkpoint {model_dir}")
+        
+        self.tokenizer = DistilBertTokenizerFast.from_pretrained(model_dir)
+        self.model = DistilBertForSequenceClassification.from_pretrained(model_dir)
+        
+        old_num_labels = self.model.config.num_labels
+        num_labels = len(self.label2id)
+        if num_labels < old_num_labels:
+            raise ValueError(f"Label mapping has {num_labels} labels but the checkpoint head has {old_num_labels}")
+        
+        if num_labels > old_num_labels:
+            # Existing rows are copied so old labels keep their ids and weights
+            old_head = self.model.classifier
+            new_head = nn.Linear(old_head.in_features, num_labels)
+            with torch.no_grad():
+                new_head.weight[:old_num_labels] = old_head.weight
+                new_head.bias[:old_num_labels] = old_head.bias
+            self.model.classifier = new_head
+            self.model.num_labels = num_labels
+            logger.info(f"Classifier head widened from {old_num_labels} to {num_labels} labels")
+        
+        # num_labels must be set before id2label, as setting it resets the names
+        self.model.config.num_labels = num_labels
+        self.model.config.id2label = dict(self.id2label)
+        self.model.config.label2id = dict(self.label2id)
+    
+    def _sample_replay(
+        self,
+        texts: List[str],
+        labels: List[int],
+        num_samples: int,
+        min_per_label: int = 5,
+        seed: int = 42
+    ) -> Tuple[List[str], List[int]]:
+        """Stratified sample of older data so every known label stays represented"""
+        if num_samples >= len(texts):
+            return list(texts), list(labels)
+        
+        rng = np.random.default_rng(seed)
+        labels_array = np.asarray(labels)
+        selected = []
+        for label in np.unique(labels_array):
+            indices = np.where(labels_array == label)[0]
+            quota = max(min_per_label, int(round(num_samples * len(indices) / len(labels_array))))
+            selected.extend(rng.choice(indices, size=min(quota, len(indices)), replace=False).tolist())
+        
+        return [texts[i] for i in selected], [labels[i] for i in selected]
+    
+    def continue_training(
+        self,
+        base_model_dir: str,
+        new_data_file: str,
+        replay_data_file: Optional[str] = None,
+        replay_ratio: float = 1.0,
+        validation_split: float = 0.1,
+        train_batch_size: int = 16,
+        num_epochs: int = 1,
+        learning_rate: float = 1e-5,
+        seed: int = 42
+    ) -> Dict[str, Any]:
+        """
+        Fine-tune the deployed model on new samples mixed with a replay buffer
+        
+        Args:
+            base_model_dir: Directory of the currently deployed model
+            new_data_file: JSONL file with the newly corrected emails
+            replay_data_file: JSONL file of older training data to replay from
+            replay_ratio: Replay examples per new example
+            validation_split: Fraction of the mixed data used for validation
+            train_batch_size: Training batch size
+            num_epochs: Number of training epochs
+            learning_rate: Learning rate (lower than a from-scratch run)
+            seed: Seed for replay sampling and shuffling
+            
+        Returns:
+            Training results with a label compatibility report
+        """
+        start_time = time.time()
+        
+        base_mappings = load_label_mappings(base_model_dir)
+        if base_mappings is None:
+            raise ValueError(f"{base_model_dir} has no label_mappings.json; cannot keep label ids stable")
+        base_label2id = base_mappings["label2id"]
+        
+        new_texts, new_labels, _ = self.load_and_preprocess_dataset(new_data_file, base_label2id=base_label2id)
+        
+        replay_texts, replay_labels = [], []
+        if replay_data_file:
+            old_texts, old_labels, _ = self.load_and_preprocess_dataset(replay_data_file, base_label2id=self.label2id)
+            replay_texts, replay_labels = self._sample_replay(
+                old_texts, old_labels, int(len(new_texts) * replay_ratio), seed=seed
+            )
+        
+        logger.info(f"Continual training on {len(new_texts)} new + {len(replay_texts)} replay examples")
+        
+        self.initialize_from_checkpoint(base_model_dir)
+        
+        texts = new_texts + replay_texts
+        labels = new_labels + replay_labels
+        order = np.random.default_rng(seed).permutation(len(texts))
+        texts = [texts[i] for i in order]
+        labels = [labels[i] for i in order]
+        
+        results = self.train_model(
+            texts=texts,
+            labels=labels,
+            validation_split=validation_split,
+            train_batch_size=train_batch_size,
+            num_epochs=num_epochs,
+            learning_rate=learning_rate,
+            warmup_steps=0
+        )
+        
+        compatibility = compare_mappings(base_label2id, self.label2id)
+        compatibility["base_model_dir"] = base_model_dir
+        with open(os.path.join(self.output_dir, "label_compatibility.json"), "w") as f:
+            json.dump(compatibility, f, indent=2)
+        
+        if not compatibility["compatible"]:
+            logger.error(f"Label mapping changed incompatibly: {compatibility}")
+        elif compatibility["added_labels"]:
+            logger.info(f"Added labels {compatibility['added_labels']} without renumbering existing ones")
+        
+        results["continual"] = {
+            "base_model_dir": base_model_dir,
+            "new_examples": len(new_texts),
+            "replay_examples": len(replay_texts),
+            "elapsed_seconds": time.time() - start_time,
+            "label_compatibility": compatibility
+        }
+        return results
+    
+    def train_adapter(
+        self,
+        user_id: str,
+        texts: List[str],
+        labels: List[str],
+        base_model_dir: str,
+        adapters_dir: str = "user_adapters",
+        rank: int = 8,
+        alpha: float = 16.0,
+        num_epochs: int = 3,
+        learning_rate: float = 5e-4,
+        batch_size: int = 16,
+        validation_split: float = 0.2
+    ) -> Dict[str, Any]:
+        """
+        Train a per-user LoRA adapter and classifier on top of the frozen shared model
+        
+        Args:
+            user_id: User the adapter belongs to
+            texts: The user's labelled email texts
+            labels: Label names (the user's own categories)
+            base_model_dir: Shared fine-tuned model served by DynamicEmailClassifier
+            adapters_dir: Root directory holding one sub-directory per user
+            rank: LoRA rank
+            alpha: LoRA scaling numerator
+            num_epochs: Number of training epochs
+            learning_rate: Learning rate for adapter parameters
+            batch_size: Training batch size
+            validation_split: Fraction of data held out for evaluation
+            
+        Returns:
+            Adapter metrics and size
+        """
+        from lora_adapters import UserAdapter, base_model_fingerprint, inject_lora, adapter_logits, safe_user_dir
+        
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.tokenizer = DistilBertTokenizerFast.from_pretrained(base_model_dir)
+        self.model = DistilBertForSequenceClassification.from_pretrained(base_model_dir).to(device)
+        for param in self.model.parameters():
+            param.requires_grad = False
+        
+        user_labels = sorted(set(labels))
+        label_ids = [user_labels.index(label) for label in labels]
+        
+        layer_shapes = inject_lora(self.model)
+        adapter = UserAdapter(layer_shapes, self.model.config.dim, user_labels, rank=rank, alpha=alpha).to(device)
+        
+        split_idx = int(len(texts) * (1 - validation_split))
+        train_dataset = EmailDataset(texts[:split_idx], label_ids[:split_idx], self.tokenizer, self.max_length)
+        val_dataset = EmailDataset(texts[split_idx:], label_ids[split_idx:], self.tokenizer, self.max_length)
+        
+        optimizer = torch.optim.AdamW(adapter.parameters(), lr=learning_rate, weight_decay=0.01)
+        loss_fn = nn.CrossEntropyLoss()
+        
+        logger.info(f"Training adapter for user {user_id}: {len(train_dataset)} examples, {len(user_labels)} labels, rank {rank}")
+        
+        # Dropout stays on in the adapter; the frozen encoder runs in eval mode
+        self.model.eval()
+        for epoch in range(num_epochs):
+            adapter.train()
+            epoch_loss = 0.0
+            for batch in DataLoader(train_dataset, batch_size=batch_size, shuffle=True):
+                batch = {k: v.to(device) for k, v in batch.items()}
+                logits = adapter_logits(self.model, adapter, batch['input_ids'], batch['attention_mask'])
+                loss = loss_fn(logits, batch['labels'])
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                epoch_loss += loss.item() * len(batch['labels'])
+            logger.info(f"Adapter epoch {epoch + 1}/{num_epochs}: loss {epoch_loss / max(len(train_dataset), 1):.4f}")
+        
+        adapter.eval()
+        predictions, references = [], []
+        with torch.no_grad():
+            for batch in DataLoader(val_dataset, batch_size=batch_size):
+                batch = {k: v.to(device) for k, v in batch.items()}
+                logits = adapter_logits(self.model, adapter, batch['input_ids'], batch['attention_mask'])
+                predictions.extend(torch.argmax(logits, dim=-1).tolist())
+                references.extend(batch['labels'].tolist())
+        
+        adapter_dir = safe_user_dir(adapters_dir, user_id)
+        # The server only applies the adapter to a model with these exact weights
+        adapter.cpu().save(adapter_dir, base_model=base_model_fingerprint(self.model))
+        
+        metrics = {}
+        if references:
+            precision, recall, f1, _ = precision_recall_fscore_support(
+                references, predictions, average='weighted', zero_division=0
+            )
+            metrics = {
+                'accuracy': accuracy_score(references, predictions),
+                'precision': precision,
+                'recall': recall,
+                'f1': f1
+            }
+        results = {
+            "user_id": user_id,
+            "adapter_dir": adapter_dir,
+            "labels": user_labels,
+            "adapter_bytes": adapter.num_bytes(),
+            "base_model_bytes": sum(p.numel() * p.element_size() for p in self.model.parameters()),
+            "eval_results": metrics,
+            "training_config": {
+                "rank": rank,
+                "alpha": alpha,
+                "num_epochs": num_epochs,
+                "learning_rate": learning_rate,
+                "train_size": len(train_dataset)
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        with open(os.path.join(adapter_dir, "adapter_results.json"), "w") as f:
+            json.dump(results, f, indent=2)
+        
+        logger.info(f"Adapter for user {user_id} saved to {adapter_dir} "
+                    f"({results['adapter_bytes'] / 1e6:.1f} MB vs {results['base_model_bytes'] / 1e6:.0f} MB base)")
+        return results
+    
+    def train_exit_heads(
+        self,
+        texts: List[str],
+        labels: List[int],
+        validation_split: float = 0.2,
+        exit_layers: Optional[List[int]] = None,
+        num_epochs: int = 5,
+        learning_rate: float = 1e-3,
+        entropy_thresholds: Tuple[float, ...] = (0.1, 0.2, 0.3, 0.4)
+    ) -> Dict[str, Any]:
+        """
+        Train early-exit heads post-hoc on the frozen fine-tuned model
+        
+        Args:
+            texts: List of training texts (same order as train_model)
+            labels: List of corresponding labels
+            validation_split: Fraction of data held out for the early-exit report
+            exit_layers: Layer indices that get an exit head (default: all but the last)
+            num_epochs: Number of head training epochs
+            learning_rate: Learning rate for the heads
+            entropy_thresholds: Normalized entropy thresholds to report on
+            
+        Returns:
+            Early-exit report with accuracy, average layers executed and latency savings
+        """
+        from early_exit import collect_cls_states, train_exit_heads, evaluate_early_exit
+        
+        num_layers = self.model.config.n_layers
+        if exit_layers is None:
+            exit_layers = list(range(num_layers - 1))
+        
+        # Same split as train_model so the report uses unseen emails
+        split_idx = int(len(texts) * (1 - validation_split))
+        train_texts, train_labels = texts[:split_idx], labels[:split_idx]
+        val_texts, val_labels = texts[split_idx:], labels[split_idx:]
+        
+        logger.info(f"Training exit heads after layers {exit_layers} on {len(train_texts)} examples")
+        cls_states = collect_cls_states(self.model, self.tokenizer, train_texts, self.max_length)
+        heads = train_exit_heads(
+            self.model, cls_states, train_labels, exit_layers,
+            num_epochs=num_epochs, learning_rate=learning_rate
+        )
+        heads.save(self.output_dir)
+        
+        report = evaluate_early_exit(
+            self.model, self.tokenizer, heads, val_texts, val_labels,
+            self.max_length, entropy_thresholds=entropy_thresholds
+        )
+        report["timestamp"] = datetime.now().isoformat()
+        
+        with open(os.path.join(self.output_dir, "early_exit_report.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        
+        for threshold, metrics in report["thresholds"].items():
+            logger.info(f"Early exit @ entropy {threshold}: accuracy {metrics['accuracy']:.4f} "
+                        f"(full {report['full']['accuracy']:.4f}), "
+                        f"avg layers {metrics['avg_layers_executed']:.2f}/{num_layers}, "
+                        f"latency saving {metrics['latency_saving']:.1%}")
+        
+        return report
+    
     def load_trained_model(self, model_path: str):
         """Load a trained model and tokenizer"""
         logger.info(f"Loading trained model from {model_path}")
@@ -351,6 +701,20 @@ def main():
                        help="Maximum token sequence length")
     parser.add_argument("--validation_split", type=float, default=0.2,
                        help="Validation split ratio")
+    parser.add_argument("--continue_from", type=str, default=None,
+                       help="Deployed model directory to fine-tune incrementally (data_file holds the new samples)")
+    parser.add_argument("--replay_file", type=str, default=None,
+                       help="Older training data to sample a replay buffer from (with --continue_from)")
+    parser.add_argument("--replay_ratio", type=float, default=1.0,
+                       help="Replay examples per new example (with --continue_from)")
+    parser.add_argument("--adapter_user_id", type=str, default=None,
+                       help="Train a per-user LoRA adapter on data_file instead of a full model")
+    parser.add_argument("--base_model_dir", type=str, default=None,
+                       help="Shared fine-tuned model the adapter is trained against (with --adapter_user_id)")
+    parser.add_argument("--adapters_dir", type=str, default="user_adapters",
+                       help="Directory holding per-user adapters (with --adapter_user_id)")
+    parser.add_argument("--early_exit", action="store_true",
+                       help="Train early-exit heads after fine-tuning and report savings")
     
     args = parser.parse_args()
     
@@ -361,25 +725,60 @@ def main():
     )
     
     try:
-        # Load and preprocess dataset
-        texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
-        
-        if len(texts) == 0:
-            logger.error("No valid training examples found!")
+        if args.adapter_user_id:
+            if not args.base_model_dir:
+                parser.error("--adapter_user_id requires --base_model_dir")
+            texts, labels, _ = trainer.load_and_preprocess_dataset(args.data_file)
+            results = trainer.train_adapter(
+                user_id=args.adapter_user_id,
+                texts=texts,
+                labels=[trainer.id2label[label] for label in labels],
+                base_model_dir=args.base_model_dir,
+                adapters_dir=args.adapters_dir,
+                num_epochs=args.num_epochs,
+                batch_size=args.batch_size
+            )
+            logger.info(f"Adapter training completed for user {args.adapter_user_id}")
             return
-        
-        # Initialize model
-        trainer.initialize_model(len(label_mapping))
-        
-        # Train model
-        results = trainer.train_model(
-            texts=texts,
-            labels=labels,
-            validation_split=args.validation_split,
-            train_batch_size=args.batch_size,
-            num_epochs=args.num_epochs,
-            learning_rate=args.learning_rate
-        )
+        elif args.continue_from:
+            # Incremental run: new samples + replay buffer, starting from the deployed model
+            results = trainer.continue_training(
+                base_model_dir=args.continue_from,
+                new_data_file=args.data_file,
+                replay_data_file=args.replay_file,
+                replay_ratio=args.replay_ratio,
+                validation_split=args.validation_split,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate
+            )
+        else:
+            # Load and preprocess dataset
+            texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
+            
+            if len(texts) == 0:
+                logger.error("No valid training examples found!")
+                return
+            
+            # Initialize model
+            trainer.initialize_model(len(label_mapping))
+            
+            # Train model
+            results = trainer.train_model(
+                texts=texts,
+                labels=labels,
+                validation_split=args.validation_split,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate
+            )
+            
+            if args.early_exit:
+                results["early_exit"] = trainer.train_exit_heads(
+                    texts=texts,
+                    labels=labels,
+                    validation_split=args.validation_split
+                )
         
         # Save results
         results_file = os.path.join(args.output_dir, "training_results.json")
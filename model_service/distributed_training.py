@@ -0,0 +1,284 @@
+"""
+Multi-process CPU Data-Parallel Training for DistilBERT
+Launches DistilBERTTrainer workers over torch.distributed (gloo) on one or more CPU nodes
+"""
+
+import os
+import sys
+import json
+import shutil
+import time
+import subprocess
+import logging
+import argparse
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def default_threads_per_worker(num_workers: int) -> int:
+    """Split the node's cores evenly so workers do not oversubscribe each other"""
+    return max(1, (os.cpu_count() or 1) // max(num_workers, 1))
+
+def launch_workers(
+    num_workers: int,
+    worker_args: List[str],
+    nnodes: int = 1,
+    node_rank: int = 0,
+    master_addr: str = "127.0.0.1",
+    master_port: int = 29500,
+    threads_per_worker: Optional[int] = None
+) -> int:
+    """
+    Start this node's worker processes and wait for them
+
+    Run the same command on every node with its own --node_rank; node 0 hosts
+    the rendezvous at master_addr:master_port.
+
+    Args:
+        num_workers: Worker processes on this node
+        worker_args: Training arguments forwarded to every worker
+        nnodes: Number of nodes taking part
+        node_rank: Rank of this node (0 .. nnodes-1)
+        master_addr: Address of node 0
+        master_port: Free TCP port on node 0
+        threads_per_worker: intra-op threads per worker (default: cores / workers)
+
+    Returns:
+        0 if every worker succeeded, otherwise the first non-zero exit code
+    """
+    world_size = nnodes * num_workers
+    threads = threads_per_worker or default_threads_per_worker(num_workers)
+
+    logger.info(f"Launching {num_workers} workers on node {node_rank}/{nnodes} "
+                f"(world size {world_size}, {threads} threads each)")
+
+    processes = []
+    for local_rank in range(num_workers):
+        env = os.environ.copy()
+        env.update({
+            "MASTER_ADDR": master_addr,
+            "MASTER_PORT": str(master_port),
+            "WORLD_SIZE": str(world_size),
+            "RANK": str(node_rank * num_workers + local_rank),
+            "LOCAL_RANK": str(local_rank),
+            "LOCAL_WORLD_SIZE": str(num_workers),
+            "OMP_NUM_THREADS": str(threads),
+            "MKL_NUM_THREADS": str(threads),
+            "TOKENIZERS_PARALLELISM": "false",
+            "CUDA_VISIBLE_DEVICES": ""
+        })
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker",
+               "--threads_per_worker", str(threads)] + worker_args
+        processes.append(subprocess.Popen(cmd, env=env))
+
+    exit_code = 0
+    running = list(processes)
+    while running:
+        for process in list(running):
+            code = process.poll()
+            if code is None:
+                continue
+            running.remove(process)
+            if code != 0 and exit_code == 0:
+                exit_code = code
+                # A failed worker leaves the others blocked in all-reduce
+                logger.error(f"Worker exited with code {code}; stopping the remaining workers")
+                for other in running:
+                    other.terminate()
+        time.sleep(0.5)
+
+    return exit_code
+
+def run_worker(args: argparse.Namespace):
+    """Body of a single worker process"""
+    import torch
+    from distilbert_trainer import DistilBERTTrainer
+
+    torch.set_num_threads(args.threads_per_worker)
+    rank = int(os.environ.get("RANK", "0"))
+
+    trainer = DistilBERTTrainer(
+        model_name=args.model_name,
+        output_dir=args.output_dir,
+        max_length=args.max_length
+    )
+
+    # Every worker loads and splits the data identically; the Trainer's
+    # DistributedSampler gives each rank a disjoint shard of every epoch
+    texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
+    if len(texts) == 0:
+        raise ValueError("No valid training examples found!")
+
+    trainer.initialize_model(len(label_mapping))
+
+    results = trainer.train_model(
+        texts=texts,
+        labels=labels,
+        validation_split=args.validation_split,
+        train_batch_size=args.batch_size,
+        num_epochs=args.num_epochs,
+        learning_rate=args.learning_rate,
+        ddp_backend="gloo",
+        use_cpu=True,
+        max_steps=args.max_steps
+    )
+
+    if rank == 0:
+        results["training_config"]["threads_per_worker"] = args.threads_per_worker
+        results_file = args.result_file or os.path.join(args.output_dir, "training_results.json")
+        with open(results_file, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        logger.info(f"Rank 0 wrote results to {results_file}")
+
+def _worker_args(args: argparse.Namespace, output_dir: str, max_steps: int, result_file: Optional[str] = None) -> List[str]:
+    worker_args = [
+        "--data_file", args.data_file,
+        "--model_name", args.model_name,
+        "--output_dir", output_dir,
+        "--num_epochs", str(args.num_epochs),
+        "--batch_size", str(args.batch_size),
+        "--learning_rate", str(args.learning_rate),
+        "--max_length", str(args.max_length),
+        "--validation_split", str(args.validation_split),
+        "--max_steps", str(max_steps)
+    ]
+    if result_file:
+        worker_args += ["--result_file", result_file]
+    return worker_args
+
+def run_scaling_benchmark(args: argparse.Namespace, worker_counts: List[int]) -> Dict[str, Any]:
+    """
+    Train for a fixed number of steps at each worker count on this node
+
+    Benchmark checkpoints go to a scratch directory that is removed afterwards,
+    so output_dir only ever holds the real checkpoint.
+    """
+    scratch_dir = os.path.join(args.output_dir, "scaling_runs")
+    os.makedirs(scratch_dir, exist_ok=True)
+
+    runs = []
+    try:
+        for num_workers in worker_counts:
+            run_dir = os.path.join(scratch_dir, f"workers_{num_workers}")
+            result_file = os.path.join(scratch_dir, f"workers_{num_workers}.json")
+            code = launch_workers(
+                num_workers,
+                _worker_args(args, run_dir, args.benchmark_steps, result_file),
+                master_addr=args.master_addr,
+                master_port=args.master_port,
+                threads_per_worker=args.threads_per_worker
+            )
+            if code != 0:
+                runs.append({"workers": num_workers, "error": f"exit code {code}"})
+                continue
+
+            with open(result_file, "r") as f:
+                throughput = json.load(f)["throughput"]
+            runs.append({
+                "workers": num_workers,
+                "threads_per_worker": args.threads_per_worker or default_threads_per_worker(num_workers),
+                "samples_per_second": throughput["train_samples_per_second"],
+                "runtime_seconds": throughput["train_runtime"]
+            })
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    # Speedup and efficiency relative to the smallest successful run
+    ok_runs = [r for r in runs if "error" not in r]
+    if ok_runs:
+        base = min(ok_runs, key=lambda r: r["workers"])
+        for run in ok_runs:
+            run["speedup"] = run["samples_per_second"] / base["samples_per_second"]
+            run["efficiency"] = run["speedup"] / (run["workers"] / base["workers"])
+
+    report = {
+        "benchmark_steps": args.benchmark_steps,
+        "per_worker_batch_size": args.batch_size,
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+        "timestamp": datetime.now().isoformat()
+    }
+
+    report_file = os.path.join(args.output_dir, "scaling_report.json")
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for run in ok_runs:
+        logger.info(f"{run['workers']} workers: {run['samples_per_second']:.1f} samples/s, "
+                    f"speedup {run['speedup']:.2f}x, efficiency {run['efficiency']:.0%}")
+    logger.info(f"Scaling report saved to {report_file}")
+
+    return report
+
+def main():
+    """Launch distributed CPU training"""
+    parser = argparse.ArgumentParser(description="Data-parallel DistilBERT training on CPU nodes")
+    parser.add_argument("--data_file", type=str, default="train_dataset.jsonl",
+                       help="Path to training dataset JSONL file")
+    parser.add_argument("--model_name", type=str, default="distilbert-base-uncased",
+                       help="Base model to fine-tune")
+    parser.add_argument("--output_dir", type=str, default="distilbert_models",
+                       help="Output directory for the trained model")
+    parser.add_argument("--num_epochs", type=int, default=3,
+                       help="Number of training epochs")
+    parser.add_argument("--batch_size", type=int, default=16,
+                       help="Per-worker training batch size")
+    parser.add_argument("--learning_rate", type=float, default=2e-5,
+                       help="Learning rate")
+    parser.add_argument("--max_length", type=int, default=256,
+                       help="Maximum token sequence length")
+    parser.add_argument("--validation_split", type=float, default=0.2,
+                       help="Validation split ratio")
+    parser.add_argument("--max_steps", type=int, default=-1,
+                       help="Stop after this many optimizer steps (-1 trains for num_epochs)")
+
+    parser.add_argument("--num_workers", type=int, default=2,
+                       help="Worker processes per node")
+    parser.add_argument("--nnodes", type=int, default=1,
+                       help="Number of CPU nodes")
+    parser.add_argument("--node_rank", type=int, default=0,
+                       help="Rank of this node")
+    parser.add_argument("--master_addr", type=str, default="127.0.0.1",
+                       help="Address of node 0")
+    parser.add_argument("--master_port", type=int, default=29500,
+                       help="Rendezvous port on node 0")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                       help="Intra-op threads per worker (default: cores / workers)")
+
+    parser.add_argument("--scaling", type=str, default=None,
+                       help="Comma-separated worker counts to benchmark on this node, e.g. 1,2,4")
+    parser.add_argument("--benchmark_steps", type=int, default=50,
+                       help="Optimizer steps per scaling benchmark run")
+
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result_file", type=str, default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.scaling:
+        worker_counts = sorted({int(n) for n in args.scaling.split(",") if n.strip()})
+        run_scaling_benchmark(args, worker_counts)
+        return
+
+    exit_code = launch_workers(
+        args.num_workers,
+        _worker_args(args, args.output_dir, args.max_steps),
+        nnodes=args.nnodes,
+        node_rank=args.node_rank,
+        master_addr=args.master_addr,
+        master_port=args.master_port,
+        threads_per_worker=args.threads_per_worker
+    )
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Offline Domain Parsing
+Public-suffix lookups from the snapshot bundled with tldextract, with an LRU of parsed hosts
+"""
+
+import os
+import logging
+from functools import lru_cache
+from urllib.parse import urlparse
+import tldextract
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOMAIN_CACHE_SIZE = int(os.getenv("DOMAIN_CACHE_SIZE", "65536"))
+
+def _build_extractor() -> tldextract.TLDExtract:
+    """
+    TLDExtract that never goes to the network
+
+    No suffix-list URLs means tldextract uses the snapshot shipped in the
+    package. An operator can point TLD_SUFFIX_LIST_FILE at a newer local
+    public_suffix_list.dat. The on-disk cache is disabled, so read-only
+    model nodes work too.
+    """
+    suffix_file = os.getenv("TLD_SUFFIX_LIST_FILE")
+    urls = (f"file://{os.path.abspath(suffix_file)}",) if suffix_file else ()
+    return tldextract.TLDExtract(suffix_list_urls=urls, cache_dir=None, fallback_to_snapshot=True)
+
+_EXTRACTOR = _build_extractor()
+
+# Load the suffix list now rather than on the first request
+_EXTRACTOR.extract_str("example.com")
+
+@lru_cache(maxsize=DOMAIN_CACHE_SIZE)
+def parse_host(host: str) -> tldextract.tldextract.ExtractResult:
+    """Split a (lowercased) host into subdomain, registered domain and suffix"""
+    return _EXTRACTOR.extract_str(host)
+
+def host_suffix(host: str) -> str:
+    """Public suffix of a host ('' for IPs, localhost and unknown TLDs)"""
+    return parse_host(host.lower()).suffix
+
+@lru_cache(maxsize=DOMAIN_CACHE_SIZE)
+def url_host(url: str) -> str:
+    """Lowercased netloc of a URL ('' for relative links)"""
+    return urlparse(url).netloc.lower()
+
+def cache_info() -> dict:
+    """Hit/miss counters of the host and URL caches"""
+    return {
+        'hosts': parse_host.cache_info()._asdict(),
+        'urls': url_host.cache_info()._asdict()
+    }
@@ -12,6 +12,7 @@ from transformers import (
     AutoModelForSequenceClassification,
     AutoConfig
 )
+import copy
 import logging
 import json
 import asyncio
@@ -20,11 +21,22 @@ import threading
 from collections import defaultdict
 import pickle
 import os
+import re
+
+from cascade_classifier import CascadeStats
+from early_exit import EarlyExitHeads, EarlyExitStats, early_exit_forward, heads_match_model
+from label_compatibility import load_label_mappings, check_model_labels
+from lora_adapters import AdapterRegistry, base_model_fingerprint, inject_lora, adapter_logits
+from service_metrics import stage_timer, record_cache_lookup
+from local_models import resolve_serving_model_dir, pretrained_kwargs, check_weights_format
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Highest base score a keyword-only (degraded) prediction can get before the rule layer
+RULES_ONLY_BASE_CONFIDENCE = 0.5
+
 class DynamicCategoryManager:
     """Manages dynamic categories with real-time updates"""
     
@@ -200,28 +212,117 @@ class DynamicCategoryManager:
         except Exception as e:
             logger.error(f"Error saving categories: {e}")
 
+class ModelBundle:
+    """
+    Everything one prediction needs from a loaded checkpoint
+
+    A bundle is built and warmed off to the side and then published with a
+    single attribute assignment. Requests read classifier.bundle once and use
+    that object until they finish, so a swap never pairs a new tokenizer with
+    an old model. After publication only the lock-guarded LoRA injection
+    touches it.
+    """
+
+    def __init__(self, version: int, source: str, tokenizer, model, max_length: int,
+                 id2label: Optional[Dict] = None, label2id: Optional[Dict] = None,
+                 model_label_to_category_id: Optional[Dict[int, int]] = None, exit_heads=None):
+        self.version = version
+        self.source = source
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_length = max_length
+        self.id2label = id2label
+        self.label2id = label2id
+        self.model_label_to_category_id = model_label_to_category_id
+        self.exit_heads = exit_heads
+        self.created_at = datetime.now().isoformat()
+
+        # Guards the one-time LoRA injection; forward passes run concurrently and pick their adapter per call
+        self.lock = threading.Lock()
+        self.lora_injected = False
+        self._base_fingerprint = None
+
+    @property
+    def base_fingerprint(self) -> str:
+        """base_model_fingerprint of this bundle's model, computed once on first use"""
+        if self._base_fingerprint is None:
+            with self.lock:
+                if self._base_fingerprint is None:
+                    self._base_fingerprint = base_model_fingerprint(self.model)
+        return self._base_fingerprint
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "max_length": self.max_length,
+            "early_exit_heads": self.exit_heads is not None,
+            "loaded_at": self.created_at
+        }
+
+def _with_classifier(model: nn.Module, classifier: nn.Linear) -> nn.Module:
+    """
+    Shallow copy of a sequence-classification model with a different classifier
+
+    Submodules other than the classifier (the encoder and pre-classifier) are
+    shared with the original, so no weights are copied; the config is copied
+    so the label count can change without affecting the original model.
+    """
+    clone = copy.copy(model)
+    clone._modules = model._modules.copy()
+    clone._parameters = model._parameters.copy()
+    clone._buffers = model._buffers.copy()
+    clone.config = copy.deepcopy(model.config)
+    clone.config.num_labels = classifier.out_features
+    clone.classifier = classifier
+    return clone
+
 class DynamicEmailClassifier:
     """High-performance dynamic email classifier"""
     
-    def __init__(self, model_name: str = "distilbert-base-uncased", max_length: int = 512):
+    def __init__(self, model_name: str = "distilbert-base-uncased", max_length: int = 512,
+                 model_path: Optional[str] = None):
         self.model_name = model_name
-        self.max_length = max_length
+        self.default_max_length = max_length
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
         # Initialize components
         self.category_manager = DynamicCategoryManager()
-        self.tokenizer = None
-        self.model = None
         self.classification_head = None
+
+        # The published model; replaced as a whole by _publish_bundle, never edited in place
+        self.bundle: Optional[ModelBundle] = None
+        self._bundle_version = 0
+        # One load at a time; predictions never take this lock
+        self.load_lock = threading.Lock()
         
         # Performance optimization
         self.batch_size = 32
         self.max_batch_size = 1000
         self.cache_size = 10000
         self.prediction_cache = {}
-        
-        # Initialize model
-        self._initialize_model()
+
+        # Optional cheap first tier that answers easy emails before the transformer
+        self.first_tier = None
+        self.cascade_stats = CascadeStats()
+
+        # Optional early-exit heads (on the bundle); opt-in: active when loaded and the entropy threshold is > 0
+        self.early_exit_threshold = float(os.getenv("EARLY_EXIT_ENTROPY", "0"))
+        self.early_exit_stats = EarlyExitStats()
+
+        # Per-user LoRA adapters share the bundle's model; each forward applies its own adapter
+        self.adapter_registry = AdapterRegistry(
+            os.getenv("USER_ADAPTERS_DIR", "user_adapters"),
+            max_adapters=int(os.getenv("MAX_USER_ADAPTERS", "64")),
+            device=str(self.device)
+        )
+
+        # A fine-tuned bundle (argument or SERVING_MODEL_DIR) replaces the base model; the base is never loaded
+        model_path = model_path or resolve_serving_model_dir()
+        if model_path:
+            self._initialize_from_path(model_path)
+        else:
+            self._initialize_model()
     
     def _initialize_model(self):
         """Initialize the DistilBERT model with dynamic classification head"""
@@ -229,24 +330,30 @@ class DynamicEmailClassifier:
             logger.info(f"Initializing model: {self.model_name}")
             
             # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            local = pretrained_kwargs(self.model_name)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name, **local)
             
             # Load base model with correct number of labels
             num_categories = len(self.category_manager.get_categories())
             config = AutoConfig.from_pretrained(
                 self.model_name,
                 num_labels=num_categories,
-                problem_type="single_label_classification"
+                problem_type="single_label_classification",
+                **local
             )
             
-            self.model = AutoModelForSequenceClassification.from_pretrained(
+            model = AutoModelForSequenceClassification.from_pretrained(
                 self.model_name,
-                config=config
+                config=config,
+                **local
             )
             
             # Move to device
-            self.model.to(self.device)
-            self.model.eval()
+            model.to(self.device)
+            model.eval()
+            
+            with self.load_lock:
+                self._publish_bundle(self._new_bundle(self.model_name, tokenizer, model, self.default_max_length))
             
             logger.info("Model initialized successfully")
             
@@ -254,6 +361,20 @@ class DynamicEmailClassifier:
             logger.error(f"Error initializing model: {e}")
             raise RuntimeError(f"Model initialization failed: {e}")
 
+    def _initialize_from_path(self, model_path: str):
+        """Serve a fine-tuned bundle from the start (no warm-up here; see warm_up)"""
+        logger.info(f"Initializing model from local bundle: {model_path}")
+        with self.load_lock:
+            bundle = self._load_bundle(model_path)
+            if bundle is None:
+                raise RuntimeError(f"Model initialization failed: could not load {model_path}")
+            self._publish_bundle(bundle)
+        logger.info("Model initialized successfully")
+
+    def warm_up(self):
+        """Warm the serving bundle; run before reporting ready"""
+        self._warm_up(self.bundle)
+
     def load_model_from_path(self, model_path: str) -> bool:
         """Load a fine-tuned model and tokenizer from a directory.
 
@@ -261,104 +382,250 @@ class DynamicEmailClassifier:
         produced by `Trainer.save_model()` and `tokenizer.save_pretrained()`.
 
         Returns True if loaded successfully, False otherwise.
+
+        The new model is loaded and warmed up next to the serving one and
+        only then swapped in, so requests keep using the previous bundle
+        until the new one is ready. Safe to call from a background thread.
         """
-        try:
-            if not os.path.exists(model_path):
-                logger.error(f"Model path does not exist: {model_path}")
+        with self.load_lock:
+            try:
+                bundle = self._load_bundle(model_path)
+                if bundle is None:
+                    return False
+
+                self._warm_up(bundle)
+                self._publish_bundle(bundle)
+
+                logger.info("Fine-tuned model loaded successfully and ready for predictions")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to load model from path '{model_path}': {e}")
                 return False
 
-            logger.info(f"Loading fine-tuned model from: {model_path}")
+    def load_candidate(self, model_path: str, tokenizer=None) -> Optional[ModelBundle]:
+        """Load and warm a checkpoint without serving it (shadow evaluation, model registry)"""
+        with self.load_lock:
+            bundle = self._load_bundle(model_path, tokenizer)
+            if bundle is not None:
+                self._warm_up(bundle)
+            return bundle
 
-            # Load tokenizer and model
-            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    def promote_bundle(self, bundle: ModelBundle):
+        """Start serving a bundle returned by load_candidate"""
+        with self.load_lock:
+            self._publish_bundle(bundle)
 
-            config = AutoConfig.from_pretrained(model_path)
-            # Ensure the number of labels aligns to current categories count
-            num_categories = len(self.category_manager.get_categories())
-            if getattr(config, "num_labels", None) and config.num_labels != num_categories:
+    def _load_bundle(self, model_path: str, tokenizer=None) -> Optional[ModelBundle]:
+        """Read a fine-tuned checkpoint into a new, unpublished bundle (reusing a compatible tokenizer if given)"""
+        if not os.path.exists(model_path):
+            logger.error(f"Model path does not exist: {model_path}")
+            return None
+
+        logger.info(f"Loading fine-tuned model from: {model_path}")
+
+        # Refuse checkpoints whose head disagrees with label_mappings.json before loading weights
+        local = pretrained_kwargs(model_path)
+        config = AutoConfig.from_pretrained(model_path, **local)
+        label_problems = check_model_labels(
+            getattr(config, 'id2label', None),
+            getattr(config, 'num_labels', None),
+            load_label_mappings(model_path)
+        )
+        if label_problems:
+            for problem in label_problems:
+                logger.error(f"Label mapping mismatch in {model_path}: {problem}")
+            return None
+
+        # Load tokenizer and model
+        tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_path, **local)
+
+        # Distilled students are trained on shorter inputs; honour the saved limit
+        saved_max_length = getattr(tokenizer, 'model_max_length', None) or self.default_max_length
+        max_length = min(self.default_max_length, saved_max_length)
+
+        # Ensure the number of labels aligns to current categories count
+        num_categories = len(self.category_manager.get_categories())
+        if getattr(config, "num_labels", None) and config.num_labels != num_categories:
+            logger.warning(
+                f"Loaded model num_labels ({config.num_labels}) does not match current categories ({num_categories})."
+            )
+
+        # safetensors checkpoints are memory-mapped by transformers
+        check_weights_format(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path, config=config, **local)
+        model.to(self.device)
+        model.eval()
+
+        # Capture label mappings if present on config
+        id2label = getattr(config, 'id2label', None)
+        label2id = getattr(config, 'label2id', None)
+
+        # If trainer saved label_mappings.json, read it for robustness
+        try:
+            mappings_path = os.path.join(model_path, 'label_mappings.json')
+            if os.path.exists(mappings_path):
+                with open(mappings_path, 'r') as f:
+                    mappings = json.load(f)
+                    label2id = mappings.get('label2id', label2id)
+                    id2label = mappings.get('id2label', id2label)
+        except Exception as e:
+            logger.warning(f"Could not read label_mappings.json: {e}")
+
+        # Build mapping from model label names -> current category IDs
+        model_label_to_category_id = {}
+        if id2label:
+            # id2label keys may be str indices; normalize
+            for k, v in list(id2label.items()):
+                try:
+                    idx = int(k)
+                    label_name = v
+                except Exception:
+                    idx = k
+                    label_name = v
+                cat_id = self.category_manager.get_category_id_by_name(label_name) or self.category_manager.get_category_id_by_name('Other') or 0
+                model_label_to_category_id[idx] = cat_id
+        else:
+            # Fallback: assume same ordering
+            logger.warning("id2label not found; assuming model label indices align with category IDs")
+            model_label_to_category_id = {i: i for i in range(num_categories)}
+
+        # Early-exit heads are saved next to the model by DistilBERTTrainer.train_exit_heads
+        exit_heads = None
+        if hasattr(model, 'distilbert'):
+            exit_heads = EarlyExitHeads.load(model_path, map_location=str(self.device))
+            if exit_heads is not None and not heads_match_model(exit_heads, model):
                 logger.warning(
-                    f"Loaded model num_labels ({config.num_labels}) does not match current categories ({num_categories})."
+                    f"Ignoring early-exit heads in {model_path}: trained for {exit_heads.num_labels} labels, "
+                    f"classifier has {model.classifier.out_features}"
                 )
+                exit_heads = None
+            if exit_heads is not None:
+                exit_heads.to(self.device)
+                logger.info(f"Early-exit heads loaded for layers {exit_heads.exit_layers}")
 
-            self.model = AutoModelForSequenceClassification.from_pretrained(model_path, config=config)
-            self.model.to(self.device)
-            self.model.eval()
+        return self._new_bundle(
+            model_path, tokenizer, model, max_length,
+            id2label=id2label,
+            label2id=label2id,
+            model_label_to_category_id=model_label_to_category_id,
+            exit_heads=exit_heads
+        )
 
-            # Capture label mappings if present on config
-            self.id2label = getattr(config, 'id2label', None)
-            self.label2id = getattr(config, 'label2id', None)
+    def _new_bundle(self, source: str, tokenizer, model, max_length: int, **kwargs) -> ModelBundle:
+        self._bundle_version += 1
+        return ModelBundle(self._bundle_version, source, tokenizer, model, max_length, **kwargs)
 
-            # If trainer saved label_mappings.json, read it for robustness
-            try:
-                mappings_path = os.path.join(model_path, 'label_mappings.json')
-                if os.path.exists(mappings_path):
-                    with open(mappings_path, 'r') as f:
-                        mappings = json.load(f)
-                        self.label2id = mappings.get('label2id', self.label2id)
-                        self.id2label = mappings.get('id2label', self.id2label)
-            except Exception as e:
-                logger.warning(f"Could not read label_mappings.json: {e}")
-
-            # Build mapping from model label names -> current category IDs
-            self.model_label_to_category_id = {}
-            if self.id2label:
-                # id2label keys may be str indices; normalize
-                for k, v in list(self.id2label.items()):
-                    try:
-                        idx = int(k)
-                        label_name = v
-                    except Exception:
-                        idx = k
-                        label_name = v
-                    cat_id = self.category_manager.get_category_id_by_name(label_name) or self.category_manager.get_category_id_by_name('Other') or 0
-                    self.model_label_to_category_id[idx] = cat_id
-            else:
-                # Fallback: assume same ordering
-                logger.warning("id2label not found; assuming model label indices align with category IDs")
-                self.model_label_to_category_id = {i: i for i in range(num_categories)}
+    def _warm_up(self, bundle: ModelBundle):
+        """
+        Run representative batches through an unpublished bundle
 
-            # Clear prediction cache after model swap
-            self.prediction_cache.clear()
+        The first passes through a freshly loaded model pay for allocator
+        growth and kernel selection; doing them here keeps that latency away
+        from the first users after a swap. Batches cover a single email, a
+        full chunk and a max-length input.
+        """
+        start = datetime.now()
+        texts = [
+            self.preprocess_text(name, f"{data.get('description', '')} {' '.join(data.get('keywords', []))}")
+            for name, data in self.category_manager.categories.items()
+        ] or ["Empty email"]
+        chunk = (texts * (self.batch_size // len(texts) + 1))[:self.batch_size]
+        long_text = " ".join(texts * (bundle.max_length // max(1, len(" ".join(texts).split())) + 1))
+
+        with torch.no_grad():
+            for batch in ([texts[0]], chunk, [long_text]):
+                encodings = bundle.tokenizer(
+                    batch, truncation=True, padding=True, max_length=bundle.max_length, return_tensors="pt"
+                )
+                encodings = {k: v.to(self.device) for k, v in encodings.items()}
+                if bundle.exit_heads is not None and self.early_exit_threshold > 0:
+                    early_exit_forward(
+                        bundle.model, bundle.exit_heads,
+                        encodings['input_ids'], encodings['attention_mask'], self.early_exit_threshold
+                    )
+                bundle.model(**encodings)
+
+        logger.info(f"Warmed up model v{bundle.version} in {(datetime.now() - start).total_seconds():.2f}s")
+
+    def _publish_bundle(self, bundle: ModelBundle):
+        """Make a bundle the one new requests use; callers hold load_lock"""
+        previous = self.bundle
+        self.bundle = bundle
+
+        if bundle.exit_heads is not None:
+            self.early_exit_stats = EarlyExitStats(len(bundle.model.distilbert.transformer.layer))
+        # Cached adapters are checked against the previous base model; reload them against this one
+        if previous is not None:
+            self.adapter_registry.invalidate()
+        # Cache keys carry the bundle version, so clearing only frees the old entries
+        self.prediction_cache.clear()
+
+        logger.info(f"Serving model v{bundle.version} from {bundle.source}")
+
+    # Read-only views of the published bundle
+    @property
+    def tokenizer(self):
+        return self.bundle.tokenizer if self.bundle else None
+
+    @property
+    def model(self):
+        return self.bundle.model if self.bundle else None
+
+    @property
+    def exit_heads(self):
+        return self.bundle.exit_heads if self.bundle else None
+
+    @property
+    def max_length(self) -> int:
+        return self.bundle.max_length if self.bundle else self.default_max_length
+
+    @property
+    def model_source(self) -> str:
+        """Where the current weights came from; reported as the model version label in /metrics"""
+        return self.bundle.source if self.bundle else self.model_name
 
-            logger.info("Fine-tuned model loaded successfully and ready for predictions")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to load model from path '{model_path}': {e}")
-            return False
-    
     def _update_classification_head(self):
-        """Update classification head for current categories"""
+        """
+        Publish a new bundle whose classification head covers the current categories
+
+        The new model shares the encoder with the serving one but gets its own
+        freshly initialised classifier and config, so requests still on the old
+        bundle are untouched and the version bump retires their cache entries.
+        Exit heads are dropped: they were trained for the old label set.
+        """
         try:
             num_categories = len(self.category_manager.get_categories())
-            
-            # Update the model's classification head
-            if hasattr(self.model, 'classifier'):
-                # Update existing classifier
-                self.model.classifier = nn.Linear(
-                    self.model.config.hidden_size, 
-                    num_categories
-                ).to(self.device)
-            else:
-                # Create new classification head
-                self.classification_head = nn.Linear(
-                    self.model.config.hidden_size, 
-                    num_categories
-                ).to(self.device)
-            
-            # Initialize weights
-            if hasattr(self.model, 'classifier'):
-                nn.init.xavier_uniform_(self.model.classifier.weight)
-                nn.init.zeros_(self.model.classifier.bias)
-            else:
-                nn.init.xavier_uniform_(self.classification_head.weight)
-                nn.init.zeros_(self.classification_head.bias)
-            
+
+            with self.load_lock:
+                bundle = self.bundle
+                if not hasattr(bundle.model, 'classifier'):
+                    # No sequence-classification head to resize on this model
+                    self.classification_head = nn.Linear(bundle.model.config.hidden_size, num_categories).to(self.device)
+                    nn.init.xavier_uniform_(self.classification_head.weight)
+                    nn.init.zeros_(self.classification_head.bias)
+                    logger.info(f"Updated classification head for {num_categories} categories")
+                    return
+
+                classifier = nn.Linear(bundle.model.classifier.in_features, num_categories).to(self.device)
+                nn.init.xavier_uniform_(classifier.weight)
+                nn.init.zeros_(classifier.bias)
+
+                new_bundle = self._new_bundle(
+                    bundle.source, bundle.tokenizer, _with_classifier(bundle.model, classifier), bundle.max_length,
+                    # A fresh head is indexed by category id, as for checkpoints without label mappings
+                    model_label_to_category_id={i: i for i in range(num_categories)}
+                )
+                new_bundle.lora_injected = bundle.lora_injected
+                # The encoder is shared, so adapters trained on it still apply
+                new_bundle._base_fingerprint = bundle._base_fingerprint
+                self._publish_bundle(new_bundle)
+
             logger.info(f"Updated classification head for {num_categories} categories")
             
         except Exception as e:
             logger.error(f"Error updating classification head: {e}")
             raise RuntimeError(f"Classification head update failed: {e}")
-    
+
     def preprocess_text(self, subject: str, body: str) -> str:
         """Preprocess email text for classification"""
         # Combine subject and body
@@ -371,20 +638,22 @@ class DynamicEmailClassifier:
         
         return text
     
-    def tokenize_batch(self, texts: List[str]) -> Dict[str, torch.Tensor]:
-        """Tokenize batch of texts efficiently"""
+    def tokenize_batch(self, texts: List[str], bundle: Optional[ModelBundle] = None) -> Dict[str, torch.Tensor]:
+        """Tokenize batch of texts efficiently (with the given bundle's tokenizer, default the published one)"""
+        bundle = bundle or self.bundle
         try:
-            # Tokenize with padding and truncation
-            encodings = self.tokenizer(
-                texts,
-                truncation=True,
-                padding=True,
-                max_length=self.max_length,
-                return_tensors="pt"
-            )
-            
-            # Move to device
-            encodings = {k: v.to(self.device) for k, v in encodings.items()}
+            with stage_timer('tokenize'):
+                # Tokenize with padding and truncation
+                encodings = bundle.tokenizer(
+                    texts,
+                    truncation=True,
+                    padding=True,
+                    max_length=bundle.max_length,
+                    return_tensors="pt"
+                )
+                
+                # Move to device
+                encodings = {k: v.to(self.device) for k, v in encodings.items()}
             
             return encodings
             
@@ -664,64 +933,201 @@ class DynamicEmailClassifier:
             logger.error(f"Error in tags analysis: {e}")
             return 0.0, 1.0
     
-    def predict_single(self, subject: str, body: str) -> Dict[str, Any]:
-        """Predict category for single email"""
+    def attach_first_tier(self, first_tier) -> None:
+        """Put a LinearFirstTier in front of the transformer (None disables the cascade)"""
+        self.first_tier = first_tier
+        self.cascade_stats = CascadeStats()
+        self.prediction_cache.clear()
+        logger.info("Cascade first tier " + ("attached" if first_tier is not None else "detached"))
+
+    def _first_tier_decisions(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Ask the first tier for answers; entries are None where DistilBERT must decide"""
+        if self.first_tier is None:
+            return [None] * len(texts)
+
         try:
-            # Preprocess text
-            text = self.preprocess_text(subject, body)
-            
-            # Check cache
-            cache_key = hash(text)
-            if cache_key in self.prediction_cache:
-                return self.prediction_cache[cache_key]
-            
-            # Tokenize
-            encodings = self.tokenize_batch([text])
-            
-            # Get predictions
-            with torch.no_grad():
-                outputs = self.model(**encodings)
-                logits = outputs.logits
+            decisions = self.first_tier.decide(texts)
+        except Exception as e:
+            logger.warning(f"First tier failed, escalating batch: {e}")
+            decisions = [None] * len(texts)
+
+        # Only answer with categories that currently exist
+        category_names = set(self.category_manager.get_category_names())
+        decisions = [d if d is not None and d['label'] in category_names else None for d in decisions]
+
+        self.cascade_stats.record([d['label'] if d is not None else None for d in decisions])
+        return decisions
+
+    def enable_early_exit(self, entropy_threshold: float) -> bool:
+        """Set the early-exit entropy threshold (0 disables early exit)"""
+        self.early_exit_threshold = max(0.0, float(entropy_threshold))
+        self.prediction_cache.clear()
+        return self.exit_heads is not None
+
+    def _forward_probabilities(self, encodings: Dict[str, torch.Tensor], bundle: ModelBundle) -> torch.Tensor:
+        """Class probabilities for a tokenized batch, exiting early per row when enabled"""
+        with torch.no_grad(), stage_timer('transformer_forward'):
+            exit_heads = bundle.exit_heads
+            if exit_heads is not None and self.early_exit_threshold > 0 and heads_match_model(exit_heads, bundle.model):
+                probabilities, layers_executed = early_exit_forward(
+                    bundle.model,
+                    exit_heads,
+                    encodings['input_ids'],
+                    encodings['attention_mask'],
+                    self.early_exit_threshold
+                )
+                self.early_exit_stats.record(layers_executed)
+                return probabilities
+
+            outputs = bundle.model(**encodings)
+            return torch.softmax(outputs.logits, dim=1)
+
+    def _get_user_adapter(self, user_id: Optional[str], bundle: ModelBundle):
+        """The user's LoRA adapter, or None to use the shared model"""
+        if not user_id or not hasattr(bundle.model, 'distilbert'):
+            return None
+        return self.adapter_registry.get(user_id, bundle.model.config.dim, bundle.base_fingerprint)
+
+    def _predict_with_adapter(self, user_id: str, adapter, texts: List[str], bundle: ModelBundle) -> List[Dict[str, Any]]:
+        """Classify texts that share one user's adapter in a single pass over the shared encoder"""
+        results = []
+        if not bundle.lora_injected:
+            # LoRALinear without an active adapter computes exactly the wrapped Linear, so
+            # forwards already running on the shared model are unaffected by the swap
+            with bundle.lock:
+                if not bundle.lora_injected:
+                    inject_lora(bundle.model)
+                    bundle.lora_injected = True
+
+        with torch.no_grad():
+            for i in range(0, len(texts), self.batch_size):
+                encodings = self.tokenize_batch(texts[i:i + self.batch_size], bundle)
+                with stage_timer('transformer_forward'):
+                    logits = adapter_logits(bundle.model, adapter, encodings['input_ids'], encodings['attention_mask'])
                 probabilities = torch.softmax(logits, dim=1)
-            
-            # Map model label indices -> current category IDs/names
-            category_names = self.category_manager.get_category_names()
-            mapped_scores = {name: 0.0 for name in category_names}
-            id_map = getattr(self, 'model_label_to_category_id', None)
-            for i in range(probabilities.shape[1]):
-                mapped_cat_id = id_map.get(i, i) if id_map else i
-                mapped_name = self.category_manager.get_category_by_id(mapped_cat_id) or 'Other'
-                score_val = probabilities[0][i].item()
-                # If multiple model labels map to same category, take max
-                mapped_scores[mapped_name] = max(mapped_scores.get(mapped_name, 0.0), score_val)
-
-            # Choose best category by mapped score
-            category_name, confidence = max(mapped_scores.items(), key=lambda x: x[1])
-            predicted_id = self.category_manager.get_category_id_by_name(category_name) or 0
-            if not category_name:
-                category_name = "Other"
-            
-            # Create scores dictionary based on mapped_scores
-            scores = mapped_scores
-            
-            # Apply comprehensive multi-layered analysis for all categories
+
+                for row in probabilities:
+                    predicted = torch.argmax(row).item()
+                    label = adapter.labels[predicted]
+                    results.append({
+                        "label": label,
+                        "confidence": round(row[predicted].item(), 4),
+                        "scores": {name: row[k].item() for k, name in enumerate(adapter.labels)},
+                        "category_id": self.category_manager.get_category_id_by_name(label) or 0,
+                        "adapter": user_id
+                    })
+        return results
+
+    def _map_model_scores(self, probabilities_row: torch.Tensor, bundle: ModelBundle) -> Dict[str, float]:
+        """Map model label probabilities onto current category names"""
+        category_names = self.category_manager.get_category_names()
+        mapped_scores = {name: 0.0 for name in category_names}
+        id_map = bundle.model_label_to_category_id
+        for i in range(probabilities_row.shape[0]):
+            mapped_cat_id = id_map.get(i, i) if id_map else i
+            mapped_name = self.category_manager.get_category_by_id(mapped_cat_id) or 'Other'
+            score_val = probabilities_row[i].item()
+            # If multiple model labels map to same category, take max
+            mapped_scores[mapped_name] = max(mapped_scores.get(mapped_name, 0.0), score_val)
+        return mapped_scores
+
+    def _finalize_prediction(self, subject: str, body: str, scores: Dict[str, float]) -> Dict[str, Any]:
+        """Pick the best category from mapped scores and apply the rule layer"""
+        category_name, confidence = max(scores.items(), key=lambda x: x[1])
+        predicted_id = self.category_manager.get_category_id_by_name(category_name) or 0
+        if not category_name:
+            category_name = "Other"
+
+        # Apply comprehensive multi-layered analysis for all categories
+        with stage_timer('rule_layer'):
             final_category_name, final_confidence, final_category_id = self._apply_comprehensive_analysis(
                 subject, body, scores, category_name, confidence, predicted_id
             )
-            
-            category_name = final_category_name
-            confidence = final_confidence
-            predicted_id = final_category_id
-            
-            result = {
-                "label": category_name,
-                "confidence": round(confidence, 4),
-                "scores": scores,
-                "category_id": predicted_id
+
+        return {
+            "label": final_category_name,
+            "confidence": round(final_confidence, 4),
+            "scores": scores,
+            "category_id": final_category_id
+        }
+
+    def predict_rules_only(self, subject: str, body: str) -> Dict[str, Any]:
+        """
+        Degraded-mode prediction from category keywords and classification strategies alone
+
+        Used when the transformer queue is over budget. Keyword hits give base
+        scores capped at RULES_ONLY_BASE_CONFIDENCE, then the same rule layer as
+        a model prediction runs on top; the result is flagged degraded.
+        """
+        try:
+            text = f"{subject} {body}".lower()
+            hits = {
+                name: sum(1 for keyword in data.get("keywords", []) if keyword and keyword.lower() in text)
+                for name, data in self.category_manager.categories.items()
             }
-            
+            total = sum(hits.values())
+            scores = {name: RULES_ONLY_BASE_CONFIDENCE * count / total if total else 0.0 for name, count in hits.items()}
+            if not total:
+                scores["Other"] = RULES_ONLY_BASE_CONFIDENCE
+            result = self._finalize_prediction(subject, body, scores)
+        except Exception as e:
+            logger.error(f"Error in rules-only prediction: {e}")
+            result = {"label": "Other", "confidence": 0.0, "scores": {}, "category_id": 0, "error": str(e)}
+        result.update(tier="rules", degraded=True)
+        return result
+
+    def predict_batch_rules_only(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        return [self.predict_rules_only(email.get('subject', ''), email.get('body', '')) for email in emails]
+
+    def predict_single(self, subject: str, body: str, user_id: Optional[str] = None,
+                       bundle: Optional[ModelBundle] = None) -> Dict[str, Any]:
+        """
+        Predict category for single email (with the user's adapter if one exists)
+
+        Passing an unpublished bundle (shadow candidate, registry version) runs
+        that model itself: no user adapters (they are trained against the
+        published model), no prediction cache and no cascade first tier, whose
+        answers would stand in for the bundle's and count as production traffic.
+        """
+        try:
+            # Preprocess text
+            text = self.preprocess_text(subject, body)
+
+            # Every step below uses this bundle, even if a new model is published meanwhile
+            published = bundle is None
+            bundle = bundle or self.bundle
+
+            adapter = self._get_user_adapter(user_id, bundle) if published else None
+            if adapter is not None:
+                return self._predict_with_adapter(user_id, adapter, [text], bundle)[0]
+
+            # Check cache
+            cache_key = (bundle.version, hash(text))
+            if published:
+                cached = self.prediction_cache.get(cache_key)
+                record_cache_lookup('prediction', cached is not None)
+                if cached is not None:
+                    return cached
+
+            decision = self._first_tier_decisions([text])[0] if published else None
+            if decision is not None:
+                # Confident first-tier answer: skip the transformer entirely
+                scores = {name: decision['scores'].get(name, 0.0) for name in self.category_manager.get_category_names()}
+                result = self._finalize_prediction(subject, body, scores)
+                result["tier"] = "linear"
+            else:
+                # Tokenize
+                encodings = self.tokenize_batch([text], bundle)
+
+                # Get predictions
+                probabilities = self._forward_probabilities(encodings, bundle)
+
+                # Map model label indices -> current category IDs/names
+                scores = self._map_model_scores(probabilities[0], bundle)
+                result = self._finalize_prediction(subject, body, scores)
+
             # Cache result
-            if len(self.prediction_cache) < self.cache_size:
+            if published and len(self.prediction_cache) < self.cache_size:
                 self.prediction_cache[cache_key] = result
             
             return result
@@ -735,8 +1141,8 @@ class DynamicEmailClassifier:
                 "error": str(e)
             }
     
-    def predict_batch(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
-        """Predict categories for batch of emails"""
+    def predict_batch(self, emails: List[Dict[str, str]], bundle: Optional[ModelBundle] = None) -> List[Dict[str, Any]]:
+        """Predict categories for batch of emails (on an unpublished bundle as in predict_single, if given)"""
         try:
             if not emails:
                 return []
@@ -749,47 +1155,55 @@ class DynamicEmailClassifier:
                 text = self.preprocess_text(subject, body)
                 texts.append(text)
             
+            results = [None] * len(emails)
+            published = bundle is None
+            bundle = bundle or self.bundle
+
+            # Emails from users with their own adapter are batched per adapter
+            by_user = defaultdict(list)
+            for idx, email in enumerate(emails):
+                if email.get('user_id') and published:
+                    by_user[email['user_id']].append(idx)
+            for user_id, indices in by_user.items():
+                adapter = self._get_user_adapter(user_id, bundle)
+                if adapter is None:
+                    continue
+                user_results = self._predict_with_adapter(user_id, adapter, [texts[idx] for idx in indices], bundle)
+                for idx, result in zip(indices, user_results):
+                    results[idx] = result
+            pending = [idx for idx, result in enumerate(results) if result is None]
+
+            # Let the first tier answer what it can; only the rest reaches DistilBERT
+            category_names = self.category_manager.get_category_names()
+            decisions = self._first_tier_decisions([texts[idx] for idx in pending]) if published else []
+            for idx, decision in zip(pending, decisions):
+                if decision is None:
+                    continue
+                # Same rule layer as predict_single, so /predict and /predict/batch agree
+                scores = {name: decision['scores'].get(name, 0.0) for name in category_names}
+                result = self._finalize_prediction(emails[idx].get('subject', ''), emails[idx].get('body', ''), scores)
+                result["tier"] = "linear"
+                results[idx] = result
+            escalated = [idx for idx, result in enumerate(results) if result is None]
+
             # Process in chunks for memory efficiency
-            results = []
-            for i in range(0, len(texts), self.batch_size):
-                chunk_texts = texts[i:i + self.batch_size]
-                chunk_emails = emails[i:i + self.batch_size]
-                
+            for i in range(0, len(escalated), self.batch_size):
+                chunk_indices = escalated[i:i + self.batch_size]
+                chunk_texts = [texts[idx] for idx in chunk_indices]
+
                 # Tokenize chunk
-                encodings = self.tokenize_batch(chunk_texts)
+                encodings = self.tokenize_batch(chunk_texts, bundle)
                 
                 # Get predictions
-                with torch.no_grad():
-                    outputs = self.model(**encodings)
-                    logits = outputs.logits
-                    probabilities = torch.softmax(logits, dim=1)
+                probabilities = self._forward_probabilities(encodings, bundle)
                 
-                # Process results
-                for j, email in enumerate(chunk_emails):
-                    predicted_id = torch.argmax(probabilities[j], dim=0).item()
-                    confidence = probabilities[j][predicted_id].item()
-                    
-                    # Get category name
-                    category_name = self.category_manager.get_category_by_id(predicted_id)
-                    if not category_name:
-                        category_name = "Other"
-                    
-                    # Create scores dictionary
-                    category_names = self.category_manager.get_category_names()
-                    scores = {}
-                    for k, name in enumerate(category_names):
-                        if k < probabilities.shape[1]:
-                            scores[name] = probabilities[j][k].item()
-                    
-                    result = {
-                        "label": category_name,
-                        "confidence": round(confidence, 4),
-                        "scores": scores,
-                        "category_id": predicted_id
-                    }
-                    
-                    results.append(result)
-            
+                # Map model label indices -> current category IDs/names, then the rule layer, as in predict_single
+                for j, idx in enumerate(chunk_indices):
+                    scores = self._map_model_scores(probabilities[j], bundle)
+                    results[idx] = self._finalize_prediction(
+                        emails[idx].get('subject', ''), emails[idx].get('body', ''), scores
+                    )
+
             return results
             
         except Exception as e:
@@ -852,7 +1266,8 @@ class DynamicEmailClassifier:
             "categories": self.category_manager.get_categories(),
             "num_categories": len(self.category_manager.get_categories()),
             "cache_size": len(self.prediction_cache),
-            "status": "ready" if self.model is not None else "not_loaded"
+            "status": "ready" if self.model is not None else "not_loaded",
+            "bundle": self.bundle.describe() if self.bundle else None
         }
     
     def clear_cache(self):
@@ -868,7 +1283,13 @@ class DynamicEmailClassifier:
             "batch_size": self.batch_size,
             "max_batch_size": self.max_batch_size,
             "device": str(self.device),
-            "categories_count": len(self.category_manager.get_categories())
+            "categories_count": len(self.category_manager.get_categories()),
+            "cascade_enabled": self.first_tier is not None,
+            "cascade": self.cascade_stats.snapshot(),
+            "early_exit_enabled": self.exit_heads is not None and self.early_exit_threshold > 0,
+            "early_exit_threshold": self.early_exit_threshold,
+            "early_exit": self.early_exit_stats.snapshot(),
+            "adapters": self.adapter_registry.snapshot()
         }
     
     def extract_category_features(self, category_name: str, category_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -886,7 +1307,8 @@ class DynamicEmailClassifier:
             text_content = f"{category_data.get('description', '')} {' '.join(category_data.get('keywords', []))}"
             
             # Generate embedding using the model
-            inputs = self.tokenizer(
+            bundle = self.bundle
+            inputs = bundle.tokenizer(
                 text_content,
                 max_length=128,
                 padding=True,
@@ -895,7 +1317,7 @@ class DynamicEmailClassifier:
             )
             
             with torch.no_grad():
-                outputs = self.model(**inputs, output_hidden_states=True)
+                outputs = bundle.model(**inputs, output_hidden_states=True)
                 # Use [CLS] token embedding as category representation
                 embedding = outputs.hidden_states[-1][:, 0, :].cpu().numpy()
             
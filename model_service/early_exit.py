@@ -0,0 +1,326 @@
+"""
+Layer-wise Early-Exit Inference for DistilBERT
+Small classifier heads after intermediate layers let easy emails skip the remaining layers
+"""
+
+import torch
+import torch.nn as nn
+import numpy as np
+import logging
+import json
+import os
+import time
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXIT_HEADS_FILE = "exit_heads.pt"
+EXIT_CONFIG_FILE = "early_exit_config.json"
+
+class EarlyExitHeads(nn.Module):
+    """Classifier heads attached after intermediate DistilBERT layers"""
+
+    def __init__(self, dim: int, num_labels: int, exit_layers: List[int], dropout: float = 0.1):
+        super().__init__()
+        self.dim = dim
+        self.num_labels = num_labels
+        self.exit_layers = sorted(exit_layers)
+        self.dropout = dropout
+
+        # Same shape as DistilBertForSequenceClassification's pre_classifier + classifier
+        self.heads = nn.ModuleDict({
+            str(layer_idx): nn.Sequential(
+                nn.Linear(dim, dim),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+                nn.Linear(dim, num_labels)
+            )
+            for layer_idx in self.exit_layers
+        })
+
+    def forward(self, layer_idx: int, cls_hidden: torch.Tensor) -> torch.Tensor:
+        return self.heads[str(layer_idx)](cls_hidden)
+
+    def save(self, model_dir: str):
+        """Save heads next to the fine-tuned model"""
+        os.makedirs(model_dir, exist_ok=True)
+        torch.save(self.state_dict(), os.path.join(model_dir, EXIT_HEADS_FILE))
+        with open(os.path.join(model_dir, EXIT_CONFIG_FILE), "w") as f:
+            json.dump({
+                "dim": self.dim,
+                "num_labels": self.num_labels,
+                "exit_layers": self.exit_layers,
+                "dropout": self.dropout
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, model_dir: str, map_location: str = "cpu") -> Optional['EarlyExitHeads']:
+        """Load heads from a model directory, or None if it has none"""
+        config_path = os.path.join(model_dir, EXIT_CONFIG_FILE)
+        weights_path = os.path.join(model_dir, EXIT_HEADS_FILE)
+        if not (os.path.exists(config_path) and os.path.exists(weights_path)):
+            return None
+
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        heads = cls(config["dim"], config["num_labels"], config["exit_layers"], config.get("dropout", 0.1))
+        heads.load_state_dict(torch.load(weights_path, map_location=map_location, mmap=True, weights_only=True))
+        heads.eval()
+        return heads
+
+def heads_match_model(heads: EarlyExitHeads, model) -> bool:
+    """Whether exit heads were trained for this model's hidden size and current classifier labels"""
+    classifier = getattr(model, "classifier", None)
+    return (
+        classifier is not None
+        and heads.num_labels == classifier.out_features
+        and heads.dim == getattr(model.config, "dim", heads.dim)
+    )
+
+def normalized_entropy(probabilities: torch.Tensor) -> torch.Tensor:
+    """Entropy of each row divided by log(num_labels), in [0, 1]"""
+    num_labels = probabilities.shape[-1]
+    entropy = -(probabilities * torch.log(probabilities.clamp_min(1e-12))).sum(dim=-1)
+    return entropy / max(np.log(num_labels), 1e-12)
+
+def _prepare_layer_mask(distilbert, embeddings: torch.Tensor, attention_mask: torch.Tensor):
+    """Build the attention mask the transformer layers expect for this transformers version"""
+    try:
+        # transformers >= 5: masks are built once by the model
+        from transformers.masking_utils import create_bidirectional_mask
+        return create_bidirectional_mask(
+            config=distilbert.config,
+            inputs_embeds=embeddings,
+            attention_mask=attention_mask,
+        )
+    except ImportError:
+        pass
+
+    if getattr(distilbert, "_use_sdpa", False):
+        from transformers.modeling_attn_mask_utils import _prepare_4d_attention_mask_for_sdpa
+        return _prepare_4d_attention_mask_for_sdpa(attention_mask, embeddings.dtype, tgt_len=embeddings.shape[1])
+
+    # Eager attention takes the (batch, seq_len) padding mask directly
+    return attention_mask
+
+def _run_layer(layer, hidden: torch.Tensor, mask) -> torch.Tensor:
+    out = layer(hidden, mask)
+    # Older transformers return a tuple whose last element is the hidden state
+    return out[-1] if isinstance(out, tuple) else out
+
+def _final_head(model, cls_hidden: torch.Tensor) -> torch.Tensor:
+    pooled = nn.functional.relu(model.pre_classifier(cls_hidden))
+    return model.classifier(model.dropout(pooled))
+
+@torch.no_grad()
+def early_exit_forward(
+    model,
+    heads: EarlyExitHeads,
+    input_ids: torch.Tensor,
+    attention_mask: torch.Tensor,
+    entropy_threshold: float
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Run a DistilBertForSequenceClassification layer by layer, retiring rows early
+
+    Rows whose exit-head prediction has normalized entropy below the threshold stop
+    at that layer; the remaining rows continue as a smaller batch.
+
+    Returns:
+        Tuple of (probabilities [batch, num_labels], layers_executed [batch])
+    """
+    if not heads_match_model(heads, model):
+        raise ValueError(
+            f"Exit heads predict {heads.num_labels} labels but the classifier has {model.classifier.out_features}"
+        )
+
+    distilbert = model.distilbert
+    layers = distilbert.transformer.layer
+    num_layers = len(layers)
+    batch_size = input_ids.shape[0]
+
+    hidden = distilbert.embeddings(input_ids)
+    mask = _prepare_layer_mask(distilbert, hidden, attention_mask)
+
+    # Sized from the final head, which is what every row that does not exit early goes through
+    probabilities = torch.zeros(batch_size, model.classifier.out_features, device=hidden.device)
+    layers_executed = torch.full((batch_size,), num_layers, dtype=torch.long, device=hidden.device)
+    active = torch.arange(batch_size, device=hidden.device)
+
+    for layer_idx, layer in enumerate(layers):
+        hidden = _run_layer(layer, hidden, mask)
+
+        if layer_idx == num_layers - 1:
+            probabilities[active] = torch.softmax(_final_head(model, hidden[:, 0]), dim=-1)
+            break
+
+        if layer_idx not in heads.exit_layers:
+            continue
+
+        exit_probs = torch.softmax(heads(layer_idx, hidden[:, 0]), dim=-1)
+        done = normalized_entropy(exit_probs) < entropy_threshold
+        if not done.any():
+            continue
+
+        probabilities[active[done]] = exit_probs[done]
+        layers_executed[active[done]] = layer_idx + 1
+
+        keep = ~done
+        if not keep.any():
+            break
+        active = active[keep]
+        hidden = hidden[keep]
+        if mask is not None:
+            mask = mask[keep]
+
+    return probabilities, layers_executed
+
+def collect_cls_states(model, tokenizer, texts: List[str], max_length: int, batch_size: int = 32) -> torch.Tensor:
+    """CLS hidden state after every transformer layer: [num_texts, num_layers, dim]"""
+    device = next(model.parameters()).device
+    states = []
+    model.eval()
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            encodings = tokenizer(
+                texts[i:i + batch_size],
+                truncation=True,
+                padding=True,
+                max_length=max_length,
+                return_tensors="pt"
+            )
+            encodings = {k: v.to(device) for k, v in encodings.items()}
+            outputs = model.distilbert(**encodings, output_hidden_states=True)
+            # hidden_states[0] is the embedding output
+            per_layer = torch.stack([h[:, 0] for h in outputs.hidden_states[1:]], dim=1)
+            states.append(per_layer.cpu())
+    return torch.cat(states, dim=0)
+
+def train_exit_heads(
+    model,
+    cls_states: torch.Tensor,
+    labels: List[int],
+    exit_layers: List[int],
+    num_epochs: int = 5,
+    learning_rate: float = 1e-3,
+    batch_size: int = 64
+) -> EarlyExitHeads:
+    """Post-hoc training of exit heads on frozen backbone features"""
+    heads = EarlyExitHeads(model.config.dim, model.config.num_labels, exit_layers)
+    optimizer = torch.optim.AdamW(heads.parameters(), lr=learning_rate, weight_decay=0.01)
+    loss_fn = nn.CrossEntropyLoss()
+    targets = torch.tensor(labels, dtype=torch.long)
+
+    heads.train()
+    for epoch in range(num_epochs):
+        permutation = torch.randperm(len(targets))
+        epoch_loss = 0.0
+        for i in range(0, len(targets), batch_size):
+            idx = permutation[i:i + batch_size]
+            loss = sum(loss_fn(heads(layer_idx, cls_states[idx, layer_idx]), targets[idx])
+                       for layer_idx in heads.exit_layers)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(idx)
+        logger.info(f"Exit heads epoch {epoch + 1}/{num_epochs}: loss {epoch_loss / max(len(targets), 1):.4f}")
+
+    heads.eval()
+    return heads
+
+def evaluate_early_exit(
+    model,
+    tokenizer,
+    heads: EarlyExitHeads,
+    texts: List[str],
+    labels: List[int],
+    max_length: int,
+    entropy_thresholds: Tuple[float, ...] = (0.1, 0.2, 0.3, 0.4),
+    batch_size: int = 32
+) -> Dict[str, Any]:
+    """Compare full-depth inference with early exit at several entropy thresholds"""
+    device = next(model.parameters()).device
+    model.eval()
+    heads.to(device)
+    num_layers = len(model.distilbert.transformer.layer)
+
+    batches = []
+    for i in range(0, len(texts), batch_size):
+        encodings = tokenizer(
+            texts[i:i + batch_size],
+            truncation=True,
+            padding=True,
+            max_length=max_length,
+            return_tensors="pt"
+        )
+        batches.append({k: v.to(device) for k, v in encodings.items()})
+
+    def full_depth():
+        preds = []
+        with torch.no_grad():
+            for enc in batches:
+                preds.extend(torch.argmax(model(**enc).logits, dim=-1).tolist())
+        return preds
+
+    start = time.perf_counter()
+    full_preds = full_depth()
+    full_seconds = time.perf_counter() - start
+
+    report = {
+        "num_layers": num_layers,
+        "exit_layers": heads.exit_layers,
+        "full": {
+            "accuracy": float(np.mean(np.array(full_preds) == np.array(labels))) if labels else 0.0,
+            "ms_per_email": full_seconds * 1000.0 / max(len(texts), 1)
+        },
+        "thresholds": {}
+    }
+
+    for threshold in entropy_thresholds:
+        preds, depths = [], []
+        start = time.perf_counter()
+        for enc in batches:
+            probs, executed = early_exit_forward(model, heads, enc["input_ids"], enc["attention_mask"], threshold)
+            preds.extend(torch.argmax(probs, dim=-1).tolist())
+            depths.extend(executed.tolist())
+        seconds = time.perf_counter() - start
+
+        report["thresholds"][str(threshold)] = {
+            "accuracy": float(np.mean(np.array(preds) == np.array(labels))) if labels else 0.0,
+            "avg_layers_executed": float(np.mean(depths)) if depths else float(num_layers),
+            "ms_per_email": seconds * 1000.0 / max(len(texts), 1),
+            "latency_saving": 1.0 - seconds / max(full_seconds, 1e-9)
+        }
+
+    return report
+
+class EarlyExitStats:
+    """Thread-safe running count of layers executed per email"""
+
+    def __init__(self, num_layers: int = 6):
+        self.lock = threading.Lock()
+        self.num_layers = num_layers
+        self.emails = 0
+        self.layers_executed = 0
+        self.exits_per_layer = {}
+
+    def record(self, layers_executed: torch.Tensor):
+        values = layers_executed.tolist()
+        with self.lock:
+            self.emails += len(values)
+            self.layers_executed += sum(values)
+            for depth in values:
+                self.exits_per_layer[depth] = self.exits_per_layer.get(depth, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            avg = self.layers_executed / self.emails if self.emails else float(self.num_layers)
+            return {
+                "emails": self.emails,
+                "avg_layers_executed": avg,
+                "layer_fraction_saved": 1.0 - avg / max(self.num_layers, 1),
+                "exits_per_layer": {str(k): v for k, v in sorted(self.exits_per_layer.items())}
+            }
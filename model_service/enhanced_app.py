@@ -3,9 +3,10 @@ Enhanced ML Service with Dynamic Category Management and Real-time Synchronizati
 Supports adding/removing categories without model retraining
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 from dotenv import load_dotenv
 import os
 import asyncio
@@ -16,9 +17,22 @@ from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 from dynamic_classifier import DynamicEmailClassifier
 from ensemble_classifier import EnsembleEmailClassifier
-from training_pipeline import ModelTrainingPipeline
-from data_collection import TrainingDataCollector
-from distilbert_trainer import DistilBERTTrainer
+from cascade_classifier import LinearFirstTier
+from feature_schema import FEATURE_SCHEMA
+from service_metrics import (
+    METRICS, REQUESTS, REQUEST_LATENCY, STAGE_LATENCY, BATCH_SIZE, MODEL_INFO, SCHEDULER_QUEUE_DEPTH, OVERLOAD,
+    observe_stage, stage_timer, set_cache_totals
+)
+import domain_utils
+from profiling import install_profiling
+from shadow_evaluator import ShadowEvaluator, SHADOW_SAMPLE_RATE
+from model_registry import ModelRegistry
+from training_jobs import JobStore, TrainingJobRunner
+from request_scheduler import RequestScheduler, DeadlineExceeded
+import collections
+import contextvars
+import functools
+import importlib
 import threading
 import time
 
@@ -45,12 +59,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Count requests and time them per route template (not per raw path)"""
+    start = time.perf_counter()
+    request_start.set(start)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(status))
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+
+# Admin profiling endpoints and sampled stage logs (no-op unless enabled by env)
+install_profiling(app)
+
 # Global variables
 classifier = None
 ensemble_classifier = None
 training_pipeline = None
 data_collector = None
-distilbert_trainer = None
+# DistilBERT fine-tuning runs in a separate worker process fed from a persistent job queue
+training_runner = None
+# Inference runs on the scheduler's threads, ordered by lane (X-Request-Lane) and tenant
+scheduler = RequestScheduler()
+# Lanes answered from the rule layer alone when the model queue is over budget; other lanes get 503
+DEGRADED_MODE_LANES = {lane for lane in os.getenv("DEGRADED_MODE_LANES", "interactive,sync").split(",") if lane}
+# /predict/stream: emails per micro-batch, how long a partial micro-batch waits for more input,
+# micro-batches in inference at once, and the longest accepted input line
+STREAM_MICRO_BATCH = int(os.getenv("STREAM_MICRO_BATCH", "32"))
+STREAM_MAX_BATCH_DELAY_MS = float(os.getenv("STREAM_MAX_BATCH_DELAY_MS", "50"))
+STREAM_MAX_PENDING_BATCHES = int(os.getenv("STREAM_MAX_PENDING_BATCHES", "4"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+# Candidate model receiving a sampled copy of /predict traffic, if any
+shadow_evaluator = None
+# Extra resident model versions, selected per request by header or tenant
+model_registry = None
+# Models load in the background after startup; /ready turns 200 once they are warm
+readiness = {"status": "starting", "error": None, "started_at": time.time(), "ready_seconds": None}
 websocket_connections = set()
 performance_stats = {
     "total_predictions": 0,
@@ -59,6 +109,116 @@ performance_stats = {
     "last_prediction_time": None,
     "uptime_start": datetime.now()
 }
+# Endpoints run on the event loop and in worker threads; guard the read-modify-write updates
+performance_stats_lock = threading.Lock()
+
+# perf_counter() at which the current request entered the service
+request_start = contextvars.ContextVar("request_start", default=None)
+
+def record_prediction(confidence: Optional[float] = None, batch: bool = False):
+    """Update the running prediction counters and average confidence"""
+    with performance_stats_lock:
+        if batch:
+            performance_stats["total_batch_predictions"] += 1
+        else:
+            performance_stats["total_predictions"] += 1
+            total_preds = performance_stats["total_predictions"]
+            current_avg = performance_stats["average_confidence"]
+            performance_stats["average_confidence"] = (
+                (current_avg * (total_preds - 1) + confidence) / total_preds
+            )
+        performance_stats["last_prediction_time"] = datetime.now().isoformat()
+
+def observe_request_parse():
+    """Time between the request reaching the service and its handler starting (body read and validation)"""
+    start = request_start.get()
+    if start is not None:
+        observe_stage('request_parse', time.perf_counter() - start)
+
+def request_lane(request: Request, default: str) -> str:
+    """Scheduler lane named by X-Request-Lane (interactive, sync or bulk), else the endpoint default"""
+    return scheduler.resolve_lane(request.headers.get("x-request-lane"), default)
+
+def request_tenant(request: Request, user_id: Optional[str]) -> Optional[str]:
+    """Fair-queuing key: X-Tenant-Id, else the email's user"""
+    return request.headers.get("x-tenant-id") or user_id
+
+def request_model_version(request: Request, user_id: Optional[str]) -> Optional[str]:
+    """Registry version for an email: X-Model-Version, else the route of its tenant (X-Tenant-Id, else the user)"""
+    version = request.headers.get("x-model-version")
+    if version or model_registry is None:
+        return version
+    return model_registry.version_for(request_tenant(request, user_id))
+
+async def registry_bundle(version: str):
+    """Resident bundle for a registry version (loaded off the event loop on a miss); 404 if unknown"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, model_registry.get, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def map_by_version(request: Request, lane: str, tenant: Optional[str], fn, items: List[Dict[str, Any]],
+                         deadline: Optional[float]) -> List[Dict[str, Any]]:
+    """
+    fn over items in scheduled chunks, each email on the model version it is routed to
+
+    Emails routed to a registry version run as fn(chunk, bundle=...) and their
+    results carry model_version; the rest use the production model. Results
+    are in input order.
+    """
+    groups = collections.defaultdict(list)
+    for idx, item in enumerate(items):
+        groups[request_model_version(request, item.get("user_id"))].append(idx)
+    results = [None] * len(items)
+    
+    async def run_group(version: Optional[str], indices: List[int]):
+        group_fn = functools.partial(fn, bundle=await registry_bundle(version)) if version else fn
+        group_results = await scheduler.map_chunks(
+            lane, tenant, group_fn, [items[idx] for idx in indices], deadline=deadline
+        )
+        for idx, result in zip(indices, group_results):
+            if version:
+                result["model_version"] = version
+            results[idx] = result
+    
+    await asyncio.gather(*(run_group(version, indices) for version, indices in groups.items()))
+    return results
+
+def request_deadline(request: Request, lane: str) -> Optional[float]:
+    """Deadline from X-Request-Timeout-Ms (the caller's remaining budget), else the lane default"""
+    try:
+        timeout_ms = float(request.headers.get("x-request-timeout-ms") or 0)
+    except ValueError:
+        timeout_ms = 0
+    return scheduler.deadline_for(lane, timeout_ms, request_start.get())
+
+def overload_action(lane: str, deadline: Optional[float], cost: int = 1) -> Optional[str]:
+    """
+    None to queue for the model, "degrade" to answer from the rule layer, "reject" to shed
+
+    The model is skipped when the lane's queue is at its limit or when the
+    estimated queue time would already miss the request's deadline.
+    """
+    over_budget = scheduler.queue_full(lane) or (
+        deadline is not None and time.perf_counter() + scheduler.estimated_wait(lane, cost) > deadline
+    )
+    if not over_budget:
+        return None
+    action = "degrade" if lane in DEGRADED_MODE_LANES else "reject"
+    OVERLOAD.inc(lane=lane, action="degraded" if action == "degrade" else "rejected")
+    if action == "reject":
+        raise HTTPException(
+            status_code=503, detail=f"Model queue for lane '{lane}' is over budget", headers={"Retry-After": "5"}
+        )
+    return action
+
+def deadline_exceeded(lane: str) -> HTTPException:
+    OVERLOAD.inc(lane=lane, action="expired")
+    return HTTPException(status_code=504, detail="Request deadline passed before the model could run it")
+
+async def run_rules_only(fn, *args):
+    """Degraded answers skip the scheduler so they never wait behind model work"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
 
 # Pydantic models
 class EmailInput(BaseModel):
@@ -80,6 +240,9 @@ class EnsembleEmailInput(BaseModel):
 class BatchEmailInput(BaseModel):
     emails: List[EmailInput] = Field(..., description="List of emails to classify")
 
+class BatchEnsembleEmailInput(BaseModel):
+    emails: List[EnsembleEmailInput] = Field(..., description="List of emails to classify")
+
 class CategoryInput(BaseModel):
     name: str = Field(..., description="Category name")
     description: str = Field("", description="Category description")
@@ -97,6 +260,9 @@ class PredictionResponse(BaseModel):
     confidence: float
     scores: Dict[str, float]
     category_id: int
+    model_version: Optional[str] = None
+    # True when answered by the keyword/strategy rule layer alone because the model was overloaded
+    degraded: bool = False
     error: Optional[str] = None
 
 class EnsemblePredictionResponse(BaseModel):
@@ -108,6 +274,11 @@ class EnsemblePredictionResponse(BaseModel):
     featureContributions: Optional[Dict[str, Any]] = None
     features: Optional[Dict[str, Any]] = None
     extractionTime: Optional[float] = None
+    distilbertTime: Optional[float] = None
+    featureExtractionTime: Optional[float] = None
+    featureModelTime: Optional[float] = None
+    model_version: Optional[str] = None
+    degraded: bool = False
     error: Optional[str] = None
 
 class CategoryResponse(BaseModel):
@@ -127,6 +298,9 @@ class PerformanceStats(BaseModel):
     uptime_seconds: float
     cache_size: int
     categories_count: int
+    # count/mean/p50/p95/p99 in seconds, keyed by endpoint or stage
+    endpoint_latency: Optional[Dict[str, Dict[str, float]]] = None
+    stage_latency: Optional[Dict[str, Dict[str, float]]] = None
 
 class TrainingInput(BaseModel):
     classification_strategy: Optional[Dict[str, Any]] = Field(None, description="Classification strategy")
@@ -137,6 +311,7 @@ class TrainingResponse(BaseModel):
     message: str
     training_metrics: Optional[Dict[str, Any]] = None
     confidence_improvement: Optional[float] = None
+    job_id: Optional[str] = None
 
 class TrainingSampleInput(BaseModel):
     subject: str
@@ -194,30 +369,65 @@ manager = ConnectionManager()
 # Initialize classifier
 @app.on_event("startup")
 async def startup_event():
-    global classifier, ensemble_classifier
+    # Serve /health and /ready right away; loading and warm-up happen off the event loop.
+    # Workers forked by prefork_server.py inherit models that are already loaded.
+    if readiness["status"] != "ready":
+        asyncio.create_task(load_models())
+    
+    # Start performance monitoring
+    asyncio.create_task(performance_monitor())
+    
+    # Resume queued training jobs and relay job progress to /ws clients
+    global training_runner
+    training_runner = TrainingJobRunner(JobStore())
+    asyncio.create_task(training_runner.watch(handle_training_job_event))
+
+def initialize_models():
+    """Load the configured model (SERVING_MODEL_DIR, else the base model), warm it and mark the service ready"""
+    global classifier, ensemble_classifier, model_registry
+    logger.info("Initializing enhanced ML classifier...")
+    classifier = DynamicEmailClassifier()
+    model_registry = ModelRegistry(classifier, resolver=resolve_model_version)
+    logger.info("✅ Enhanced ML classifier initialized successfully")
+    
+    # Optional linear first tier in front of DistilBERT
+    cascade_dir = os.getenv('CASCADE_MODEL_DIR')
+    if cascade_dir:
+        try:
+            classifier.attach_first_tier(LinearFirstTier.load(cascade_dir))
+            logger.info(f"✅ Cascade first tier loaded from {cascade_dir}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load cascade first tier from {cascade_dir}: {e}")
+    
+    # Initialize ensemble classifier
+    logger.info("Initializing ensemble email classifier...")
+    ensemble_classifier = EnsembleEmailClassifier(
+        distilbert_model=classifier,
+        feature_model_type='xgboost',
+        distilbert_weight=float(os.getenv('ENSEMBLE_DISTILBERT_WEIGHT', '0.6')),
+        feature_weight=float(os.getenv('ENSEMBLE_FEATURE_WEIGHT', '0.4'))
+    )
+    logger.info("✅ Ensemble classifier initialized successfully")
+    
+    # First requests would otherwise pay for allocator growth and kernel selection
+    classifier.warm_up()
+    readiness.update(status="ready", ready_seconds=time.time() - readiness["started_at"])
+    logger.info(f"✅ Service ready in {readiness['ready_seconds']:.1f}s")
+
+async def load_models():
+    """Background startup task around initialize_models"""
     try:
-        logger.info("Initializing enhanced ML classifier...")
-        classifier = DynamicEmailClassifier()
-        logger.info("✅ Enhanced ML classifier initialized successfully")
-        
-        # Initialize ensemble classifier
-        logger.info("Initializing ensemble email classifier...")
-        ensemble_classifier = EnsembleEmailClassifier(
-            distilbert_model=classifier,
-            feature_model_type='xgboost',
-            distilbert_weight=float(os.getenv('ENSEMBLE_DISTILBERT_WEIGHT', '0.6')),
-            feature_weight=float(os.getenv('ENSEMBLE_FEATURE_WEIGHT', '0.4'))
-        )
-        logger.info("✅ Ensemble classifier initialized successfully")
-        
-        # Start performance monitoring
-        asyncio.create_task(performance_monitor())
-        
+        await asyncio.get_running_loop().run_in_executor(None, initialize_models)
     except Exception as e:
         logger.error(f"❌ Failed to initialize classifier: {e}")
-        # Don't raise in test environment
-        if not os.getenv("TESTING"):
-            raise
+        readiness.update(status="failed", error=str(e))
+
+def resolve_model_version(version: str) -> Optional[str]:
+    """Checkpoint path of a ModelVersion row (its model_name), for versions not registered explicitly"""
+    # Imported here: the module opens its database on import
+    from database_schema import db_manager
+    model_version = db_manager.get_model_version(version)
+    return model_version["model_name"] if model_version else None
 
 # Initialize classifier for testing
 def initialize_classifier():
@@ -242,15 +452,18 @@ async def performance_monitor():
         try:
             if classifier:
                 stats = classifier.get_performance_stats()
-                performance_stats.update({
-                    "cache_size": stats["cache_size"],
-                    "categories_count": stats["categories_count"]
-                })
+                with performance_stats_lock:
+                    performance_stats.update({
+                        "cache_size": stats["cache_size"],
+                        "categories_count": stats["categories_count"]
+                    })
             
             # Broadcast performance update
+            with performance_stats_lock:
+                snapshot = dict(performance_stats)
             await manager.broadcast({
                 "type": "performance_update",
-                "data": performance_stats
+                "data": snapshot
             })
             
             await asyncio.sleep(5 * 60)  # Update every 5 minutes
@@ -262,7 +475,9 @@ async def performance_monitor():
 # Health check endpoints
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (liveness: fails only if model loading failed for good)"""
+    if readiness["status"] == "failed" and not os.getenv("TESTING"):
+        return JSONResponse(status_code=503, content={"status": "ERROR", "error": readiness["error"]})
     return {
         "status": "OK",
         "timestamp": datetime.now().isoformat(),
@@ -271,6 +486,13 @@ async def health_check():
         "categories_count": len(classifier.get_categories()) if classifier else 0
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the model is loaded and warmed up, 503 before that"""
+    if readiness["status"] != "ready":
+        return JSONResponse(status_code=503, content=readiness)
+    return {**readiness, "model": classifier.bundle.describe() if classifier and classifier.bundle else None}
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -304,63 +526,293 @@ async def model_status():
 
 # Classification endpoints
 @app.post("/predict", response_model=PredictionResponse)
-async def predict_email(email: EmailInput):
-    """Predict email category"""
+async def predict_email(email: EmailInput, request: Request):
+    """Predict email category (with a registry version if X-Model-Version or the tenant's route names one)"""
     if classifier is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    observe_request_parse()
+    lane = request_lane(request, "interactive")
+    tenant = request_tenant(request, email.user_id)
+    deadline = request_deadline(request, lane)
+    version = request_model_version(request, email.user_id)
     try:
-        # Use user_id for dynamic categories if provided
-        if email.user_id:
+        if overload_action(lane, deadline) == "degrade":
+            result = await run_rules_only(classifier.predict_rules_only, email.subject, email.body)
+        elif version:
+            bundle = await registry_bundle(version)
+            result = await scheduler.submit(
+                lane, tenant, functools.partial(classifier.predict_single, email.subject, email.body, bundle=bundle),
+                deadline=deadline
+            )
+            result["model_version"] = version
+        # Users with a trained adapter get their own categories over the shared encoder
+        elif email.user_id:
             logger.info(f"Classifying email for user: {email.user_id}")
-            # For now, we'll use the same prediction but this allows for future user-specific enhancements
-            result = classifier.predict_single(email.subject, email.body)
+            result = await scheduler.submit(
+                lane, tenant, functools.partial(classifier.predict_single, email.subject, email.body, user_id=email.user_id),
+                deadline=deadline
+            )
             logger.info(f"Classification result: {result.get('label', 'Unknown')} (confidence: {result.get('confidence', 0.0)})")
         else:
-            result = classifier.predict_single(email.subject, email.body)
+            result = await scheduler.submit(
+                lane, tenant, classifier.predict_single, email.subject, email.body, deadline=deadline
+            )
+            # Adapters belong to the production model, so only shared-model traffic is shadowed
+            if shadow_evaluator is not None:
+                shadow_evaluator.offer(email.subject, email.body, result)
         
         # Update performance stats
-        performance_stats["total_predictions"] += 1
-        performance_stats["last_prediction_time"] = datetime.now().isoformat()
-        
-        # Update average confidence
-        total_preds = performance_stats["total_predictions"]
-        current_avg = performance_stats["average_confidence"]
-        performance_stats["average_confidence"] = (
-            (current_avg * (total_preds - 1) + result["confidence"]) / total_preds
-        )
+        record_prediction(result["confidence"])
         
-        return PredictionResponse(**result)
+        with stage_timer('serialization'):
+            return PredictionResponse(**result)
+    except HTTPException:
+        raise
+    except DeadlineExceeded:
+        raise deadline_exceeded(lane)
     except Exception as e:
         logger.error(f"Prediction failed: {e}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/predict/batch", response_model=List[PredictionResponse])
-async def predict_batch_emails(batch: BatchEmailInput):
-    """Predict categories for multiple emails"""
+async def predict_batch_emails(batch: BatchEmailInput, request: Request):
+    """Predict categories for multiple emails (sync lane by default; reclassification sends X-Request-Lane: bulk)"""
     if classifier is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    observe_request_parse()
+    BATCH_SIZE.observe(len(batch.emails), endpoint="/predict/batch")
+    lane = request_lane(request, "sync")
+    deadline = request_deadline(request, lane)
     try:
         # Convert to list of dicts
-        emails_list = [{"subject": email.subject, "body": email.body} for email in batch.emails]
-        results = classifier.predict_batch(emails_list)
+        emails_list = [
+            {"subject": email.subject, "body": email.body, "user_id": email.user_id}
+            for email in batch.emails
+        ]
+        tenant = request_tenant(request, batch.emails[0].user_id if batch.emails else None)
+        if overload_action(lane, deadline, len(emails_list)) == "degrade":
+            results = await run_rules_only(classifier.predict_batch_rules_only, emails_list)
+        else:
+            results = await map_by_version(request, lane, tenant, classifier.predict_batch, emails_list, deadline)
         
         # Update performance stats
-        performance_stats["total_batch_predictions"] += 1
-        performance_stats["last_prediction_time"] = datetime.now().isoformat()
+        record_prediction(batch=True)
         
-        return [PredictionResponse(**result) for result in results]
+        with stage_timer('serialization'):
+            return [PredictionResponse(**result) for result in results]
+    except HTTPException:
+        raise
+    except DeadlineExceeded:
+        raise deadline_exceeded(lane)
     except Exception as e:
         logger.error(f"Batch prediction failed: {e}")
         raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
 
+def parse_stream_line(line: bytes, line_number: int) -> Optional[Dict[str, Any]]:
+    """One NDJSON input line as a stream item: the email to classify, or the reason it was rejected"""
+    if not line.strip():
+        return None
+    data = None
+    try:
+        data = json.loads(line)
+        email = EmailInput(**data)
+    except (ValueError, TypeError) as e:
+        # pydantic's ValidationError is a ValueError; name the offending fields rather than its multi-line text
+        reason = "; ".join(
+            f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+        ) if hasattr(e, "errors") else str(e)
+        item_id = data.get("id") if isinstance(data, dict) else None
+        return {"line": line_number, "id": item_id, "error": f"Invalid email: {reason}"}
+    return {
+        "line": line_number,
+        "id": data.get("id", line_number),
+        "email": {"subject": email.subject, "body": email.body, "user_id": email.user_id},
+    }
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse sent while the endpoint is still reading the request body
+
+    Under ASGI < 2.4 Starlette watches for a disconnect by calling receive()
+    during the response, which would swallow body chunks the endpoint has not
+    read yet; here that only starts once `body_read` is set.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive):
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
+async def read_stream_items(request: Request, items: asyncio.Queue, body_read: asyncio.Event):
+    """
+    Parse the request body into `items` as it arrives, then put None
+
+    The queue is bounded, so while the response side is behind this stops
+    pulling the body and the client is held back by TCP flow control.
+    """
+    buffer = b""
+    line_number = 0
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            while True:
+                newline = buffer.find(b"\n")
+                if newline < 0:
+                    break
+                line, buffer = buffer[:newline], buffer[newline + 1:]
+                line_number += 1
+                item = parse_stream_line(line, line_number)
+                if item is not None:
+                    await items.put(item)
+            if len(buffer) > STREAM_MAX_LINE_BYTES:
+                await items.put({"line": line_number + 1, "id": None,
+                                 "error": f"Line longer than {STREAM_MAX_LINE_BYTES} bytes; stream aborted"})
+                buffer = b""
+                break
+        item = parse_stream_line(buffer, line_number + 1)
+        if item is not None:
+            await items.put(item)
+    except ClientDisconnect:
+        logger.info(f"Prediction stream client disconnected after {line_number} lines")
+    except Exception as e:
+        logger.error(f"Reading prediction stream failed: {e}")
+        await items.put({"line": line_number + 1, "id": None, "error": f"Failed to read request body: {str(e)}"})
+    finally:
+        body_read.set()
+    await items.put(None)
+
+async def next_micro_batch(items: asyncio.Queue) -> tuple:
+    """
+    (batch, finished): up to STREAM_MICRO_BATCH items
+
+    A partial batch is sent once STREAM_MAX_BATCH_DELAY_MS have passed since
+    its first item, so a client trickling emails still gets prompt answers.
+    """
+    loop = asyncio.get_running_loop()
+    batch = []
+    flush_at = None
+    while len(batch) < STREAM_MICRO_BATCH:
+        timeout = None if flush_at is None else flush_at - loop.time()
+        if timeout is not None and timeout <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(items.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+        if flush_at is None:
+            flush_at = loop.time() + STREAM_MAX_BATCH_DELAY_MS / 1000.0
+    return batch, False
+
+async def classify_stream_batch(request: Request, batch: List[Dict[str, Any]], lane: str, tenant: Optional[str]) -> bytes:
+    """NDJSON result lines for one micro-batch, in input order; a failed batch yields error lines, not a broken stream"""
+    emails = [item["email"] for item in batch if "email" in item]
+    results, error = [], None
+    if emails:
+        BATCH_SIZE.observe(len(emails), endpoint="/predict/stream")
+        try:
+            # A full queue slows the stream down rather than failing it, except in lanes that may degrade
+            if lane in DEGRADED_MODE_LANES and scheduler.queue_full(lane):
+                OVERLOAD.inc(lane=lane, action="degraded")
+                results = await run_rules_only(classifier.predict_batch_rules_only, emails)
+            else:
+                results = await map_by_version(
+                    request, lane, tenant or emails[0]["user_id"], classifier.predict_batch, emails, None
+                )
+        except Exception as e:
+            logger.error(f"Stream micro-batch failed: {e}")
+            error = f"Prediction failed: {str(e)}"
+    
+    with stage_timer('serialization'):
+        results = iter(results)
+        lines = []
+        for item in batch:
+            line_error = item.get("error", error)
+            if line_error is None:
+                # Classifier error results lack fields the response needs; report them as error lines
+                result = next(results)
+                try:
+                    if result.get("error"):
+                        raise ValueError(result["error"])
+                    payload = {"id": item["id"], **PredictionResponse(**result).model_dump(exclude_none=True)}
+                except ValueError as e:
+                    line_error = f"Prediction failed: {str(e).splitlines()[0]}"
+            if line_error is not None:
+                payload = {"id": item["id"], "line": item["line"], "error": line_error}
+            lines.append(json.dumps(payload))
+        return ("\n".join(lines) + "\n").encode()
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request):
+    """
+    Classify newline-delimited JSON emails as they arrive, streaming NDJSON results back
+
+    Each input line is {"id", "subject", "body", "user_id"?}; each output line
+    carries the input's id (or its line number) with the prediction or an
+    error. Emails are grouped into micro-batches that go through the
+    scheduler (bulk lane by default) while the next ones are read, and results
+    are written as soon as their micro-batch completes. At most
+    STREAM_MAX_PENDING_BATCHES micro-batches are in inference and one more is
+    buffered, so memory stays bounded however long the stream is.
+    """
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    observe_request_parse()
+    lane = request_lane(request, "bulk")
+    tenant = request_tenant(request, None)
+    if lane not in DEGRADED_MODE_LANES and scheduler.queue_full(lane):
+        OVERLOAD.inc(lane=lane, action="rejected")
+        raise HTTPException(
+            status_code=503, detail=f"Model queue for lane '{lane}' is over budget", headers={"Retry-After": "5"}
+        )
+    
+    body_read = asyncio.Event()
+    
+    async def stream_results():
+        items = asyncio.Queue(maxsize=STREAM_MICRO_BATCH)
+        reader = asyncio.create_task(read_stream_items(request, items, body_read))
+        pending = collections.deque()
+        next_batch = None
+        finished = False
+        try:
+            while not finished or pending:
+                if next_batch is None and not finished and len(pending) < STREAM_MAX_PENDING_BATCHES:
+                    next_batch = asyncio.create_task(next_micro_batch(items))
+                waiting = [task for task in (next_batch, pending[0] if pending else None) if task is not None]
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if next_batch is not None and next_batch.done():
+                    batch, finished = next_batch.result()
+                    next_batch = None
+                    if batch:
+                        pending.append(asyncio.create_task(classify_stream_batch(request, batch, lane, tenant)))
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+        finally:
+            # Client disconnects land here too; queued micro-batches are then dropped by the scheduler
+            for task in (reader, next_batch, *pending):
+                if task is not None:
+                    task.cancel()
+            record_prediction(batch=True)
+    
+    return DuplexStreamingResponse(stream_results(), body_read, media_type="application/x-ndjson")
+
 @app.post("/predict/ensemble", response_model=EnsemblePredictionResponse)
-async def predict_email_ensemble(email: EnsembleEmailInput):
+async def predict_email_ensemble(email: EnsembleEmailInput, request: Request):
     """Predict email category using ensemble approach with comprehensive features"""
     if ensemble_classifier is None:
         raise HTTPException(status_code=503, detail="Ensemble model not loaded")
     
+    observe_request_parse()
+    lane = request_lane(request, "interactive")
+    deadline = request_deadline(request, lane)
     try:
         logger.info(f"Ensemble classification request for: {email.subject[:50]}...")
         
@@ -377,27 +829,83 @@ async def predict_email_ensemble(email: EnsembleEmailInput):
         }
         
         # Get ensemble prediction
-        result = ensemble_classifier.predict_single(email.subject, email.body, email_data)
+        if overload_action(lane, deadline) == "degrade":
+            result = await run_rules_only(
+                ensemble_classifier.distilbert_classifier.predict_rules_only, email.subject, email.body
+            )
+        else:
+            version = request_model_version(request, email.user_id)
+            bundle = await registry_bundle(version) if version else None
+            result = await scheduler.submit(
+                lane, request_tenant(request, email.user_id),
+                functools.partial(ensemble_classifier.predict_single, bundle=bundle),
+                email.subject, email.body, email_data, deadline=deadline
+            )
+            if version:
+                result["model_version"] = version
         
         # Update performance stats
-        performance_stats["total_predictions"] += 1
-        performance_stats["last_prediction_time"] = datetime.now().isoformat()
-        
-        # Update average confidence
-        total_preds = performance_stats["total_predictions"]
-        current_avg = performance_stats["average_confidence"]
-        performance_stats["average_confidence"] = (
-            (current_avg * (total_preds - 1) + result["confidence"]) / total_preds
-        )
+        record_prediction(result["confidence"])
         
         logger.info(f"Ensemble result: {result.get('label', 'Unknown')} (confidence: {result.get('confidence', 0.0)})")
         
-        return EnsemblePredictionResponse(**result)
+        with stage_timer('serialization'):
+            return EnsemblePredictionResponse(**result)
         
+    except HTTPException:
+        raise
+    except DeadlineExceeded:
+        raise deadline_exceeded(lane)
     except Exception as e:
         logger.error(f"Ensemble prediction failed: {e}")
         raise HTTPException(status_code=500, detail=f"Ensemble prediction failed: {str(e)}")
 
+@app.post("/predict/ensemble/batch", response_model=List[EnsemblePredictionResponse])
+async def predict_batch_ensemble(batch: BatchEnsembleEmailInput, request: Request):
+    """Predict categories for multiple emails with one pass through each ensemble model"""
+    if ensemble_classifier is None:
+        raise HTTPException(status_code=503, detail="Ensemble model not loaded")
+    
+    observe_request_parse()
+    BATCH_SIZE.observe(len(batch.emails), endpoint="/predict/ensemble/batch")
+    lane = request_lane(request, "sync")
+    deadline = request_deadline(request, lane)
+    try:
+        emails_list = [
+            {
+                'subject': email.subject,
+                'body': email.body,
+                'html': email.html or '',
+                'from': email.from_addr or '',
+                'to': email.to_addr or '',
+                'date': email.date,
+                'attachments': email.attachments or [],
+                'headers': email.headers or {},
+                'user_id': email.user_id
+            }
+            for email in batch.emails
+        ]
+        tenant = request_tenant(request, batch.emails[0].user_id if batch.emails else None)
+        if overload_action(lane, deadline, len(emails_list)) == "degrade":
+            results = await run_rules_only(
+                ensemble_classifier.distilbert_classifier.predict_batch_rules_only, emails_list
+            )
+        else:
+            results = await map_by_version(request, lane, tenant, ensemble_classifier.predict_batch, emails_list, deadline)
+        
+        # Update performance stats
+        record_prediction(batch=True)
+        
+        with stage_timer('serialization'):
+            return [EnsemblePredictionResponse(**result) for result in results]
+    except HTTPException:
+        raise
+    except DeadlineExceeded:
+        raise deadline_exceeded(lane)
+    except Exception as e:
+        logger.error(f"Ensemble batch prediction failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Ensemble batch prediction failed: {str(e)}")
+
 # Category template endpoints
 @app.get("/categories/templates")
 async def get_category_templates():
@@ -722,21 +1230,104 @@ async def get_performance_stats():
     
     try:
         model_stats = classifier.get_performance_stats()
-        uptime = (datetime.now() - performance_stats["uptime_start"]).total_seconds()
+        with performance_stats_lock:
+            stats = dict(performance_stats)
+        uptime = (datetime.now() - stats["uptime_start"]).total_seconds()
         
         return PerformanceStats(
-            total_predictions=performance_stats["total_predictions"],
-            total_batch_predictions=performance_stats["total_batch_predictions"],
-            average_confidence=performance_stats["average_confidence"],
-            last_prediction_time=performance_stats["last_prediction_time"],
+            total_predictions=stats["total_predictions"],
+            total_batch_predictions=stats["total_batch_predictions"],
+            average_confidence=stats["average_confidence"],
+            last_prediction_time=stats["last_prediction_time"],
             uptime_seconds=uptime,
             cache_size=model_stats["cache_size"],
-            categories_count=model_stats["categories_count"]
+            categories_count=model_stats["categories_count"],
+            endpoint_latency=REQUEST_LATENCY.summary(),
+            stage_latency=STAGE_LATENCY.summary()
         )
     except Exception as e:
         logger.error(f"Failed to get performance stats: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get performance stats: {str(e)}")
 
+def collect_component_metrics():
+    """Refresh model-version and cache-ratio gauges from the live components"""
+    MODEL_INFO.clear()
+    MODEL_INFO.set(1, component="feature_schema", version=f"v{FEATURE_SCHEMA.version}-{FEATURE_SCHEMA.fingerprint()}")
+    if classifier is not None:
+        MODEL_INFO.set(1, component="distilbert", version=classifier.model_source)
+        adapters = classifier.adapter_registry.snapshot()
+        set_cache_totals("adapters", adapters["hits"], adapters["loads"])
+    if ensemble_classifier is not None:
+        feature_classifier = ensemble_classifier.feature_classifier
+        compiled = "compiled" if feature_classifier.compiled is not None else "reference"
+        MODEL_INFO.set(1, component="feature_model", version=f"{feature_classifier.model_type}-{compiled}")
+    for name, info in domain_utils.cache_info().items():
+        set_cache_totals(f"domain_{name}", info["hits"], info["misses"])
+    for lane, stats in scheduler.snapshot()["lanes"].items():
+        SCHEDULER_QUEUE_DEPTH.set(stats["queued"], lane=lane)
+
+METRICS.register_collector(collect_component_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Queue depth, concurrency and average queue time per scheduler lane"""
+    return scheduler.snapshot()
+
+@app.get("/cascade/stats")
+async def get_cascade_stats():
+    """Get first-tier answer vs. transformer escalation counts"""
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    return {
+        "enabled": classifier.first_tier is not None,
+        "stats": classifier.cascade_stats.snapshot(),
+        "thresholds": classifier.first_tier.thresholds if classifier.first_tier else {},
+        "validation_metrics": classifier.first_tier.metrics if classifier.first_tier else {}
+    }
+
+@app.post("/cascade/load")
+async def load_cascade_first_tier(payload: Dict[str, Any]):
+    """Load (or with no model_dir, detach) the linear first tier"""
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    model_dir = payload.get("model_dir")
+    if not model_dir:
+        classifier.attach_first_tier(None)
+        return {"status": "success", "message": "Cascade first tier detached"}
+    if not os.path.exists(model_dir):
+        raise HTTPException(status_code=404, detail=f"Model path not found: {model_dir}")
+    
+    try:
+        classifier.attach_first_tier(LinearFirstTier.load(model_dir))
+        return {"status": "success", "message": "Cascade first tier loaded", "model_dir": model_dir}
+    except Exception as e:
+        logger.error(f"Failed to load cascade first tier: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to load cascade first tier: {str(e)}")
+
+@app.get("/adapters/stats")
+async def get_adapter_stats():
+    """Get per-user adapter cache statistics"""
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    return classifier.adapter_registry.snapshot()
+
+@app.post("/adapters/{user_id}/reload")
+async def reload_user_adapter(user_id: str):
+    """Drop a user's cached adapter so the next request loads the newly trained one"""
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    classifier.adapter_registry.invalidate(user_id)
+    return {"status": "success", "message": f"Adapter for user {user_id} will be reloaded"}
+
 @app.post("/cache/clear")
 async def clear_cache():
     """Clear prediction cache"""
@@ -751,6 +1342,10 @@ async def clear_cache():
         raise HTTPException(status_code=500, detail=f"Failed to clear cache: {str(e)}")
 
 # Training endpoints
+async def import_training_module(name: str):
+    """Import a training-only module on first use, off the event loop; replicas that never train never load it"""
+    return await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, name)
+
 @app.post("/training/collect")
 async def collect_training_data(training_data: TrainingDataInput):
     """Add training samples to the collection"""
@@ -758,7 +1353,8 @@ async def collect_training_data(training_data: TrainingDataInput):
     
     try:
         if data_collector is None:
-            data_collector = TrainingDataCollector()
+            data_collection = await import_training_module("data_collection")
+            data_collector = data_collection.TrainingDataCollector()
         
         # Convert Pydantic models to dictionaries
         valid_samples = []
@@ -800,7 +1396,8 @@ async def trigger_model_training(training_data: Optional[Dict[str, Any]] = None)
     
     try:
         if training_pipeline is None:
-            training_pipeline = ModelTrainingPipeline()
+            pipeline_module = await import_training_module("training_pipeline")
+            training_pipeline = pipeline_module.ModelTrainingPipeline()
         
         # Load training data if not provided
         samples = []
@@ -875,7 +1472,9 @@ async def load_finetuned_model(payload: Dict[str, Any]):
             raise HTTPException(status_code=404, detail=f"Model path not found: {model_path}")
         if classifier is None:
             classifier = DynamicEmailClassifier()
-        if classifier.load_model_from_path(model_path):
+        # Load and warm up off the event loop; requests keep using the current model until the swap
+        loaded = await asyncio.get_running_loop().run_in_executor(None, classifier.load_model_from_path, model_path)
+        if loaded:
             return {"status": "success", "message": "Model loaded", "model_path": model_path}
         raise HTTPException(status_code=500, detail="Failed to load model")
     except HTTPException:
@@ -884,6 +1483,138 @@ async def load_finetuned_model(payload: Dict[str, Any]):
         logger.error(f"Failed to load model: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
 
+@app.post("/shadow/start")
+async def start_shadow_evaluation(payload: Dict[str, Any]):
+    """Load a candidate model (by path or ModelVersion) and replay a sample of /predict traffic against it"""
+    global shadow_evaluator
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    model_path = payload.get("model_path")
+    version = payload.get("version")
+    if not model_path and version:
+        # Imported here: the module opens its database on import
+        from database_schema import db_manager
+        model_version = db_manager.get_model_version(version)
+        if model_version is None:
+            raise HTTPException(status_code=404, detail=f"Model version not found: {version}")
+        model_path = model_version["model_name"]
+    if not model_path:
+        raise HTTPException(status_code=400, detail="model_path or version is required")
+    if not os.path.exists(model_path):
+        raise HTTPException(status_code=404, detail=f"Model path not found: {model_path}")
+    
+    sample_rate = float(payload.get("sample_rate", SHADOW_SAMPLE_RATE))
+    if not 0 < sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be in (0, 1]")
+    
+    try:
+        candidate = await asyncio.get_running_loop().run_in_executor(None, classifier.load_candidate, model_path)
+    except Exception as e:
+        logger.error(f"Failed to load shadow candidate: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to load candidate: {str(e)}")
+    if candidate is None:
+        raise HTTPException(status_code=500, detail="Failed to load candidate model")
+    
+    if shadow_evaluator is not None:
+        shadow_evaluator.stop()
+    shadow_evaluator = ShadowEvaluator(classifier, candidate, source=version or model_path, sample_rate=sample_rate)
+    logger.info(f"Shadow evaluation started for {model_path} at sample rate {sample_rate}")
+    return {"status": "success", "message": "Shadow evaluation started", "candidate": candidate.describe()}
+
+@app.get("/shadow/stats")
+async def get_shadow_stats():
+    """Agreement, confidence shift and confusion of the candidate vs. production"""
+    if shadow_evaluator is None:
+        return {"active": False}
+    return {"active": True, **shadow_evaluator.snapshot()}
+
+@app.post("/shadow/stop")
+async def stop_shadow_evaluation():
+    """Stop shadowing and drop the candidate"""
+    global shadow_evaluator
+    if shadow_evaluator is None:
+        raise HTTPException(status_code=404, detail="No shadow evaluation running")
+    stats = shadow_evaluator.snapshot()
+    shadow_evaluator.stop()
+    shadow_evaluator = None
+    return {"status": "success", "message": "Shadow evaluation stopped", "final_stats": stats}
+
+@app.post("/shadow/promote")
+async def promote_shadow_candidate():
+    """Serve the shadow candidate (already warm) as the production model"""
+    global shadow_evaluator
+    if shadow_evaluator is None:
+        raise HTTPException(status_code=404, detail="No shadow evaluation running")
+    evaluator, shadow_evaluator = shadow_evaluator, None
+    evaluator.stop()
+    await asyncio.get_running_loop().run_in_executor(None, classifier.promote_bundle, evaluator.candidate)
+    return {"status": "success", "message": "Candidate promoted", "final_stats": evaluator.snapshot()}
+
+@app.get("/models/registry")
+async def get_model_registry():
+    """Resident and registered model versions, tenant routes and memory use"""
+    if model_registry is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return model_registry.snapshot()
+
+@app.post("/models/registry")
+async def register_model_version(payload: Dict[str, Any]):
+    """Register a version by checkpoint path; preload=true loads it now instead of on first use"""
+    if model_registry is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    version = payload.get("version")
+    model_path = payload.get("model_path")
+    if not version or not model_path:
+        raise HTTPException(status_code=400, detail="version and model_path are required")
+    if not os.path.exists(model_path):
+        raise HTTPException(status_code=404, detail=f"Model path not found: {model_path}")
+    
+    model_registry.register(version, model_path)
+    if payload.get("preload"):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, model_registry.get, version)
+        except Exception as e:
+            logger.error(f"Failed to preload model version {version}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to load model version: {str(e)}")
+    return {"status": "success", "version": version, "model_path": model_path}
+
+@app.post("/models/registry/routes")
+async def route_tenant_to_version(payload: Dict[str, Any]):
+    """Pin a tenant (X-Tenant-Id, else the email's user_id) to a model version on every /predict endpoint; omit version to unpin"""
+    if model_registry is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    tenant = payload.get("tenant")
+    if not tenant:
+        raise HTTPException(status_code=400, detail="tenant is required")
+    model_registry.route(tenant, payload.get("version"))
+    return {"status": "success", "tenant": tenant, "version": payload.get("version")}
+
+@app.post("/models/registry/{version}/activate")
+async def activate_model_version(version: str):
+    """Serve a registry version as production; the replaced model stays resident for rollback"""
+    if model_registry is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        bundle = await loop.run_in_executor(None, model_registry.get, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to load model version {version}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to load model version: {str(e)}")
+    
+    previous = classifier.bundle
+    await loop.run_in_executor(None, classifier.promote_bundle, bundle)
+    rollback_version = None
+    if previous is not None and previous is not bundle:
+        # A route-safe name; the source may be a path or a hub name
+        rollback_version = f"rollback-v{previous.version}"
+        model_registry.adopt(rollback_version, previous)
+    return {"status": "success", "message": f"Model version {version} is now serving", "rollback_version": rollback_version}
+
 @app.get("/model/performance")
 async def get_model_performance():
     """Get detailed model performance metrics"""
@@ -914,109 +1645,108 @@ async def get_model_performance():
         raise HTTPException(status_code=500, detail=f"Failed to get model performance: {str(e)}")
 
 @app.post("/training/distilbert", response_model=TrainingResponse)
-async def train_distilbert_model(training_config: DistilBERTTrainingInput, background_tasks: BackgroundTasks):
-    """Train DistilBERT model with provided dataset"""
-    global distilbert_trainer
+async def train_distilbert_model(training_config: DistilBERTTrainingInput):
+    """Queue DistilBERT fine-tuning; it runs in the training worker process, never in this one"""
+    if training_runner is None:
+        raise HTTPException(status_code=503, detail="Training job runner not started")
     
     try:
-        logger.info(f"Starting DistilBERT training with dataset: {training_config.data_file}")
+        logger.info(f"Queueing DistilBERT training with dataset: {training_config.data_file}")
         
         # Validate data file exists
         if not os.path.exists(training_config.data_file):
             raise HTTPException(status_code=404, detail=f"Dataset file not found: {training_config.data_file}")
         
-        # Initialize trainer if not already done
-        if distilbert_trainer is None:
-            distilbert_trainer = DistilBERTTrainer(
-                output_dir=training_config.output_dir,
-                max_length=training_config.max_length
-            )
-        
-        # Add training task to background
-        background_tasks.add_task(
-            run_distilbert_training,
-            training_config,
-            distilbert_trainer
+        config = training_config.model_dump()
+        config["data_file"] = os.path.abspath(training_config.data_file)
+        config["output_dir"] = os.path.abspath(training_config.output_dir or "distilbert_models")
+        job = await asyncio.get_running_loop().run_in_executor(
+            None, training_runner.submit, "distilbert", config
         )
         
         return TrainingResponse(
             status="success",
-            message=f"DistilBERT training started for dataset: {training_config.data_file}",
+            message=f"DistilBERT training queued as job {job['id']} for dataset: {training_config.data_file}",
             training_metrics=None,
-            confidence_improvement=None
+            confidence_improvement=None,
+            job_id=job["id"]
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to start DistilBERT training: {e}")
+        logger.error(f"Failed to queue DistilBERT training: {e}")
         raise HTTPException(status_code=500, detail=f"Training initialization failed: {str(e)}")
 
-async def run_distilbert_training(training_config: DistilBERTTrainingInput, trainer: DistilBERTTrainer):
-    """Background task to run DistilBERT training"""
-    try:
-        logger.info("Starting DistilBERT training in background...")
-        
-        # Load and preprocess dataset
-        texts, labels, label_mapping = trainer.load_and_preprocess_dataset(training_config.data_file)
-        
-        if len(texts) == 0:
-            logger.error("No valid training examples found!")
-            return
-        
-        # Initialize model
-        trainer.initialize_model(len(label_mapping))
-        
-        # Train model
-        results = trainer.train_model(
-            texts=texts,
-            labels=labels,
-            validation_split=training_config.validation_split,
-            train_batch_size=training_config.batch_size,
-            num_epochs=training_config.num_epochs,
-            learning_rate=training_config.learning_rate
-        )
-        
-        logger.info(f"DistilBERT training completed successfully! Results: {results.get('eval_results', {})}")
-        
-        # Auto-load fine-tuned model into live classifier so all endpoints use it
-        global classifier
-        if classifier is None:
-            classifier = DynamicEmailClassifier()
-        model_dir = results.get("model_path")
-        if model_dir:
-            try:
-                loaded = classifier.load_model_from_path(model_dir)
-                if loaded:
-                    logger.info("Fine-tuned DistilBERT loaded into live classifier")
-                else:
-                    logger.warning("Fine-tuned model could not be loaded; continuing with existing model")
-            except Exception as e:
-                logger.warning(f"Failed to load fine-tuned model into classifier: {e}")
+@app.get("/training/jobs")
+async def list_training_jobs(limit: int = 50):
+    """Recent training jobs, newest first"""
+    if training_runner is None:
+        raise HTTPException(status_code=503, detail="Training job runner not started")
+    jobs = await asyncio.get_running_loop().run_in_executor(None, training_runner.store.list, limit)
+    return {"jobs": jobs}
 
-        # Broadcast training completion
-        await manager.broadcast({
-            "type": "distilbert_training_completed",
-            "data": {
-                "status": "success",
-                "model_path": results.get("model_path"),
-                "metrics": results.get("eval_results", {}),
-                "timestamp": results.get("timestamp")
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"DistilBERT training failed: {e}")
-        
-        # Broadcast training failure
+@app.get("/training/jobs/{job_id}")
+async def get_training_job(job_id: str):
+    if training_runner is None:
+        raise HTTPException(status_code=503, detail="Training job runner not started")
+    job = await asyncio.get_running_loop().run_in_executor(None, training_runner.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Training job not found: {job_id}")
+    return job
+
+@app.post("/training/jobs/{job_id}/cancel")
+async def cancel_training_job(job_id: str):
+    """Cancel a queued job, or stop a running one at its next training step"""
+    if training_runner is None:
+        raise HTTPException(status_code=503, detail="Training job runner not started")
+    job = await asyncio.get_running_loop().run_in_executor(None, training_runner.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Training job not found: {job_id}")
+    return job
+
+async def handle_training_job_event(job: Dict[str, Any], event: str):
+    """Relay a job state change to /ws clients; hot-swap the live model when a DistilBERT job succeeds"""
+    await manager.broadcast({"type": f"training_job_{event}", "data": job})
+    if job["kind"] != "distilbert" or event not in ("succeeded", "failed"):
+        return
+    
+    if event == "failed":
         await manager.broadcast({
             "type": "distilbert_training_failed",
             "data": {
                 "status": "error",
-                "error": str(e),
+                "job_id": job["id"],
+                "error": job["error"],
                 "timestamp": datetime.now().isoformat()
             }
         })
+        return
+    
+    result = job["result"] or {}
+    model_dir = result.get("model_path")
+    if classifier is not None and model_dir:
+        try:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, classifier.load_model_from_path, model_dir
+            )
+            if loaded:
+                logger.info(f"Fine-tuned DistilBERT from job {job['id']} loaded into live classifier")
+            else:
+                logger.warning("Fine-tuned model could not be loaded; continuing with existing model")
+        except Exception as e:
+            logger.warning(f"Failed to load fine-tuned model into classifier: {e}")
+    
+    await manager.broadcast({
+        "type": "distilbert_training_completed",
+        "data": {
+            "status": "success",
+            "job_id": job["id"],
+            "model_path": model_dir,
+            "metrics": result.get("metrics", {}),
+            "timestamp": result.get("timestamp")
+        }
+    })
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws")
@@ -1032,11 +1762,11 @@ async def websocket_endpoint(websocket: WebSocket):
 
 # Legacy endpoints for backward compatibility
 @app.post("/categorize")
-async def categorize_email(content: dict):
+async def categorize_email(content: dict, request: Request):
     """Legacy categorize endpoint"""
     if "content" in content:
         email_input = EmailInput(subject="", body=content["content"])
-        return await predict_email(email_input)
+        return await predict_email(email_input, request)
     else:
         raise HTTPException(status_code=400, detail="Use /predict endpoint with {subject, body}")
 
@@ -8,39 +8,55 @@ import torch.nn as nn
 import numpy as np
 import logging
 from typing import Dict, List, Any, Optional, Tuple
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-import xgboost as xgb
 import joblib
 import os
 import json
+import time
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from dynamic_classifier import DynamicEmailClassifier
-from feature_extractor import EmailFeatureExtractor, normalize_features
+from feature_extractor import EmailFeatureExtractor
+from feature_schema import FEATURE_SCHEMA
+from compiled_trees import compile_feature_model
+from service_metrics import observe_stage, stage_timer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Batches up to this size go through the compiled trees; larger ones are faster in xgboost's native predictor
+COMPILED_MAX_BATCH = int(os.getenv("COMPILED_TREES_MAX_BATCH", "8"))
+
+FEATURE_MODEL_TYPES = ('xgboost', 'random_forest', 'logistic_regression')
+
 class FeatureBasedClassifier:
     """Traditional ML classifier for metadata and structural features"""
     
     def __init__(self, model_type: str = 'xgboost'):
+        if model_type not in FEATURE_MODEL_TYPES:
+            raise ValueError(f"Unsupported model type: {model_type}")
         self.model_type = model_type
+        # Estimators are created by train() or restored by load_models(), so serving
+        # without a trained feature model never imports sklearn or xgboost
         self.model = None
-        self.scaler = StandardScaler()
-        self.label_encoder = LabelEncoder()
+        self.scaler = None
+        self.label_encoder = None
         self.feature_names = None
+        self.schema = FEATURE_SCHEMA
         self.is_trained = False
-        
-        self._initialize_model()
+        self.compiled = None
     
     def _initialize_model(self):
         """Initialize the ML model"""
+        from sklearn.preprocessing import StandardScaler, LabelEncoder
+        
+        self.scaler = StandardScaler()
+        self.label_encoder = LabelEncoder()
         if self.model_type == 'xgboost':
+            import xgboost as xgb
             self.model = xgb.XGBClassifier(
                 n_estimators=100,
                 max_depth=6,
@@ -49,6 +65,7 @@ class FeatureBasedClassifier:
                 n_jobs=-1
             )
         elif self.model_type == 'random_forest':
+            from sklearn.ensemble import RandomForestClassifier
             self.model = RandomForestClassifier(
                 n_estimators=100,
                 max_depth=10,
@@ -56,6 +73,7 @@ class FeatureBasedClassifier:
                 n_jobs=-1
             )
         elif self.model_type == 'logistic_regression':
+            from sklearn.linear_model import LogisticRegression
             self.model = LogisticRegression(
                 random_state=42,
                 max_iter=1000,
@@ -66,43 +84,32 @@ class FeatureBasedClassifier:
     
     def prepare_features(self, features: Dict[str, Any]) -> np.ndarray:
         """Prepare and normalize features for ML model"""
-        normalized_features = normalize_features(features)
-        
-        # Define expected feature order (these should match training features)
-        expected_features = [
-            'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
-            'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
-            'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
-            'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
-            'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
-            'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
-            'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
-            'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
-            'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
-            'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
-            'subject_question_count', 'subject_number_count', 'body_paragraph_count',
-            'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
-            'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header'
-        ]
-        
-        # Add categorical feature hashes
-        categorical_features = ['sender_domain_hash', 'sender_tld_hash']
-        expected_features.extend(categorical_features)
-        
-        # Create feature vector
-        feature_vector = []
-        for feature_name in expected_features:
-            if feature_name in normalized_features:
-                feature_vector.append(normalized_features[feature_name])
-            else:
-                feature_vector.append(0.0)  # Default value for missing features
-        
-        return np.array(feature_vector).reshape(1, -1)
+        return self.schema.vectorize(features).reshape(1, -1)
+    
+    def prepare_feature_matrix(self, features_list: List[Dict[str, Any]]) -> np.ndarray:
+        """Vectorize a batch of raw feature dicts into one float32 (n_emails, n_features) matrix"""
+        return self.schema.vectorize_batch(features_list)
+    
+    def predict_proba_batch(self, X: np.ndarray) -> Optional[np.ndarray]:
+        """Class probabilities for a feature matrix in one scaler/model call (None if untrained)"""
+        if not self.is_trained or len(X) == 0:
+            return None
+        if self.compiled is not None and len(X) <= COMPILED_MAX_BATCH:
+            return self.compiled.predict_proba(X)
+        return self.model.predict_proba(self.scaler.transform(X))
+    
+    def compile(self, probe: Optional[np.ndarray] = None):
+        """Build the low-latency tree evaluator (XGBoost only; others keep the sklearn path)"""
+        self.compiled = None
+        if not self.is_trained or os.getenv("COMPILE_FEATURE_MODEL", "1") != "1":
+            return
+        self.compiled = compile_feature_model(self.model, self.scaler, probe)
     
     def train(self, X: np.ndarray, y: np.ndarray):
         """Train the feature-based classifier"""
         try:
             logger.info(f"Training {self.model_type} with {len(X)} samples")
+            self._initialize_model()
             
             # Fit scaler and transform features
             X_scaled = self.scaler.fit_transform(X)
@@ -112,8 +119,9 @@ class FeatureBasedClassifier:
             
             # Train model
             self.model.fit(X_scaled, y_encoded)
-            self.feature_names = [f"feature_{i}" for i in range(X.shape[1])]
+            self.feature_names = list(self.schema.columns)
             self.is_trained = True
+            self.compile(X[:256])
             
             logger.info(f"Feature-based classifier training completed")
             
@@ -129,10 +137,12 @@ class FeatureBasedClassifier:
             
             # Prepare features
             X = self.prepare_features(features)
-            X_scaled = self.scaler.transform(X)
             
             # Get predictions
-            predictions = self.model.predict_proba(X_scaled)[0]
+            if self.compiled is not None:
+                predictions = self.compiled.predict_proba_row(X[0])
+            else:
+                predictions = self.model.predict_proba(self.scaler.transform(X))[0]
             predicted_class_idx = np.argmax(predictions)
             confidence = predictions[predicted_class_idx]
             
@@ -251,6 +261,97 @@ class ModelFusion:
                 }
             }
 
+    def fuse_batch(
+        self,
+        distilbert_results: List[Dict[str, Any]],
+        feature_probabilities: Optional[np.ndarray],
+        feature_classes: List[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Batch version of fuse_predictions over a fixed label index
+        
+        Args:
+            distilbert_results: One DynamicEmailClassifier result per email
+            feature_probabilities: (n_emails, n_classes) from the feature model, or None
+            feature_classes: Label for each feature_probabilities column
+            
+        Returns:
+            One fused result per email, matching fuse_predictions
+        """
+        n = len(distilbert_results)
+        if n == 0:
+            return []
+        
+        # Fixed label index: DistilBERT labels first, then feature-only labels
+        labels = []
+        for result in distilbert_results:
+            for label in result.get('scores', {}):
+                if label not in labels:
+                    labels.append(label)
+        for label in feature_classes:
+            if label not in labels:
+                labels.append(label)
+        label_index = {label: i for i, label in enumerate(labels)}
+        
+        D = np.zeros((n, len(labels)))
+        for row, result in enumerate(distilbert_results):
+            for label, score in result.get('scores', {}).items():
+                D[row, label_index[label]] = score
+        
+        F = np.zeros((n, len(labels)))
+        if feature_probabilities is not None:
+            F[:, [label_index[label] for label in feature_classes]] = feature_probabilities
+        
+        combined = D * self.distilbert_weight + F * self.feature_weight
+        best_idx = np.argmax(combined, axis=1)
+        best_confidence = combined[np.arange(n), best_idx]
+        
+        distilbert_confidence = np.array([r.get('confidence', 0.0) for r in distilbert_results], dtype=float)
+        if feature_probabilities is not None:
+            feature_confidence = feature_probabilities.max(axis=1)
+            feature_labels = np.asarray(feature_classes)[feature_probabilities.argmax(axis=1)]
+        else:
+            feature_confidence = np.zeros(n)
+            feature_labels = np.full(n, 'Other', dtype=object)
+        
+        # Dynamic weighting based on individual model confidence
+        adjusted = best_confidence.copy()
+        boost_distilbert = (distilbert_confidence > 0.8) & (feature_confidence < 0.6)
+        boost_feature = ~boost_distilbert & (feature_confidence > 0.8) & (distilbert_confidence < 0.6)
+        adjusted[boost_distilbert] = np.minimum(0.95, distilbert_confidence * 0.8 + best_confidence * 0.2)[boost_distilbert]
+        adjusted[boost_feature] = np.minimum(0.95, feature_confidence * 0.8 + best_confidence * 0.2)[boost_feature]
+        
+        # Fallback logic for very low confidence
+        fallback = adjusted < 0.3
+        adjusted[fallback] = (np.maximum(distilbert_confidence, feature_confidence) * 0.7)[fallback]
+        
+        fused = []
+        for row in range(n):
+            if fallback[row]:
+                if distilbert_confidence[row] >= feature_confidence[row]:
+                    label = distilbert_results[row].get('label', 'Other')
+                else:
+                    label = str(feature_labels[row])
+            else:
+                label = labels[best_idx[row]]
+            
+            fused.append({
+                'label': label,
+                'confidence': round(float(adjusted[row]), 4),
+                'scores': dict(zip(labels, combined[row].tolist())),
+                'ensembleScores': {
+                    'distilbert': float(distilbert_confidence[row]),
+                    'featureBased': float(feature_confidence[row]),
+                    'combined': float(adjusted[row])
+                },
+                'featureContributions': {
+                    'distilbertWeight': self.distilbert_weight,
+                    'featureWeight': self.feature_weight
+                }
+            })
+        
+        return fused
+
 class EnsembleEmailClassifier:
     """Main ensemble classifier combining DistilBERT and feature-based ML"""
     
@@ -270,6 +371,13 @@ class EnsembleEmailClassifier:
         self.feature_extractor = EmailFeatureExtractor()
         self.model_fusion = ModelFusion(distilbert_weight, feature_weight)
         
+        # The transformer branch runs here while the calling thread extracts features and
+        # scores the tree model; torch and xgboost both release the GIL in native code
+        self.branch_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("ENSEMBLE_BRANCH_WORKERS", "4")),
+            thread_name_prefix="ensemble-distilbert"
+        )
+        
         # Performance tracking
         self.prediction_count = 0
         self.feature_extraction_time = 0.0
@@ -307,22 +415,64 @@ class EnsembleEmailClassifier:
                 label = sample.get('trueLabel') or sample.get('label', 'Other')
                 y.append(label)
             
-            X = np.array(X)
-            y = np.array(y)
-            
-            # Train the model
-            self.feature_classifier.train(X, y)
-            
-            logger.info("Feature-based classifier training completed successfully")
+            self.train_feature_matrix(np.array(X), np.array(y))
             
         except Exception as e:
             logger.error(f"Error training feature-based classifier: {e}")
             raise
     
-    def predict_single(self, subject: str, body: str, email_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Predict category for single email using ensemble approach"""
+    def train_feature_matrix(self, X: np.ndarray, y: np.ndarray):
+        """Train the feature-based classifier on an already vectorized (n_samples, n_features) matrix"""
+        self.feature_classifier.train(X, y)
+        logger.info("Feature-based classifier training completed successfully")
+    
+    def predict_feature_matrix(self, emails: List[Dict[str, Any]], X: np.ndarray, batch_size: int = 64) -> List[Dict[str, Any]]:
+        """
+        Fused predictions for emails whose feature rows are already computed
+        
+        Used by training and evaluation, where the feature matrix comes from the
+        feature cache instead of being extracted again per email.
+        """
+        feature_classes = (
+            [str(c) for c in self.feature_classifier.label_encoder.classes_]
+            if self.feature_classifier.is_trained else []
+        )
+        
+        results = []
+        for start in range(0, len(emails), batch_size):
+            chunk = emails[start:start + batch_size]
+            distilbert_results = self.distilbert_classifier.predict_batch(chunk)
+            feature_probabilities = self.feature_classifier.predict_proba_batch(X[start:start + batch_size])
+            results.extend(self.model_fusion.fuse_batch(distilbert_results, feature_probabilities, feature_classes))
+        return results
+    
+    def _timed(self, fn, *args):
+        """Run fn(*args) and return (result, seconds)"""
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+    
+    def _distilbert_fallback(self, distilbert_future, rerun):
+        """
+        DistilBERT-only answer after the ensemble path failed
+
+        Waits for the branch already in flight rather than running the
+        transformer a second time; only calls rerun() if that branch itself
+        failed or was never started.
+        """
+        if distilbert_future is not None:
+            try:
+                return distilbert_future.result()[0]
+            except Exception as e:
+                logger.error(f"DistilBERT branch failed as well: {e}")
+        return rerun()
+    
+    def predict_single(self, subject: str, body: str, email_data: Optional[Dict[str, Any]] = None,
+                       bundle=None) -> Dict[str, Any]:
+        """Predict category for single email using ensemble approach (DistilBERT branch on `bundle` if given)"""
+        distilbert_future = None
         try:
-            start_time = datetime.now()
+            start_time = time.perf_counter()
             
             # Extract features if not provided
             if email_data is None:
@@ -336,24 +486,34 @@ class EnsembleEmailClassifier:
                     'attachments': []
                 }
             
-            # Extract comprehensive features
-            features = self.feature_extractor.extract_features(email_data)
+            # DistilBERT branch in the background (with this request's context, for sampled stage logs)
+            distilbert_future = self.branch_executor.submit(
+                contextvars.copy_context().run,
+                self._timed, functools.partial(self.distilbert_classifier.predict_single, bundle=bundle), subject, body
+            )
             
-            # Get DistilBERT prediction
-            distilbert_result = self.distilbert_classifier.predict_single(subject, body)
+            # Feature branch on this thread: extraction, then the tree model
+            features, feature_extraction_time = self._timed(self.feature_extractor.extract_features, email_data)
+            feature_result, feature_model_time = self._timed(self.feature_classifier.predict, features)
             
-            # Get feature-based prediction
-            feature_result = self.feature_classifier.predict(features)
+            distilbert_result, distilbert_time = distilbert_future.result()
             
             # Fuse predictions
-            ensemble_result = self.model_fusion.fuse_predictions(distilbert_result, feature_result)
+            with stage_timer('fusion'):
+                ensemble_result = self.model_fusion.fuse_predictions(distilbert_result, feature_result)
+            observe_stage('feature_extraction', feature_extraction_time)
+            observe_stage('tree_model', feature_model_time)
             
-            # Add feature extraction metadata
+            # Add feature extraction metadata and per-branch timings
             ensemble_result['features'] = features
-            ensemble_result['extractionTime'] = (datetime.now() - start_time).total_seconds()
+            ensemble_result['extractionTime'] = time.perf_counter() - start_time
+            ensemble_result['distilbertTime'] = distilbert_time
+            ensemble_result['featureExtractionTime'] = feature_extraction_time
+            ensemble_result['featureModelTime'] = feature_model_time
             
             # Update performance stats
             self.prediction_count += 1
+            self.feature_extraction_time += feature_extraction_time
             self.prediction_time += ensemble_result['extractionTime']
             
             return ensemble_result
@@ -361,38 +521,85 @@ class EnsembleEmailClassifier:
         except Exception as e:
             logger.error(f"Error in ensemble prediction: {e}")
             # Fallback to DistilBERT only
-            return self.distilbert_classifier.predict_single(subject, body)
+            return self._distilbert_fallback(
+                distilbert_future, functools.partial(self.distilbert_classifier.predict_single, subject, body, bundle=bundle)
+            )
+    
+    def _extract_batch_features(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Extract comprehensive features for every email"""
+        features_list = []
+        for email in emails:
+            email_data = {
+                'subject': email.get('subject', ''),
+                'body': email.get('body', ''),
+                'html': email.get('html', ''),
+                'from': email.get('from', ''),
+                'to': email.get('to', ''),
+                'date': email.get('date'),
+                'attachments': email.get('attachments', []),
+                'headers': email.get('headers', {})
+            }
+            features_list.append(self.feature_extractor.extract_features(email_data))
+        return features_list
+    
+    def _predict_feature_batch(self, features_list: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """One scaler transform and one predict_proba for the whole batch"""
+        X = self.feature_classifier.prepare_feature_matrix(features_list)
+        return self.feature_classifier.predict_proba_batch(X)
     
-    def predict_batch(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Predict categories for batch of emails"""
+    def predict_batch(self, emails: List[Dict[str, Any]], bundle=None) -> List[Dict[str, Any]]:
+        """Predict categories for batch of emails with one pass per model (DistilBERT branch on `bundle` if given)"""
+        distilbert_future = None
         try:
-            results = []
+            if not emails:
+                return []
             
-            for email in emails:
-                subject = email.get('subject', '')
-                body = email.get('body', '')
-                
-                # Extract additional email data for feature extraction
-                email_data = {
-                    'subject': subject,
-                    'body': body,
-                    'html': email.get('html', ''),
-                    'from': email.get('from', ''),
-                    'to': email.get('to', ''),
-                    'date': email.get('date'),
-                    'attachments': email.get('attachments', []),
-                    'headers': email.get('headers', {})
-                }
-                
-                result = self.predict_single(subject, body, email_data)
-                results.append(result)
+            start_time = time.perf_counter()
+            
+            # One batched transformer pass in the background
+            distilbert_future = self.branch_executor.submit(
+                contextvars.copy_context().run,
+                self._timed, self.distilbert_classifier.predict_batch, emails, bundle
+            )
+            
+            # Feature branch on this thread
+            features_list, feature_extraction_time = self._timed(self._extract_batch_features, emails)
+            feature_probabilities, feature_model_time = self._timed(self._predict_feature_batch, features_list)
+            feature_classes = (
+                [str(c) for c in self.feature_classifier.label_encoder.classes_]
+                if feature_probabilities is not None else []
+            )
+            
+            distilbert_results, distilbert_time = distilbert_future.result()
+            
+            with stage_timer('fusion'):
+                results = self.model_fusion.fuse_batch(distilbert_results, feature_probabilities, feature_classes)
+            observe_stage('feature_extraction', feature_extraction_time)
+            observe_stage('tree_model', feature_model_time)
+            
+            # Batch time is shared evenly across its emails
+            elapsed = time.perf_counter() - start_time
+            n = len(emails)
+            for result, features in zip(results, features_list):
+                result['features'] = features
+                result['extractionTime'] = elapsed / n
+                result['distilbertTime'] = distilbert_time / n
+                result['featureExtractionTime'] = feature_extraction_time / n
+                result['featureModelTime'] = feature_model_time / n
+            
+            # Update performance stats
+            self.prediction_count += n
+            self.feature_extraction_time += feature_extraction_time
+            self.prediction_time += elapsed
             
             return results
             
         except Exception as e:
             logger.error(f"Error in batch prediction: {e}")
             # Fallback to DistilBERT batch prediction
-            return self.distilbert_classifier.predict_batch(emails)
+            return self._distilbert_fallback(
+                distilbert_future, functools.partial(self.distilbert_classifier.predict_batch, emails, bundle)
+            )
     
     def get_categories(self) -> Dict[str, Any]:
         """Get all available categories"""
@@ -410,9 +617,13 @@ class EnsembleEmailClassifier:
             },
             'feature_model_type': self.feature_classifier.model_type,
             'feature_model_trained': self.feature_classifier.is_trained,
+            'feature_model_compiled': self.feature_classifier.compiled is not None,
             'prediction_count': self.prediction_count,
             'avg_prediction_time': (
                 self.prediction_time / max(self.prediction_count, 1)
+            ),
+            'avg_feature_extraction_time': (
+                self.feature_extraction_time / max(self.prediction_count, 1)
             )
         }
         
@@ -431,7 +642,8 @@ class EnsembleEmailClassifier:
                 'label_encoder': self.feature_classifier.label_encoder,
                 'feature_names': self.feature_classifier.feature_names,
                 'model_type': self.feature_classifier.model_type,
-                'is_trained': self.feature_classifier.is_trained
+                'is_trained': self.feature_classifier.is_trained,
+                'feature_schema': self.feature_classifier.schema.to_dict()
             }
             joblib.dump(model_data, feature_model_path)
             
@@ -460,13 +672,25 @@ class EnsembleEmailClassifier:
             
             if os.path.exists(feature_model_path):
                 model_data = joblib.load(feature_model_path)
-                self.feature_classifier.model = model_data['model']
-                self.feature_classifier.scaler = model_data['scaler']
-                self.feature_classifier.label_encoder = model_data['label_encoder']
-                self.feature_classifier.feature_names = model_data['feature_names']
-                self.feature_classifier.is_trained = model_data['is_trained']
                 
-                logger.info("Feature-based model loaded successfully")
+                saved_schema = model_data.get('feature_schema')
+                schema_problems = self.feature_classifier.schema.check_compatible(saved_schema)
+                if saved_schema is not None and schema_problems:
+                    # Serving with a different column layout would silently produce garbage
+                    logger.error(f"Feature model not loaded, schema mismatch: {'; '.join(schema_problems)}")
+                else:
+                    if saved_schema is None:
+                        # Same column order; only the (previously unstable) hash columns differ
+                        logger.warning(f"Feature model: {schema_problems[0]}; retrain to remove hash-feature skew")
+                    
+                    self.feature_classifier.model = model_data['model']
+                    self.feature_classifier.scaler = model_data['scaler']
+                    self.feature_classifier.label_encoder = model_data['label_encoder']
+                    self.feature_classifier.feature_names = model_data['feature_names']
+                    self.feature_classifier.is_trained = model_data['is_trained']
+                    self.feature_classifier.compile()
+                    
+                    logger.info("Feature-based model loaded successfully")
             
             # Load ensemble configuration
             config_path = os.path.join(save_dir, "ensemble_config.json")
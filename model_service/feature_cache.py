@@ -0,0 +1,162 @@
+"""
+Training Feature Matrix Cache
+Extracts each sample's features once (in a process pool) and keeps the vectors on disk, keyed by sample digest
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional
+
+from feature_schema import FEATURE_SCHEMA, FeatureSchema
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fields EmailFeatureExtractor reads; anything else in a sample does not change its features
+EMAIL_FIELDS = ('subject', 'body', 'html', 'snippet', 'from', 'to', 'date', 'attachments', 'headers')
+
+# Below this many uncached samples a process pool costs more than it saves
+MIN_PARALLEL_SAMPLES = 64
+
+def email_data_from_sample(sample: Dict[str, Any]) -> Dict[str, Any]:
+    """The subset of a training sample that feature extraction looks at"""
+    return {
+        'subject': sample.get('subject', ''),
+        'body': sample.get('body', ''),
+        'html': sample.get('html', ''),
+        'snippet': sample.get('snippet', ''),
+        'from': sample.get('from', ''),
+        'to': sample.get('to', ''),
+        'date': sample.get('date'),
+        'attachments': sample.get('attachments', []),
+        'headers': sample.get('headers', {})
+    }
+
+def sample_digest(sample: Dict[str, Any]) -> str:
+    """Content digest of the fields that feed feature extraction"""
+    canonical = json.dumps(email_data_from_sample(sample), sort_keys=True, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+# One extractor per worker process, built on first use
+_worker_extractor = None
+
+def _extract_rows(email_batch: List[Dict[str, Any]], schema_dict: Dict[str, Any]) -> np.ndarray:
+    """Worker: feature vectors for a chunk of emails"""
+    global _worker_extractor
+    if _worker_extractor is None:
+        from feature_extractor import EmailFeatureExtractor
+        _worker_extractor = EmailFeatureExtractor()
+
+    schema = FeatureSchema.from_dict(schema_dict)
+    return schema.vectorize_batch([_worker_extractor.extract_features(email) for email in email_batch])
+
+class FeatureCache:
+    """
+    Feature vectors for training samples, stored as one compressed NPZ per schema
+
+    The file name carries the schema version and fingerprint, so a schema change
+    starts a fresh cache instead of serving stale columns. Bump
+    FEATURE_SCHEMA_VERSION when extraction itself changes what a column means.
+    """
+
+    def __init__(self, cache_dir: str, schema: FeatureSchema = FEATURE_SCHEMA, max_workers: Optional[int] = None):
+        self.cache_dir = str(cache_dir)
+        self.schema = schema
+        self.max_workers = max_workers or int(os.getenv("FEATURE_WORKERS", str(os.cpu_count() or 1)))
+        self.path = os.path.join(
+            self.cache_dir, f"features_v{schema.version}_{schema.fingerprint()}.npz"
+        )
+        self.lock = threading.Lock()
+        self._rows: Optional[Dict[str, np.ndarray]] = None
+        self.stats = {'hits': 0, 'extracted': 0}
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        if self._rows is not None:
+            return self._rows
+
+        self._rows = {}
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as data:
+                    for digest, row in zip(data['digests'], data['X']):
+                        self._rows[digest.decode('ascii')] = row
+                logger.info(f"Loaded {len(self._rows)} cached feature rows from {self.path}")
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable feature cache {self.path}: {e}")
+                self._rows = {}
+        return self._rows
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        digests = np.array([d.encode('ascii') for d in self._rows], dtype='S32')
+        X = np.stack(list(self._rows.values())) if self._rows else np.zeros((0, self.schema.num_features), dtype=np.float32)
+
+        # Write then rename so a crashed run never leaves a truncated cache behind
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez_compressed(tmp_path, digests=digests, X=X)
+        os.replace(tmp_path, self.path)
+
+    def _extract(self, emails: List[Dict[str, Any]]) -> np.ndarray:
+        """Feature rows for uncached emails, fanned out over worker processes"""
+        schema_dict = self.schema.to_dict()
+        workers = min(self.max_workers, max(1, len(emails) // MIN_PARALLEL_SAMPLES))
+        if workers <= 1:
+            return _extract_rows(emails, schema_dict)
+
+        chunk_size = max(1, min(256, len(emails) // (workers * 4)))
+        chunks = [emails[i:i + chunk_size] for i in range(0, len(emails), chunk_size)]
+        logger.info(f"Extracting features for {len(emails)} samples with {workers} processes")
+
+        # spawn: the parent may already hold torch/xgboost thread pools that do not survive fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(_extract_rows, chunks, [schema_dict] * len(chunks)))
+        return np.concatenate(parts)
+
+    def feature_matrix(self, samples: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        (n_samples, num_features) float32 matrix in sample order
+
+        Samples that already carry a 'features' dict are vectorized directly;
+        the rest come from the cache or are extracted once and added to it.
+        """
+        X = np.zeros((len(samples), self.schema.num_features), dtype=np.float32)
+
+        with self.lock:
+            rows = self._load()
+            missing: Dict[str, List[int]] = {}
+            for i, sample in enumerate(samples):
+                if sample.get('features'):
+                    self.schema.fill_row(sample['features'], X[i])
+                    continue
+                digest = sample_digest(sample)
+                if digest in rows:
+                    X[i] = rows[digest]
+                    self.stats['hits'] += 1
+                else:
+                    missing.setdefault(digest, []).append(i)
+
+            if missing:
+                digests = list(missing)
+                extracted = self._extract([email_data_from_sample(samples[missing[d][0]]) for d in digests])
+                for digest, row in zip(digests, extracted):
+                    rows[digest] = row
+                    X[missing[digest]] = row
+                self.stats['extracted'] += len(digests)
+                self._save()
+
+        return X
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'path': self.path,
+                'rows': len(self._rows) if self._rows is not None else None,
+                **self.stats
+            }
@@ -6,13 +6,14 @@ Extracts comprehensive features from email content, metadata, and structure
 import re
 import json
 from typing import Dict, List, Any, Optional, Tuple
-from urllib.parse import urlparse
 from email.utils import parseaddr, parsedate
 from datetime import datetime
 import html
 import logging
-from bs4 import BeautifulSoup
-import tldextract
+
+from feature_schema import stable_hash
+from domain_utils import host_suffix, url_host
+from html_document import ParsedHTML, parse_html
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -65,12 +66,17 @@ class EmailFeatureExtractor:
         features = {}
         
         try:
+            # Parse the HTML once and share it with every extractor below
+            html = email_data.get('html', '')
+            doc = self._parse_html(html) if html else None
+            
             # Extract content features
             features.update(self._extract_content_features(
                 email_data.get('subject', ''),
                 email_data.get('body', ''),
-                email_data.get('html', ''),
-                email_data.get('snippet', '')
+                html,
+                email_data.get('snippet', ''),
+                doc
             ))
             
             # Extract metadata features
@@ -90,7 +96,8 @@ class EmailFeatureExtractor:
             features.update(self._extract_structural_features(
                 email_data.get('subject', ''),
                 email_data.get('body', ''),
-                email_data.get('html', '')
+                html,
+                doc
             ))
             
             return features
@@ -99,9 +106,20 @@ class EmailFeatureExtractor:
             logger.error(f"Error extracting features: {e}")
             return self._get_default_features()
     
-    def _extract_content_features(self, subject: str, body: str, html: str, snippet: str) -> Dict[str, Any]:
+    def _parse_html(self, html: str) -> Optional[ParsedHTML]:
+        """Single pass over the HTML body; None if it cannot be parsed"""
+        try:
+            return parse_html(html)
+        except Exception as e:
+            logger.warning(f"Error parsing HTML: {e}")
+            return None
+    
+    def _extract_content_features(self, subject: str, body: str, html: str, snippet: str,
+                                  doc: Optional[ParsedHTML] = None) -> Dict[str, Any]:
         """Extract content-based features"""
         features = {}
+        if html and doc is None:
+            doc = self._parse_html(html)
         
         # Subject analysis
         subject_lower = subject.lower().strip()
@@ -122,19 +140,12 @@ class EmailFeatureExtractor:
             features['has_html'] = 1
             features['html_length'] = len(html)
             
-            # Extract text from HTML and calculate ratio
-            try:
-                soup = BeautifulSoup(html, 'html.parser')
-                html_text = soup.get_text()
-                html_text_length = len(html_text)
-                features['html_to_text_ratio'] = html_text_length / max(len(html), 1)
-                features['html_image_count'] = len(soup.find_all('img'))
-                
-                # Check for hidden text (small font, color matching background)
-                hidden_elements = soup.find_all(['span', 'div'], style=re.compile(r'font-size:\s*1?px|color:\s*#[fF]{6}'))
-                features['has_hidden_text'] = len(hidden_elements) > 0
-            except Exception as e:
-                logger.warning(f"Error parsing HTML: {e}")
+            # Text ratio, images and hidden text (small font, color matching background)
+            if doc is not None:
+                features['html_to_text_ratio'] = doc.text_length / max(len(html), 1)
+                features['html_image_count'] = doc.image_count
+                features['has_hidden_text'] = doc.has_hidden_text
+            else:
                 features['html_to_text_ratio'] = 0
                 features['html_image_count'] = 0
                 features['has_hidden_text'] = 0
@@ -153,7 +164,7 @@ class EmailFeatureExtractor:
         
         # Link extraction from HTML
         if html:
-            features.update(self._extract_link_features(html))
+            features.update(self._extract_link_features(html, doc))
         else:
             # Extract URLs from plain text
             url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+'
@@ -181,9 +192,9 @@ class EmailFeatureExtractor:
                 features['domain_levels'] = len(domain_parts)
                 features['is_common_domain'] = self._is_common_domain(domain)
                 
-                # Extract top-level domain
-                extracted = tldextract.extract(sender_email)
-                features['sender_tld'] = extracted.suffix.lower() if extracted.suffix else 'unknown'
+                # Extract top-level domain (offline suffix list, cached per host)
+                suffix = host_suffix(domain)
+                features['sender_tld'] = suffix if suffix else 'unknown'
             else:
                 features['sender_domain'] = 'unknown'
                 features['domain_levels'] = 0
@@ -276,7 +287,8 @@ class EmailFeatureExtractor:
         
         return features
     
-    def _extract_structural_features(self, subject: str, body: str, html: str) -> Dict[str, Any]:
+    def _extract_structural_features(self, subject: str, body: str, html: str,
+                                     doc: Optional[ParsedHTML] = None) -> Dict[str, Any]:
         """Extract structural and formatting features"""
         features = {}
         
@@ -294,16 +306,13 @@ class EmailFeatureExtractor:
             features['body_bold_count'] = body.count('**') + body.count('__')
             features['body_italic_count'] = body.count('*') + body.count('_')
             
-            if html:
-                try:
-                    soup = BeautifulSoup(html, 'html.parser')
-                    features['html_table_count'] = len(soup.find_all('table'))
-                    features['html_list_count'] = len(soup.find_all(['ul', 'ol']))
-                    features['html_form_count'] = len(soup.find_all('form'))
-                except:
-                    features['html_table_count'] = 0
-                    features['html_list_count'] = 0
-                    features['html_form_count'] = 0
+            if html and doc is None:
+                doc = self._parse_html(html)
+            
+            if doc is not None:
+                features['html_table_count'] = doc.table_count
+                features['html_list_count'] = doc.list_count
+                features['html_form_count'] = doc.form_count
             else:
                 features['html_table_count'] = 0
                 features['html_list_count'] = 0
@@ -315,19 +324,13 @@ class EmailFeatureExtractor:
         
         return features
     
-    def _extract_link_features(self, html: str) -> Dict[str, Any]:
+    def _extract_link_features(self, html: str, doc: Optional[ParsedHTML] = None) -> Dict[str, Any]:
         """Extract link-related features from HTML"""
         try:
-            soup = BeautifulSoup(html, 'html.parser')
-            links = soup.find_all('a', href=True)
-            
-            urls = []
-            for link in links:
-                href = link.get('href')
-                if href:
-                    urls.append(href)
+            if doc is None:
+                doc = parse_html(html)
             
-            return self._analyze_extracted_urls(urls)
+            return self._analyze_extracted_urls(doc.hrefs)
         except Exception as e:
             logger.warning(f"Error extracting links: {e}")
             return self._get_default_link_features()
@@ -347,8 +350,7 @@ class EmailFeatureExtractor:
                 
                 for url in urls:
                     try:
-                        parsed = urlparse(url)
-                        domain = parsed.netloc.lower()
+                        domain = url_host(url)
                         
                         if domain:
                             domains.add(domain)
@@ -578,8 +580,8 @@ def normalize_features(features: Dict[str, Any]) -> Dict[str, float]:
         elif key in ['sender_domain', 'sender_tld']:
             # Handle categorical features with simple encoding
             if isinstance(value, str):
-                # Simple hash-based encoding for domains
-                normalized[f"{key}_hash"] = float(hash(value) % 1000) / 1000.0
+                # Stable hash so training and serving processes agree
+                normalized[f"{key}_hash"] = stable_hash(value)
             else:
                 normalized[f"{key}_hash"] = 0.0
                 
@@ -0,0 +1,157 @@
+"""
+Versioned Feature Schema
+Single source of the feature-based model's column order, shared by training and serving
+"""
+
+import hashlib
+import logging
+import numpy as np
+from typing import Dict, List, Any, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# v1: column order only, sender_domain/sender_tld hashed with Python's salted hash()
+# v2: stable BLAKE2b hash buckets
+FEATURE_SCHEMA_VERSION = 2
+
+HASH_BUCKETS = 1000
+
+FEATURE_COLUMNS = [
+    'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
+    'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
+    'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
+    'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
+    'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
+    'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
+    'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
+    'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
+    'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
+    'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
+    'subject_question_count', 'subject_number_count', 'body_paragraph_count',
+    'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
+    'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header',
+    # Categorical feature hashes
+    'sender_domain_hash', 'sender_tld_hash'
+]
+
+# Large raw counts are scaled down the same way normalize_features does
+SCALED_FEATURES = {
+    'subject_length', 'subject_word_count', 'total_text_length', 'total_word_count',
+    'body_length', 'body_word_count', 'html_length', 'attachment_count',
+    'total_attachment_size', 'avg_attachment_size', 'link_count', 'external_link_count'
+}
+
+# Strict numeric features: anything that is not a number becomes 0.0
+NUMERIC_ONLY_FEATURES = {
+    'subject_caps_ratio', 'html_to_text_ratio', 'avg_paragraph_length',
+    'html_image_count', 'business_keyword_count', 'academic_keyword_count',
+    'job_keyword_count', 'unique_extension_count', 'suspicious_extension_count',
+    'unique_domain_count', 'short_url_count', 'recipient_count'
+}
+
+def stable_hash(value: str, buckets: int = HASH_BUCKETS) -> float:
+    """Process-independent hash of a string into [0, 1) with the given bucket count"""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return float(int.from_bytes(digest, 'little') % buckets) / buckets
+
+class FeatureSchema:
+    """Compiled column layout that fills float32 rows straight from raw feature dicts"""
+
+    # Column kinds
+    _SCALED, _NUMERIC, _GENERIC, _HASH = range(4)
+
+    def __init__(self, columns: List[str], version: int = FEATURE_SCHEMA_VERSION, hash_buckets: int = HASH_BUCKETS):
+        self.columns = list(columns)
+        self.version = version
+        self.hash_buckets = hash_buckets
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self._compiled = [self._compile(i, name) for i, name in enumerate(self.columns)]
+
+    def _compile(self, col: int, name: str):
+        """(column, raw feature key, kind) for one output column"""
+        if name.endswith('_hash'):
+            return col, name[:-len('_hash')], self._HASH
+        if name in SCALED_FEATURES:
+            return col, name, self._SCALED
+        if name in NUMERIC_ONLY_FEATURES:
+            return col, name, self._NUMERIC
+        return col, name, self._GENERIC
+
+    @property
+    def num_features(self) -> int:
+        return len(self.columns)
+
+    def fingerprint(self) -> str:
+        """Short digest of everything that affects column values"""
+        spec = f"{self.version}|{self.hash_buckets}|{','.join(self.columns)}"
+        return hashlib.blake2b(spec.encode('utf-8'), digest_size=8).hexdigest()
+
+    def fill_row(self, features: Dict[str, Any], out: np.ndarray):
+        """Write one email's columns into a preallocated (zeroed) row"""
+        for col, key, kind in self._compiled:
+            value = features.get(key)
+            if value is None:
+                continue
+
+            if kind == self._HASH:
+                if isinstance(value, str):
+                    out[col] = stable_hash(value, self.hash_buckets)
+            elif isinstance(value, (int, float)):
+                value = float(value)
+                if kind == self._SCALED and value > 1000:
+                    value = min(10.0, max(0.0, value / 1000.0))
+                out[col] = value
+            elif kind == self._GENERIC:
+                try:
+                    out[col] = float(value)
+                except (ValueError, TypeError):
+                    pass
+
+    def vectorize(self, features: Dict[str, Any]) -> np.ndarray:
+        """One email -> float32 vector of length num_features"""
+        row = np.zeros(self.num_features, dtype=np.float32)
+        self.fill_row(features, row)
+        return row
+
+    def vectorize_batch(self, features_list: List[Dict[str, Any]]) -> np.ndarray:
+        """Many emails -> preallocated float32 (n_emails, num_features) matrix"""
+        X = np.zeros((len(features_list), self.num_features), dtype=np.float32)
+        for row, features in enumerate(features_list):
+            self.fill_row(features, X[row])
+        return X
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'hash_buckets': self.hash_buckets,
+            'columns': self.columns,
+            'fingerprint': self.fingerprint()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FeatureSchema':
+        return cls(data['columns'], version=data['version'], hash_buckets=data.get('hash_buckets', HASH_BUCKETS))
+
+    def check_compatible(self, saved: Optional[Dict[str, Any]]) -> List[str]:
+        """
+        Compare a schema saved with a model against this one
+
+        Returns:
+            List of problems; empty when the model can be served with this schema
+        """
+        if saved is None:
+            return [f"model was saved without a feature schema (pre-v{FEATURE_SCHEMA_VERSION})"]
+
+        problems = []
+        if saved.get('version') != self.version:
+            problems.append(f"schema version {saved.get('version')} != {self.version}")
+        if saved.get('hash_buckets', HASH_BUCKETS) != self.hash_buckets:
+            problems.append(f"hash buckets {saved.get('hash_buckets')} != {self.hash_buckets}")
+        if saved.get('columns') != self.columns:
+            problems.append("column order differs")
+        return problems
+
+# The schema every trainer and server uses
+FEATURE_SCHEMA = FeatureSchema(FEATURE_COLUMNS)
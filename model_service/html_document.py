@@ -0,0 +1,167 @@
+"""
+Single-Pass HTML Document Parsing
+Tokenizes an email's HTML once and collects everything the feature extractors need
+"""
+
+import re
+import logging
+from html.parser import HTMLParser
+from typing import List
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Small font or white text on (usually) white background
+HIDDEN_STYLE = re.compile(r'font-size:\s*1?px|color:\s*#[fF]{6}')
+
+# Same rules BeautifulSoup applies when building a tree, so the numbers match the old get_text()
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+_NON_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+_VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer'
+}
+_LIST_TAGS = {'ul', 'ol'}
+_HIDDEN_TEXT_TAGS = {'span', 'div'}
+
+class ParsedHTML:
+    """Everything derived from one HTML body: visible text, counts and hrefs"""
+
+    __slots__ = ('text_length', 'image_count', 'hidden_element_count', 'table_count',
+                 'list_count', 'form_count', 'hrefs')
+
+    def __init__(self):
+        self.text_length = 0
+        self.image_count = 0
+        self.hidden_element_count = 0
+        self.table_count = 0
+        self.list_count = 0
+        self.form_count = 0
+        self.hrefs: List[str] = []
+
+    @property
+    def has_hidden_text(self) -> bool:
+        return self.hidden_element_count > 0
+
+class _DocumentCollector(HTMLParser):
+    """Streaming tokenizer that fills a ParsedHTML without building a tree"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.doc = ParsedHTML()
+        self._pending: List[str] = []
+        # Open element names; only needed to know when text is hidden or whitespace-preserving
+        self._open: List[str] = []
+        self._non_text_depth = 0
+        self._preserve_depth = 0
+
+    def _flush_text(self):
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._pending = []
+        if self._non_text_depth:
+            return
+        # Whitespace-only runs between tags collapse to a single character
+        if not self._preserve_depth and not text.strip(_ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        self.doc.text_length += len(text)
+
+    def _count(self, tag, attrs):
+        doc = self.doc
+        if tag == 'img':
+            doc.image_count += 1
+        elif tag == 'a':
+            href = None
+            for name, value in attrs:
+                if name == 'href':
+                    href = value
+            if href:
+                doc.hrefs.append(href)
+        elif tag in _HIDDEN_TEXT_TAGS:
+            style = None
+            for name, value in attrs:
+                if name == 'style':
+                    style = value
+            if style and HIDDEN_STYLE.search(style):
+                doc.hidden_element_count += 1
+        elif tag == 'table':
+            doc.table_count += 1
+        elif tag in _LIST_TAGS:
+            doc.list_count += 1
+        elif tag == 'form':
+            doc.form_count += 1
+
+    def _push(self, tag):
+        self._open.append(tag)
+        if tag in _NON_TEXT_TAGS:
+            self._non_text_depth += 1
+        elif tag in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve_depth += 1
+
+    def _pop_to(self, tag):
+        # A stray end tag closes everything opened after the matching start tag; unmatched ones are ignored
+        if tag not in self._open:
+            return
+        while True:
+            closed = self._open.pop()
+            if closed in _NON_TEXT_TAGS:
+                self._non_text_depth -= 1
+            elif closed in _PRESERVE_WHITESPACE_TAGS:
+                self._preserve_depth -= 1
+            if closed == tag:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        self._count(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self._push(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush_text()
+        self._count(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        self._pop_to(tag)
+
+    def handle_data(self, data):
+        self._pending.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
+    def handle_decl(self, decl):
+        self._flush_text()
+
+    def handle_pi(self, data):
+        self._flush_text()
+
+    def unknown_decl(self, data):
+        self._flush_text()
+        # <![CDATA[...]]> content is text
+        if data.startswith('CDATA[') and not self._non_text_depth:
+            self.doc.text_length += len(data) - len('CDATA[')
+
+    def close(self):
+        super().close()
+        self._flush_text()
+
+def parse_html(html: str) -> ParsedHTML:
+    """
+    Parse an HTML body once
+
+    Args:
+        html: Raw HTML string
+
+    Returns:
+        ParsedHTML with text length, image/table/list/form counts, hidden-text elements and hrefs
+    """
+    collector = _DocumentCollector()
+    collector.feed(html)
+    collector.close()
+    return collector.doc
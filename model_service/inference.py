@@ -7,6 +7,8 @@ from typing import Dict, Any, List, Union
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import logging
 
+from local_models import resolve_serving_model_dir, pretrained_kwargs, check_weights_format
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,9 +19,9 @@ class EmailCategorizer:
         Initialize the email categorizer with Hugging Face model
         
         Args:
-            model_name: Hugging Face model name
+            model_name: Hugging Face model name (SERVING_MODEL_DIR, when set, takes precedence)
         """
-        self.model_name = model_name
+        self.model_name = resolve_serving_model_dir() or model_name
         self.model = None
         self.tokenizer = None
         self.categories = [
@@ -36,16 +38,24 @@ class EmailCategorizer:
         Load the pre-trained model and tokenizer
         """
         try:
+            local = pretrained_kwargs(self.model_name)
             logger.info(f"Loading tokenizer: {self.model_name}")
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, **local)
             
             logger.info(f"Loading model: {self.model_name}")
-            # Load model with classification head for our 5 categories
-            self.model = AutoModelForSequenceClassification.from_pretrained(
-                self.model_name,
-                num_labels=len(self.categories),
-                problem_type="single_label_classification"
-            )
+            if check_weights_format(self.model_name):
+                # Fine-tuned save folder: keep its own head and label names
+                self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name, **local)
+                id2label = self.model.config.id2label
+                self.categories = [id2label[i] for i in sorted(id2label)]
+            else:
+                # Load model with classification head for our 5 categories
+                self.model = AutoModelForSequenceClassification.from_pretrained(
+                    self.model_name,
+                    num_labels=len(self.categories),
+                    problem_type="single_label_classification",
+                    **local
+                )
             
             # Move model to device
             self.model.to(self.device)
@@ -0,0 +1,102 @@
+"""
+Label Mapping Compatibility Checks
+Keeps label ids stable across retrains and refuses models whose head disagrees with label_mappings.json
+"""
+
+import json
+import os
+import re
+import logging
+from typing import Dict, List, Any, Optional, Iterable
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LABEL_MAPPINGS_FILE = "label_mappings.json"
+
+# transformers fills id2label with LABEL_0, LABEL_1, ... when none is given
+_GENERIC_LABEL = re.compile(r"^LABEL_\d+$")
+
+def load_label_mappings(model_dir: str) -> Optional[Dict[str, Any]]:
+    """Read label_mappings.json from a model directory (ids normalized to int)"""
+    path = os.path.join(model_dir, LABEL_MAPPINGS_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        mappings = json.load(f)
+
+    id2label = {int(k): v for k, v in mappings.get("id2label", {}).items()}
+    label2id = {k: int(v) for k, v in mappings.get("label2id", {}).items()}
+    if not label2id:
+        label2id = {v: k for k, v in id2label.items()}
+    if not id2label:
+        id2label = {v: k for k, v in label2id.items()}
+    return {"label2id": label2id, "id2label": id2label}
+
+def extend_label_mapping(label2id: Dict[str, int], labels: Iterable[str]) -> Dict[str, int]:
+    """
+    Append unseen labels after the existing ids without renumbering anything
+
+    Args:
+        label2id: Existing mapping (left untouched)
+        labels: Labels found in the new data
+
+    Returns:
+        New mapping; existing labels keep their ids, new ones get max_id+1, ...
+    """
+    extended = dict(label2id)
+    next_id = max(extended.values()) + 1 if extended else 0
+    for label in sorted(set(labels) - set(extended)):
+        extended[label] = next_id
+        next_id += 1
+    return extended
+
+def compare_mappings(base_label2id: Dict[str, int], new_label2id: Dict[str, int]) -> Dict[str, Any]:
+    """Report how a retrained model's labels relate to the deployed model's"""
+    moved = {
+        label: {"old_id": old_id, "new_id": new_label2id[label]}
+        for label, old_id in base_label2id.items()
+        if label in new_label2id and new_label2id[label] != old_id
+    }
+    removed = sorted(set(base_label2id) - set(new_label2id))
+    added = sorted(set(new_label2id) - set(base_label2id), key=lambda l: new_label2id[l])
+
+    return {
+        "compatible": not moved and not removed,
+        "base_num_labels": len(base_label2id),
+        "num_labels": len(new_label2id),
+        "added_labels": added,
+        "removed_labels": removed,
+        "moved_labels": moved
+    }
+
+def check_model_labels(config_id2label: Optional[Dict[Any, str]], num_labels: Optional[int],
+                       mappings: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    Cross-check a model config's head against its label_mappings.json
+
+    Returns:
+        List of problems; empty when the head and mappings agree
+    """
+    if mappings is None:
+        return []
+
+    id2label = mappings["id2label"]
+    problems = []
+
+    if num_labels is not None and num_labels != len(id2label):
+        problems.append(f"model head has {num_labels} outputs but label_mappings.json lists {len(id2label)} labels")
+
+    if sorted(id2label) != list(range(len(id2label))):
+        problems.append(f"label ids in label_mappings.json are not contiguous: {sorted(id2label)}")
+
+    for raw_idx, name in (config_id2label or {}).items():
+        idx = int(raw_idx)
+        if _GENERIC_LABEL.match(str(name)):
+            continue
+        if idx in id2label and id2label[idx] != name:
+            problems.append(f"id {idx} is '{name}' in config.json but '{id2label[idx]}' in label_mappings.json")
+
+    return problems
@@ -0,0 +1,53 @@
+"""
+Local Model Resolution
+Locates the one configured model bundle on disk and keeps transformers loads off the Hugging Face Hub
+"""
+
+import os
+import logging
+from typing import Dict, Any, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fine-tuned bundle (transformers save folder) to serve from startup; skips the base model entirely
+SERVING_MODEL_DIR = os.getenv("SERVING_MODEL_DIR")
+# Never contact the hub; hub names must already be in the local cache
+MODEL_OFFLINE = os.getenv("MODEL_OFFLINE", "false").strip().lower() in ("1", "true", "yes", "on")
+
+SAFETENSORS_WEIGHTS = "model.safetensors"
+PICKLE_WEIGHTS = "pytorch_model.bin"
+
+def resolve_serving_model_dir() -> Optional[str]:
+    """The configured local bundle, or None to start from the base model"""
+    if not SERVING_MODEL_DIR:
+        return None
+    if not os.path.isdir(SERVING_MODEL_DIR):
+        raise FileNotFoundError(f"SERVING_MODEL_DIR does not exist: {SERVING_MODEL_DIR}")
+    check_weights_format(SERVING_MODEL_DIR)
+    return SERVING_MODEL_DIR
+
+def check_weights_format(model_dir: str) -> Optional[str]:
+    """
+    'safetensors' or 'bin' for a save folder (None if it has neither single-file format)
+
+    transformers memory-maps safetensors and reads tensors straight from the
+    page cache; pickled .bin checkpoints are unpickled into fresh memory,
+    which is slower and not shared between worker processes.
+    """
+    if os.path.exists(os.path.join(model_dir, SAFETENSORS_WEIGHTS)) or os.path.exists(
+        os.path.join(model_dir, SAFETENSORS_WEIGHTS + ".index.json")
+    ):
+        return "safetensors"
+    if os.path.exists(os.path.join(model_dir, PICKLE_WEIGHTS)):
+        logger.warning(
+            f"{model_dir} has pickled weights; re-save with save_pretrained(safe_serialization=True) "
+            f"for memory-mapped loading"
+        )
+        return "bin"
+    return None
+
+def pretrained_kwargs(name_or_path: str) -> Dict[str, Any]:
+    """from_pretrained keyword arguments that keep a load local"""
+    return {"local_files_only": MODEL_OFFLINE or os.path.isdir(name_or_path)}
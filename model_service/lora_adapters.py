@@ -0,0 +1,278 @@
+"""
+Low-Rank Adapters for Per-User Email Classification
+One shared DistilBERT encoder, a few MB of LoRA weights and a small head per user
+"""
+
+import torch
+import torch.nn as nn
+import contextlib
+import contextvars
+import hashlib
+import logging
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADAPTER_WEIGHTS_FILE = "adapter.pt"
+ADAPTER_CONFIG_FILE = "adapter_config.json"
+DEFAULT_TARGETS = ("q_lin", "v_lin")
+
+# Adapter applied by LoRALinear layers in the current thread/task; concurrent forwards each see their own
+_active_adapter: contextvars.ContextVar = contextvars.ContextVar("lora_active_adapter", default=None)
+
+class LoRALinear(nn.Module):
+    """
+    Frozen shared Linear plus an optional low-rank update
+
+    The update comes from the UserAdapter active in the calling context (see
+    use_adapter), so one shared model serves different users on different
+    threads at once; the base weights are never copied.
+    """
+
+    def __init__(self, base: nn.Linear, name: str):
+        super().__init__()
+        self.base = base
+        self.name = name
+
+    @property
+    def in_features(self) -> int:
+        return self.base.in_features
+
+    @property
+    def out_features(self) -> int:
+        return self.base.out_features
+
+    @property
+    def weight(self) -> torch.Tensor:
+        return self.base.weight
+
+    @property
+    def bias(self) -> Optional[torch.Tensor]:
+        return self.base.bias
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.base(x)
+        adapter = _active_adapter.get()
+        if adapter is None:
+            return out
+        lora_a, lora_b = adapter.lora_a[self.name], adapter.lora_b[self.name]
+        return out + (adapter.dropout(x) @ lora_a.t() @ lora_b.t()) * adapter.scaling
+
+class UserAdapter(nn.Module):
+    """LoRA matrices for the targeted encoder projections plus a per-user classifier"""
+
+    def __init__(
+        self,
+        layer_shapes: Dict[str, List[int]],
+        dim: int,
+        labels: List[str],
+        rank: int = 8,
+        alpha: float = 16.0,
+        dropout: float = 0.1
+    ):
+        super().__init__()
+        self.layer_shapes = layer_shapes
+        self.dim = dim
+        self.labels = list(labels)
+        self.rank = rank
+        self.alpha = alpha
+        self.scaling = alpha / rank
+        self.dropout = nn.Dropout(dropout)
+
+        # ParameterDict keys may not contain dots
+        self.lora_a = nn.ParameterDict()
+        self.lora_b = nn.ParameterDict()
+        for name, (in_features, out_features) in layer_shapes.items():
+            key = _key(name)
+            # B starts at zero so a fresh adapter reproduces the base model exactly
+            self.lora_a[key] = nn.Parameter(torch.randn(rank, in_features) * 0.01)
+            self.lora_b[key] = nn.Parameter(torch.zeros(out_features, rank))
+
+        self.classifier = nn.Linear(dim, len(self.labels))
+
+    def num_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.parameters())
+
+    def save(self, adapter_dir: str, base_model: str = ""):
+        """Save adapter weights and config; base_model is the base_model_fingerprint it was trained on"""
+        os.makedirs(adapter_dir, exist_ok=True)
+        torch.save(self.state_dict(), os.path.join(adapter_dir, ADAPTER_WEIGHTS_FILE))
+        with open(os.path.join(adapter_dir, ADAPTER_CONFIG_FILE), "w") as f:
+            json.dump({
+                "layer_shapes": self.layer_shapes,
+                "dim": self.dim,
+                "labels": self.labels,
+                "rank": self.rank,
+                "alpha": self.alpha,
+                "base_model": base_model
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, adapter_dir: str, map_location: str = "cpu") -> 'UserAdapter':
+        """Load an adapter saved with save()"""
+        with open(os.path.join(adapter_dir, ADAPTER_CONFIG_FILE), "r") as f:
+            config = json.load(f)
+        adapter = cls(
+            config["layer_shapes"], config["dim"], config["labels"],
+            rank=config["rank"], alpha=config["alpha"]
+        )
+        adapter.load_state_dict(torch.load(os.path.join(adapter_dir, ADAPTER_WEIGHTS_FILE), map_location=map_location))
+        adapter.base_model = config.get("base_model", "")
+        adapter.eval()
+        return adapter
+
+def _key(module_name: str) -> str:
+    return module_name.replace(".", "__")
+
+def safe_user_dir(adapters_dir: str, user_id: str) -> str:
+    """Adapter directory for a user, with the id reduced to filesystem-safe characters (ValueError for '.'/'..')"""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(user_id))
+    if not name.strip("."):
+        raise ValueError(f"Invalid user id for an adapter directory: {user_id!r}")
+    return os.path.join(adapters_dir, name)
+
+def base_model_fingerprint(model: nn.Module) -> str:
+    """
+    Hash of the shared weights an adapter runs on (encoder and pre-classifier)
+
+    Saved as the adapter's base_model and compared at load, so an adapter is
+    never applied to a different model after a swap. LoRA wrapping does not
+    change the fingerprint.
+    """
+    digest = hashlib.sha256()
+    modules = [("distilbert", model.distilbert), ("pre_classifier", getattr(model, "pre_classifier", None))] \
+        if hasattr(model, "distilbert") else [("", model)]
+    for prefix, module in modules:
+        if module is None:
+            continue
+        for name, parameter in sorted(module.named_parameters(), key=lambda item: item[0].replace(".base.", ".")):
+            digest.update(f"{prefix}.{name.replace('.base.', '.')}".encode())
+            digest.update(parameter.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def inject_lora(model: nn.Module, targets=DEFAULT_TARGETS) -> Dict[str, List[int]]:
+    """
+    Wrap the targeted Linear layers of the encoder in LoRALinear (idempotent)
+
+    Returns:
+        {module name: [in_features, out_features]} for every wrapped layer
+    """
+    encoder = model.distilbert if hasattr(model, "distilbert") else model
+    shapes = {}
+    for name, module in list(encoder.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if child_name not in targets:
+                continue
+            full_name = f"{name}.{child_name}" if name else child_name
+            if isinstance(child, nn.Linear):
+                setattr(module, child_name, LoRALinear(child, _key(full_name)))
+            elif not isinstance(child, LoRALinear):
+                continue
+            shapes[full_name] = [child.in_features, child.out_features]
+    return shapes
+
+@contextlib.contextmanager
+def use_adapter(adapter: Optional[UserAdapter]):
+    """Make LoRALinear layers apply `adapter` for forwards run in this context (None: the base model)"""
+    token = _active_adapter.set(adapter)
+    try:
+        yield
+    finally:
+        _active_adapter.reset(token)
+
+def adapter_logits(model, adapter: UserAdapter, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Shared encoder (with the adapter active) -> shared pre_classifier -> user classifier"""
+    with use_adapter(adapter):
+        hidden = model.distilbert(input_ids=input_ids, attention_mask=attention_mask)[0][:, 0]
+    pooled = nn.functional.relu(model.pre_classifier(hidden))
+    return adapter.classifier(adapter.dropout(pooled))
+
+class AdapterRegistry:
+    """LRU of per-user adapters kept in memory next to one shared base model"""
+
+    def __init__(self, adapters_dir: str, max_adapters: int = 64, device: str = "cpu"):
+        self.adapters_dir = adapters_dir
+        self.max_adapters = max_adapters
+        self.device = device
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "stale": 0}
+
+    def get(self, user_id: Optional[str], dim: int, base_model: str) -> Optional[UserAdapter]:
+        """
+        Return the user's adapter, loading it from disk on a miss
+
+        None unless the adapter was trained against `base_model` (the serving
+        model's base_model_fingerprint); a stale adapter stays cached so the
+        next request does not re-read it, but is never applied.
+        """
+        if not user_id:
+            return None
+
+        with self.lock:
+            if user_id in self.cache:
+                self.cache.move_to_end(user_id)
+                self.stats["hits"] += 1
+                adapter = self.cache[user_id]
+                return adapter if adapter.base_model == base_model else None
+
+        # Users without a trained adapter fall back to the shared model
+        try:
+            adapter_dir = safe_user_dir(self.adapters_dir, user_id)
+        except ValueError as e:
+            logger.warning(str(e))
+            return None
+        if not os.path.exists(os.path.join(adapter_dir, ADAPTER_CONFIG_FILE)):
+            return None
+
+        try:
+            adapter = UserAdapter.load(adapter_dir, map_location=str(self.device)).to(self.device)
+        except Exception as e:
+            logger.error(f"Failed to load adapter for user {user_id}: {e}")
+            return None
+
+        if adapter.dim != dim:
+            logger.error(f"Adapter for user {user_id} expects dim {adapter.dim}, base model has {dim}")
+            return None
+
+        with self.lock:
+            self.cache[user_id] = adapter
+            self.stats["loads"] += 1
+            while len(self.cache) > self.max_adapters:
+                evicted, _ = self.cache.popitem(last=False)
+                self.stats["evictions"] += 1
+                logger.info(f"Evicted adapter for user {evicted}")
+
+        if adapter.base_model != base_model:
+            self.stats["stale"] += 1
+            logger.warning(
+                f"Adapter for user {user_id} was trained against another base model "
+                f"({adapter.base_model[:12] or 'unknown'}, serving {base_model[:12]}); using the shared model until it is retrained"
+            )
+            return None
+        return adapter
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's adapter (or all) so the next request reloads from disk"""
+        with self.lock:
+            if user_id is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(user_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "adapters_dir": self.adapters_dir,
+                "loaded": len(self.cache),
+                "max_adapters": self.max_adapters,
+                "memory_bytes": sum(a.num_bytes() for a in self.cache.values()),
+                **self.stats
+            }
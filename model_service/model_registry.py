@@ -0,0 +1,194 @@
+"""
+Multi-Version Model Registry
+Keeps several fine-tuned model versions resident next to production, evicted LRU under a memory budget
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_REGISTRY_MEMORY_MB = float(os.getenv("MODEL_REGISTRY_MEMORY_MB", "2048"))
+
+# Files that fully determine how a saved tokenizer splits text
+TOKENIZER_FILES = ("tokenizer.json", "vocab.txt", "tokenizer_config.json", "special_tokens_map.json")
+
+def bundle_memory_bytes(bundle) -> int:
+    """Bytes held by a bundle's parameters and buffers (model and early-exit heads)"""
+    total = 0
+    for module in (bundle.model, bundle.exit_heads):
+        if module is None:
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+def tokenizer_fingerprint(model_path: str) -> Optional[str]:
+    """Digest of a checkpoint's tokenizer files; equal digests can share one tokenizer"""
+    if not model_path or not os.path.isdir(model_path):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    found = False
+    for name in TOKENIZER_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            found = True
+            digest.update(name.encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest() if found else None
+
+class ModelRegistry:
+    """
+    LRU of ModelBundles keyed by version name
+
+    Versions are registered with a checkpoint path (or found through the
+    resolver, e.g. the ModelVersion table) and loaded on first use. When the
+    resident models exceed the memory budget the least recently used ones are
+    dropped; requests already holding an evicted bundle finish on it, and the
+    next request for that version reloads it. Checkpoints with identical
+    tokenizer files share one tokenizer instance.
+
+    Adopted bundles (a replaced production model) may not be reloadable from
+    their source: it can be a hub name, or the head may have been resized in
+    memory. The latest adopted version is pinned against eviction; older ones
+    are forgotten entirely once evicted.
+    """
+
+    def __init__(self, classifier, memory_budget_mb: float = MODEL_REGISTRY_MEMORY_MB,
+                 resolver: Optional[Callable[[str], Optional[str]]] = None):
+        self.classifier = classifier
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.resolver = resolver
+        self.paths: Dict[str, str] = {}
+        # version -> (bundle, bytes, tokenizer fingerprint)
+        self.cache = OrderedDict()
+        # tenant -> version
+        self.routes: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.load_locks: Dict[str, threading.Lock] = {}
+        self.adopted = set()
+        self.pinned: Optional[str] = None
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def register(self, version: str, model_path: str):
+        """Make a version known; it is loaded on first use"""
+        with self.lock:
+            if self.paths.get(version) != model_path:
+                self.cache.pop(version, None)
+            self.paths[version] = model_path
+            self.adopted.discard(version)
+            if self.pinned == version:
+                self.pinned = None
+
+    def adopt(self, version: str, bundle):
+        """Keep an already loaded bundle (e.g. the production model being replaced) resident and pinned"""
+        entry = (bundle, bundle_memory_bytes(bundle), tokenizer_fingerprint(bundle.source))
+        with self.lock:
+            self.paths[version] = bundle.source
+            self.cache[version] = entry
+            self.cache.move_to_end(version)
+            self.adopted.add(version)
+            self.pinned = version
+            self._evict(keep=version)
+
+    def route(self, tenant: str, version: Optional[str]):
+        """Pin a tenant to a version (None removes the pin)"""
+        with self.lock:
+            if version is None:
+                self.routes.pop(tenant, None)
+            else:
+                self.routes[tenant] = version
+
+    def version_for(self, tenant: Optional[str]) -> Optional[str]:
+        if not tenant or not self.routes:
+            return None
+        return self.routes.get(tenant)
+
+    def get(self, version: str):
+        """The bundle for a version, loading it (and evicting others) on a miss"""
+        with self.lock:
+            if version in self.cache:
+                self.cache.move_to_end(version)
+                self.stats["hits"] += 1
+                return self.cache[version][0]
+            load_lock = self.load_locks.setdefault(version, threading.Lock())
+
+        # One load per version; concurrent requests for it wait for the same load
+        with load_lock:
+            with self.lock:
+                if version in self.cache:
+                    self.cache.move_to_end(version)
+                    self.stats["hits"] += 1
+                    return self.cache[version][0]
+                model_path = self.paths.get(version)
+
+            if model_path is None and self.resolver is not None:
+                model_path = self.resolver(version)
+                if model_path:
+                    self.register(version, model_path)
+            if not model_path:
+                raise KeyError(f"Unknown model version: {version}")
+
+            fingerprint = tokenizer_fingerprint(model_path)
+            bundle = self.classifier.load_candidate(model_path, tokenizer=self._shared_tokenizer(fingerprint))
+            if bundle is None:
+                raise RuntimeError(f"Failed to load model version {version} from {model_path}")
+
+            entry = (bundle, bundle_memory_bytes(bundle), fingerprint)
+            with self.lock:
+                self.cache[version] = entry
+                self.stats["loads"] += 1
+                self._evict(keep=version)
+            logger.info(f"Model version {version} resident ({entry[1] / 1024 / 1024:.1f} MB)")
+            return bundle
+
+    def _shared_tokenizer(self, fingerprint: Optional[str]):
+        if fingerprint is None:
+            return None
+        production = self.classifier.bundle
+        if production is not None and tokenizer_fingerprint(production.source) == fingerprint:
+            return production.tokenizer
+        with self.lock:
+            for bundle, _, resident_fingerprint in self.cache.values():
+                if resident_fingerprint == fingerprint:
+                    return bundle.tokenizer
+        return None
+
+    def _evict(self, keep: str):
+        """Drop least recently used versions until under budget; callers hold the lock"""
+        while self._resident_bytes() > self.memory_budget:
+            version = next((v for v in self.cache if v != keep and v != self.pinned), None)
+            if version is None:
+                break
+            self.cache.pop(version)
+            if version in self.adopted:
+                # Only the evicted bundle held these weights; requests for it now get 404
+                self.adopted.discard(version)
+                self.paths.pop(version, None)
+            self.stats["evictions"] += 1
+            logger.info(f"Evicted model version {version}")
+
+    def _resident_bytes(self) -> int:
+        return sum(nbytes for _, nbytes, _ in self.cache.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "memory_budget_bytes": self.memory_budget,
+                "memory_bytes": self._resident_bytes(),
+                "resident": {
+                    version: {**bundle.describe(), "memory_bytes": nbytes}
+                    for version, (bundle, nbytes, _) in self.cache.items()
+                },
+                "registered": dict(self.paths),
+                "routes": dict(self.routes),
+                "pinned": self.pinned,
+                **self.stats
+            }
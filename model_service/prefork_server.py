@@ -0,0 +1,166 @@
+"""
+Pre-Fork Launcher for the Enhanced Model Service
+Loads and warms the models once in a parent process, then forks uvicorn workers that share the weight pages
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Workers that die this soon after starting are not respawned (e.g. a crash on import)
+MIN_WORKER_LIFETIME_SECONDS = 5.0
+
+def freeze_model_memory(classifier, registry=None):
+    """
+    Keep the parent's model pages untouched so forked workers share them
+
+    Tensor storage is only copied into a worker when something writes to it.
+    Inference never does once autograd is off for every parameter; gc.freeze()
+    moves all objects created so far into the permanent generation, so the
+    collector in each worker does not write to their headers either.
+    """
+    bundles = [classifier.bundle]
+    if registry is not None:
+        bundles.extend(bundle for bundle, _, _ in registry.cache.values())
+    for bundle in bundles:
+        if bundle is None:
+            continue
+        for module in (bundle.model, bundle.exit_heads):
+            if module is not None:
+                module.eval()
+                module.requires_grad_(False)
+    gc.collect()
+    gc.freeze()
+
+def load_models():
+    """
+    Load and warm the models in the parent, ready to fork; returns enhanced_app
+
+    The warm-up runs on a single torch thread. An OpenMP pool that has run
+    work in the parent is not usable in a forked child: a worker that then
+    asks for more than one thread deadlocks on its first forward pass. With
+    one thread no pool exists yet, and each worker builds its own after
+    set_num_threads.
+    """
+    import torch
+    import enhanced_app
+
+    torch.set_num_threads(1)
+    enhanced_app.initialize_models()
+    freeze_model_memory(enhanced_app.classifier, enhanced_app.model_registry)
+    return enhanced_app
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket created in the parent and inherited by every worker"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock: socket.socket, threads: int):
+    """Child process body: one uvicorn server on the shared socket"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    import torch
+    import uvicorn
+
+    # Each worker gets its own slice of the cores instead of all of them
+    torch.set_num_threads(threads)
+    config = uvicorn.Config(app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def spawn_worker(app, sock: socket.socket, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, threads)
+        except BaseException:
+            logger.exception("Worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+def serve(host: str, port: int, workers: int, threads_per_worker: int):
+    """
+    Load once, fork `workers` servers and keep that many running until SIGTERM/SIGINT
+
+    Nothing may start threads in the parent before the fork: only the
+    forking thread survives in a child, so a thread pool that has run work
+    (e.g. the ensemble's branch executor or torch's intra-op pool) would be
+    left holding dead threads. load_models() therefore warms DistilBERT on a
+    single torch thread.
+    """
+    # Imported before the fork so workers share the modules as well as the weights
+    import uvicorn  # noqa: F401
+
+    enhanced_app = load_models()
+    sock = bind_socket(host, port)
+    logger.info(f"Models loaded in parent {os.getpid()}; forking {workers} workers on {host}:{port}")
+
+    children = {}
+    for _ in range(workers):
+        children[spawn_worker(enhanced_app.app, sock, threads_per_worker)] = time.monotonic()
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME_SECONDS:
+            logger.error(f"Worker {pid} died right after starting; not respawning")
+            continue
+        children[spawn_worker(enhanced_app.app, sock, threads_per_worker)] = time.monotonic()
+
+    sock.close()
+    logger.info("All workers stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the enhanced model service from pre-forked workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MODEL_SERVICE_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    serve(args.host, args.port, workers, threads)
+
+if __name__ == "__main__":
+    sys.exit(main())
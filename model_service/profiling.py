@@ -0,0 +1,251 @@
+"""
+On-Demand Profiling for the Model Service
+Time-boxed stack sampling, a torch.profiler capture over the next N requests, and sampled per-request stage logs
+"""
+
+import asyncio
+import collections
+import contextvars
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Admin endpoints are only mounted when this is set
+PROFILING_ENDPOINTS = os.getenv("PROFILING_ENDPOINTS", "false").lower() == "true"
+# Fraction of requests whose per-stage timings are logged (0 disables it)
+STAGE_TIMING_SAMPLE_RATE = float(os.getenv("STAGE_TIMING_SAMPLE_RATE", "0"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "sortify-profiles"))
+
+MAX_PROFILE_SECONDS = 120.0
+MAX_PROFILE_REQUESTS = 1000
+
+# Stage -> seconds for the current request, present only when the request was sampled
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "stage_timings", default=None
+)
+
+def record_stage(stage: str, seconds: float):
+    """Add a stage duration to the current request's log entry, if it is being sampled"""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage(name: str):
+    """Time a block for the sampled stage log (a no-op for unsampled requests)"""
+    if _stage_timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """
+    Statistical profiler over every thread of the process
+
+    A background loop reads sys._current_frames() at a fixed interval and
+    counts identical stacks. The result is in the folded format
+    ("thread;outer;...;inner count") read by flamegraph.pl and speedscope.
+    Nothing is hooked into the interpreter, so requests run at full speed
+    and the cost is one stack walk per thread per interval.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def run(self, duration: float) -> str:
+        counts: collections.Counter = collections.Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+class TorchRequestProfiler:
+    """
+    torch.profiler session that stays open for the next N requests
+
+    Kineto must be started and stopped on the same thread; arm(), finish()
+    and request_finished() are all called from the event loop. Inference runs
+    on the request scheduler's threads, so the session records ops on every
+    thread (profile_all_threads); torch builds without that option are refused.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.remaining = 0
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+    def arm(self, num_requests: int):
+        """Start profiling; the session ends after num_requests requests or finish()"""
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+        from torch._C._profiler import _ExperimentalConfig
+
+        with self.lock:
+            if self.profiler is not None:
+                raise RuntimeError("A torch profile is already running")
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            # export_stacks needs with_stack, and verbose to keep the Python frames
+            try:
+                config = _ExperimentalConfig(verbose=True, profile_all_threads=True)
+            except TypeError:
+                raise NotImplementedError(
+                    f"torch {torch.__version__} can only profile the arming thread, not the inference threads"
+                )
+            self.profiler = profile(
+                activities=activities, record_shapes=True, with_stack=True, experimental_config=config
+            )
+            self.profiler.start()
+            self.remaining = num_requests
+            self.result = None
+            self.done.clear()
+
+    def request_finished(self):
+        if self.profiler is None:
+            return
+        with self.lock:
+            if self.profiler is None:
+                return
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self._finish()
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """Stop early (e.g. on timeout) and export whatever was recorded"""
+        with self.lock:
+            if self.profiler is not None:
+                self._finish()
+            return self.result
+
+    def _finish(self):
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        stacks_path = os.path.join(PROFILE_OUTPUT_DIR, f"torch-{stamp}.folded")
+        trace_path = os.path.join(PROFILE_OUTPUT_DIR, f"torch-{stamp}.trace.json")
+        profiler.export_stacks(stacks_path, "self_cpu_time_total")
+        profiler.export_chrome_trace(trace_path)
+
+        self.result = {"stacks_path": stacks_path, "trace_path": trace_path}
+        logger.info(f"Torch profile written to {stacks_path} and {trace_path}")
+        self.done.set()
+
+TORCH_PROFILER = TorchRequestProfiler()
+_cpu_profile_lock = threading.Lock()
+
+def install_profiling(app):
+    """
+    Add the profiling hooks to a FastAPI app
+
+    The request middleware is only added when stage sampling or the admin
+    endpoints are enabled, so a service started without either flag runs
+    exactly the code it ran before.
+    """
+    if not PROFILING_ENDPOINTS and STAGE_TIMING_SAMPLE_RATE <= 0:
+        return
+
+    from fastapi import HTTPException, Request
+    from fastapi.responses import FileResponse, PlainTextResponse
+
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        token = None
+        if STAGE_TIMING_SAMPLE_RATE > 0 and random.random() < STAGE_TIMING_SAMPLE_RATE:
+            token = _stage_timings.set({})
+        start = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            if token is not None:
+                timings = _stage_timings.get()
+                _stage_timings.reset(token)
+                stages = " ".join(f"{name}={seconds * 1000:.2f}ms" for name, seconds in timings.items())
+                logger.info(
+                    f"Stage timings {request.method} {request.url.path}: "
+                    f"total={(time.perf_counter() - start) * 1000:.2f}ms {stages}"
+                )
+            if not request.url.path.startswith("/admin/profile"):
+                TORCH_PROFILER.request_finished()
+
+    if not PROFILING_ENDPOINTS:
+        return
+
+    @app.post("/admin/profile/cpu")
+    async def profile_cpu(seconds: float = 10.0, interval_ms: float = 5.0):
+        """Sample all thread stacks for a few seconds and return folded stacks for a flamegraph"""
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS}]")
+        if not _cpu_profile_lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="A CPU profile is already running")
+        try:
+            # Sample from a worker thread so the event loop keeps serving the traffic being profiled
+            sampler = StackSampler(interval=max(interval_ms, 1.0) / 1000.0)
+            folded = await asyncio.get_running_loop().run_in_executor(None, sampler.run, seconds)
+        finally:
+            _cpu_profile_lock.release()
+
+        return PlainTextResponse(
+            folded,
+            headers={"Content-Disposition": f'attachment; filename="cpu-{time.strftime("%Y%m%d-%H%M%S")}.folded"'}
+        )
+
+    @app.post("/admin/profile/torch")
+    async def profile_torch(requests: int = 20, timeout: float = 60.0):
+        """Run torch.profiler across the next N requests and return the stacks as a folded file"""
+        if not 0 < requests <= MAX_PROFILE_REQUESTS:
+            raise HTTPException(status_code=400, detail=f"requests must be in (0, {MAX_PROFILE_REQUESTS}]")
+        if not 0 < timeout <= MAX_PROFILE_SECONDS:
+            raise HTTPException(status_code=400, detail=f"timeout must be in (0, {MAX_PROFILE_SECONDS}]")
+        try:
+            TORCH_PROFILER.arm(requests)
+        except NotImplementedError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+        await asyncio.get_running_loop().run_in_executor(None, TORCH_PROFILER.done.wait, timeout)
+        result = TORCH_PROFILER.finish()
+        if result is None:
+            raise HTTPException(status_code=500, detail="Torch profile produced no output")
+
+        return FileResponse(
+            result["stacks_path"],
+            media_type="text/plain",
+            filename=os.path.basename(result["stacks_path"]),
+            headers={"X-Chrome-Trace-Path": result["trace_path"]}
+        )
@@ -106,6 +106,8 @@ class EmailReclassifier:
             response = requests.post(
                 f"{self.model_service_url}/predict",
                 json={'subject': subject, 'body': body},
+                # Background work; keeps interactive requests ahead of the backfill
+                headers={'X-Request-Lane': 'bulk'},
                 timeout=30
             )
             
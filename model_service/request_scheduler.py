@@ -0,0 +1,295 @@
+"""
+Request Scheduler for Inference
+Priority lanes (interactive > sync > bulk) with per-lane concurrency limits, weighted fair queuing by tenant
+and request deadlines
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+from service_metrics import SCHEDULER_QUEUE_WAIT, observe_stage
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Inference threads shared by all lanes; each forward pass also uses torch's intra-op threads
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "2"))
+# Emails per scheduled unit; larger batches are split so other tenants' work can interleave
+SCHEDULER_CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", "32"))
+# Workers only the top lane may use, so an interactive request never waits behind a full pool of batch chunks
+SCHEDULER_RESERVED_WORKERS = int(os.getenv("SCHEDULER_RESERVED_WORKERS", "1"))
+
+def _lane(name: str, priority: int, limit: int, deadline_ms: int, max_queue: int) -> Dict[str, int]:
+    prefix = f"SCHEDULER_{name.upper()}"
+    return {
+        "priority": priority,
+        "limit": int(os.getenv(f"{prefix}_CONCURRENCY", str(limit))),
+        # Deadline for requests that do not send X-Request-Timeout-Ms
+        "deadline_ms": int(os.getenv(f"{prefix}_DEADLINE_MS", str(deadline_ms))),
+        # Queued units (emails) beyond which new requests are not admitted to the model
+        "max_queue": int(os.getenv(f"{prefix}_MAX_QUEUE", str(max_queue))),
+    }
+
+# Highest priority first; `limit` caps the workers a lane may hold at once
+LANES = {
+    "interactive": _lane("interactive", 0, SCHEDULER_WORKERS, 3000, 256),
+    "sync": _lane("sync", 1, max(1, SCHEDULER_WORKERS - 1), 30000, 4096),
+    "bulk": _lane("bulk", 2, 1, 120000, 16384),
+}
+DEFAULT_TENANT = "anonymous"
+# Smoothing for the per-email service time behind estimated_wait()
+SERVICE_TIME_EWMA_ALPHA = 0.1
+
+class DeadlineExceeded(Exception):
+    """The unit's deadline passed while it was queued, so it was dropped without running"""
+
+class _Lane:
+    """
+    One priority lane: a weighted fair queue across tenants
+
+    Start-time fair queuing: a unit costing c from a tenant with weight w gets
+    start = max(lane virtual time, tenant's last finish) and finish = start + c / w;
+    units run in finish order and the virtual time advances to the start tag of
+    each dispatched unit. A tenant submitting 50k emails only moves its own
+    finish tags forward, so another tenant's first request sorts ahead of it.
+    """
+
+    def __init__(self, name: str, priority: int, limit: int, deadline_ms: int, max_queue: int):
+        self.name = name
+        self.priority = priority
+        self.limit = max(1, limit)
+        self.deadline_seconds = deadline_ms / 1000.0
+        self.max_queue = max_queue
+        self.heap: List[tuple] = []
+        self.queued_cost = 0.0
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[str, float] = {}
+        self.running = 0
+        self.submitted = 0
+        self.dispatched = 0
+        self.completed = 0
+        self.expired = 0
+        self.wait_seconds = 0.0
+
+    def push(self, tenant: str, cost: float, weight: float, seq: int, unit: "_Unit"):
+        start = max(self.virtual_time, self.finish_tags.get(tenant, 0.0))
+        finish = start + cost / weight
+        self.finish_tags[tenant] = finish
+        heapq.heappush(self.heap, (finish, seq, start, unit))
+        self.queued_cost += cost
+        self.submitted += 1
+
+    def pop(self) -> "_Unit":
+        _, _, start, unit = heapq.heappop(self.heap)
+        self.queued_cost -= unit.cost
+        self.virtual_time = max(self.virtual_time, start)
+        if not self.heap:
+            # Idle lane: forget old tags so returning tenants start level
+            self.finish_tags.clear()
+            self.queued_cost = 0.0
+        return unit
+
+class _Unit:
+    __slots__ = ("fn", "args", "context", "loop", "future", "tenant", "cost", "deadline", "enqueued_at")
+
+    def __init__(self, fn, args, context, loop, future, tenant, cost, deadline):
+        self.fn = fn
+        self.args = args
+        self.context = context
+        self.loop = loop
+        self.future = future
+        self.tenant = tenant
+        self.cost = cost
+        self.deadline = deadline
+        self.enqueued_at = time.perf_counter()
+
+class RequestScheduler:
+    """
+    Runs blocking inference calls on a small thread pool in lane/tenant order
+
+    Callers await submit(); the call runs on a scheduler thread in a copy of
+    the caller's context (so stage timers and profiling still see the
+    request). A unit whose caller has gone away (client disconnect) or
+    whose deadline has passed is dropped when it reaches the front instead
+    of being run, so the model never works for a caller that gave up.
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS, lanes: Optional[Dict[str, Dict[str, int]]] = None,
+                 reserved_workers: int = SCHEDULER_RESERVED_WORKERS):
+        self.workers = max(1, workers)
+        # Lower lanes can always use at least one worker
+        self.shared_workers = max(1, self.workers - reserved_workers)
+        self.lanes = {
+            name: _Lane(name, spec["priority"], min(spec["limit"], self.workers),
+                        spec.get("deadline_ms", 0), spec.get("max_queue", 0))
+            for name, spec in (lanes or LANES).items()
+        }
+        self.by_priority = sorted(self.lanes.values(), key=lambda lane: lane.priority)
+        self.tenant_weights: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.running = 0
+        self.sequence = itertools.count()
+        # Seconds of worker time per unit of cost (one email), smoothed over completed units
+        self.seconds_per_cost: Optional[float] = None
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+
+    def resolve_lane(self, requested: Optional[str], default: str) -> str:
+        """The requested lane if it exists, else the endpoint's default"""
+        if requested and requested.lower() in self.lanes:
+            return requested.lower()
+        return default
+
+    def deadline_for(self, lane: str, timeout_ms: Optional[float], start: Optional[float] = None) -> Optional[float]:
+        """Absolute perf_counter() deadline from a caller's timeout, else the lane default (None: no deadline)"""
+        seconds = timeout_ms / 1000.0 if timeout_ms and timeout_ms > 0 else self.lanes[lane].deadline_seconds
+        if not seconds:
+            return None
+        return (start if start is not None else time.perf_counter()) + seconds
+
+    def queue_full(self, lane: str) -> bool:
+        """Admission control: the lane already holds its maximum of queued work"""
+        limit = self.lanes[lane].max_queue
+        return bool(limit) and self.lanes[lane].queued_cost >= limit
+
+    def estimated_wait(self, lane: str, cost: float = 1.0) -> float:
+        """
+        Seconds until new work of this cost in this lane would finish
+
+        Counts queued work in this lane and in every lane that runs before it,
+        at the smoothed per-email service time, spread over the workers the
+        lane can use. Zero until the first unit has completed.
+        """
+        if self.seconds_per_cost is None:
+            return 0.0
+        target = self.lanes[lane]
+        with self.lock:
+            ahead = sum(queued.queued_cost for queued in self.by_priority if queued.priority <= target.priority)
+        workers = self.workers if target is self.by_priority[0] else min(target.limit, self.shared_workers)
+        return (ahead / max(workers, 1) + cost) * self.seconds_per_cost
+
+    def set_tenant_weight(self, tenant: str, weight: float):
+        """Relative share of a lane for one tenant (default 1.0)"""
+        with self.lock:
+            self.tenant_weights[tenant] = max(weight, 1e-3)
+
+    async def submit(self, lane: str, tenant: Optional[str], fn: Callable, *args, cost: float = 1.0,
+                     deadline: Optional[float] = None):
+        """Queue fn(*args) in a lane on behalf of a tenant and wait for its result (DeadlineExceeded if dropped)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tenant = tenant or DEFAULT_TENANT
+        cost = max(cost, 1.0)
+        unit = _Unit(fn, args, contextvars.copy_context(), loop, future, tenant, cost, deadline)
+        with self.lock:
+            self.lanes[lane].push(tenant, cost, self.tenant_weights.get(tenant, 1.0), next(self.sequence), unit)
+        self._dispatch()
+        return await future
+
+    async def map_chunks(self, lane: str, tenant: Optional[str], fn: Callable[[List[Any]], List[Any]],
+                         items: List[Any], chunk_size: int = SCHEDULER_CHUNK_SIZE,
+                         deadline: Optional[float] = None) -> List[Any]:
+        """fn over a list in chunks scheduled as separate units; results in input order"""
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = await asyncio.gather(*(
+            self.submit(lane, tenant, fn, chunk, cost=len(chunk), deadline=deadline) for chunk in chunks
+        ))
+        return [result for chunk_results in results for result in chunk_results]
+
+    def _dispatch(self):
+        """Start queued units while there are free workers, highest priority lane first"""
+        while True:
+            with self.lock:
+                unit = lane = None
+                if self.running < self.workers:
+                    for candidate in self.by_priority:
+                        if candidate is not self.by_priority[0] and self.running >= self.shared_workers:
+                            break
+                        while candidate.heap and candidate.running < candidate.limit:
+                            queued = candidate.pop()
+                            if queued.future.cancelled():
+                                continue
+                            if queued.deadline is not None and time.perf_counter() > queued.deadline:
+                                candidate.expired += 1
+                                queued.loop.call_soon_threadsafe(
+                                    self._resolve, queued.future, None, DeadlineExceeded()
+                                )
+                                continue
+                            unit, lane = queued, candidate
+                            break
+                        if unit is not None:
+                            break
+                if unit is None:
+                    return
+                self.running += 1
+                lane.running += 1
+                waited = time.perf_counter() - unit.enqueued_at
+                lane.dispatched += 1
+                lane.wait_seconds += waited
+            SCHEDULER_QUEUE_WAIT.observe(waited, lane=lane.name)
+            self.executor.submit(self._run, lane, unit, waited)
+
+    def _run(self, lane: _Lane, unit: _Unit, waited: float):
+        started = time.perf_counter()
+        try:
+            # In the request's context, so the wait also reaches its sampled stage log
+            unit.context.run(observe_stage, 'queue_wait', waited)
+            result = unit.context.run(unit.fn, *unit.args)
+            unit.loop.call_soon_threadsafe(self._resolve, unit.future, result, None)
+        except BaseException as e:
+            unit.loop.call_soon_threadsafe(self._resolve, unit.future, None, e)
+        finally:
+            per_cost = (time.perf_counter() - started) / unit.cost
+            with self.lock:
+                self.running -= 1
+                lane.running -= 1
+                lane.completed += 1
+                if self.seconds_per_cost is None:
+                    self.seconds_per_cost = per_cost
+                else:
+                    self.seconds_per_cost += SERVICE_TIME_EWMA_ALPHA * (per_cost - self.seconds_per_cost)
+            self._dispatch()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result, error: Optional[BaseException]):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "shared_workers": self.shared_workers,
+                "running": self.running,
+                "seconds_per_email": self.seconds_per_cost,
+                "lanes": {
+                    lane.name: {
+                        "priority": lane.priority,
+                        "concurrency_limit": lane.limit,
+                        "queued": len(lane.heap),
+                        "queued_emails": lane.queued_cost,
+                        "max_queue": lane.max_queue,
+                        "default_deadline_ms": lane.deadline_seconds * 1000,
+                        "running": lane.running,
+                        "submitted": lane.submitted,
+                        "completed": lane.completed,
+                        "expired": lane.expired,
+                        "avg_queue_ms": lane.wait_seconds / lane.dispatched * 1000 if lane.dispatched else None,
+                        "tenants_queued": len({entry[3].tenant for entry in lane.heap}),
+                    }
+                    for lane in self.by_priority
+                },
+                "tenant_weights": dict(self.tenant_weights),
+            }
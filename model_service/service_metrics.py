@@ -0,0 +1,256 @@
+"""
+Service Metrics in Prometheus Text Format
+Thread-safe counters, gauges and latency histograms for the model service, with no extra dependencies
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from profiling import record_stage
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond stages up to slow batch requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    """Base for one metric family; children are keyed by label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_child(key, value))
+        return lines
+
+    def _render_child(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self._values.get(self._key(labels), 0.0)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self._values[self._key(labels)] = float(value)
+
+    def clear(self):
+        with self.lock:
+            self._values.clear()
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; each child holds [bucket counts..., sum, count]"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child = self._values.get(key)
+            if child is None:
+                child = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            child[index] += 1
+            child[-2] += value
+            child[-1] += 1
+
+    def _render_child(self, key, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child[-2])}")
+        lines.append(f"{self.name}_count{labels} {child[-1]}")
+        return lines
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.95, 0.99)) -> Dict[str, Dict[str, float]]:
+        """Per-child count, mean and bucket-interpolated quantiles (seconds), keyed by the first label"""
+        with self.lock:
+            items = [(key, list(child)) for key, child in self._values.items()]
+
+        result = {}
+        for key, child in items:
+            count = child[-1]
+            if not count:
+                continue
+            stats = {'count': count, 'mean': child[-2] / count}
+            for q in quantiles:
+                stats[f'p{int(q * 100)}'] = self._quantile(child, q)
+            result["|".join(key)] = stats
+        return result
+
+    def _quantile(self, child: List, q: float) -> float:
+        target = q * child[-1]
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, child):
+            if count and cumulative + count >= target:
+                return lower + (bound - lower) * (target - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """All metric families of the process plus collectors that refresh gauges at scrape time"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+        self.lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], None]):
+        """collector() runs before every render, typically to copy stats from a component into gauges"""
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# The process-wide registry and the metric families the service reports
+METRICS = MetricsRegistry()
+
+REQUESTS = METRICS.counter(
+    'sortify_requests_total', 'HTTP requests by endpoint, method and status code',
+    ['endpoint', 'method', 'status']
+)
+REQUEST_LATENCY = METRICS.histogram(
+    'sortify_request_duration_seconds', 'End-to-end request latency by endpoint', ['endpoint']
+)
+# Stages: request_parse, queue_wait (behind the scheduler), tokenize, transformer_forward, rule_layer, feature_extraction, tree_model, fusion, serialization
+STAGE_LATENCY = METRICS.histogram(
+    'sortify_stage_duration_seconds', 'Latency of one pipeline stage', ['stage']
+)
+BATCH_SIZE = METRICS.histogram(
+    'sortify_batch_size', 'Emails per batch request', ['endpoint'], buckets=BATCH_SIZE_BUCKETS
+)
+CACHE_REQUESTS = METRICS.counter(
+    'sortify_cache_requests_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result']
+)
+CACHE_HIT_RATIO = METRICS.gauge(
+    'sortify_cache_hit_ratio', 'Hits / lookups since start, per cache', ['cache']
+)
+SCHEDULER_QUEUE_WAIT = METRICS.histogram(
+    'sortify_scheduler_queue_seconds', 'Time a unit of inference work waited for a scheduler thread', ['lane']
+)
+SCHEDULER_QUEUE_DEPTH = METRICS.gauge(
+    'sortify_scheduler_queue_depth', 'Units of inference work waiting per scheduler lane', ['lane']
+)
+# action: degraded (rules-only answer), rejected (503) or expired (deadline passed in the queue)
+OVERLOAD = METRICS.counter(
+    'sortify_overload_total', 'Requests not served by the model because of load, by lane and action', ['lane', 'action']
+)
+MODEL_INFO = METRICS.gauge(
+    'sortify_model_info', 'Loaded model versions (value is always 1)', ['component', 'version']
+)
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_LATENCY.observe(seconds, stage=stage)
+    record_stage(stage, seconds)
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+def set_cache_totals(cache: str, hits: int, misses: int):
+    """Publish the hit ratio of a cache that keeps its own counters (lru_cache, registries)"""
+    total = hits + misses
+    CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache=cache)
+
+def _update_counted_cache_ratios():
+    with CACHE_REQUESTS.lock:
+        totals: Dict[str, List[float]] = {}
+        for (cache, result), value in CACHE_REQUESTS._values.items():
+            totals.setdefault(cache, [0.0, 0.0])[0 if result == 'hit' else 1] += value
+    for cache, (hits, misses) in totals.items():
+        set_cache_totals(cache, hits, misses)
+
+METRICS.register_collector(_update_counted_cache_ratios)
@@ -0,0 +1,150 @@
+"""
+Shadow Evaluation of a Candidate Model
+Replays a sample of live /predict traffic against an unpublished model and compares it with production
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+# Shadow requests waiting beyond this are dropped instead of queued
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "64"))
+
+def _lower_thread_priority():
+    """Executor initializer: run shadow work at the lowest CPU priority (Linux, per thread)"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"Could not lower shadow thread priority: {e}")
+
+class ShadowStats:
+    """Thread-safe agreement, confidence and confusion counters, production vs. candidate"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.offered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.evaluated = 0
+        self.agreed = 0
+        self.production_confidence = 0.0
+        self.candidate_confidence = 0.0
+        self.candidate_seconds = 0.0
+        # production label -> candidate label -> count
+        self.confusion: Dict[str, Dict[str, int]] = {}
+
+    def record(self, production: Dict[str, Any], candidate: Dict[str, Any], seconds: float):
+        production_label = production.get("label", "Other")
+        candidate_label = candidate.get("label", "Other")
+        with self.lock:
+            self.evaluated += 1
+            self.agreed += production_label == candidate_label
+            self.production_confidence += production.get("confidence", 0.0)
+            self.candidate_confidence += candidate.get("confidence", 0.0)
+            self.candidate_seconds += seconds
+            row = self.confusion.setdefault(production_label, {})
+            row[candidate_label] = row.get(candidate_label, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            n = self.evaluated
+            per_category = {}
+            for label, row in self.confusion.items():
+                total = sum(row.values())
+                per_category[label] = {
+                    "count": total,
+                    "agreement_rate": row.get(label, 0) / total
+                }
+            return {
+                "offered": self.offered,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "evaluated": n,
+                "agreement_rate": self.agreed / n if n else None,
+                "avg_production_confidence": self.production_confidence / n if n else None,
+                "avg_candidate_confidence": self.candidate_confidence / n if n else None,
+                "avg_confidence_shift": (self.candidate_confidence - self.production_confidence) / n if n else None,
+                "avg_candidate_latency_ms": self.candidate_seconds / n * 1000 if n else None,
+                "per_category": per_category,
+                "confusion": {label: dict(row) for label, row in self.confusion.items()}
+            }
+
+class ShadowEvaluator:
+    """
+    Sends a copy of sampled requests to a candidate ModelBundle
+
+    offer() is called after the production response is computed and only
+    samples, counts and submits, so the request path pays a random() call.
+    The candidate runs on one low-priority thread with a bounded backlog;
+    when it falls behind, samples are dropped rather than queued.
+    """
+
+    def __init__(self, classifier, candidate, source: str,
+                 sample_rate: float = SHADOW_SAMPLE_RATE, max_pending: int = SHADOW_MAX_PENDING):
+        self.classifier = classifier
+        self.candidate = candidate
+        self.source = source
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.started_at = time.time()
+        self.stats = ShadowStats()
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shadow", initializer=_lower_thread_priority
+        )
+
+    def offer(self, subject: str, body: str, production: Dict[str, Any]):
+        """Maybe replay one production prediction against the candidate"""
+        if random.random() >= self.sample_rate or "error" in production:
+            return
+        with self.stats.lock:
+            self.stats.offered += 1
+            if self.pending >= self.max_pending:
+                self.stats.dropped += 1
+                return
+            self.pending += 1
+        try:
+            self.executor.submit(self._evaluate, subject, body, production)
+        except RuntimeError:
+            # Executor already shut down by stop()
+            with self.stats.lock:
+                self.pending -= 1
+
+    def _evaluate(self, subject: str, body: str, production: Dict[str, Any]):
+        try:
+            start = time.perf_counter()
+            candidate = self.classifier.predict_single(subject, body, bundle=self.candidate)
+            elapsed = time.perf_counter() - start
+            if "error" in candidate:
+                with self.stats.lock:
+                    self.stats.errors += 1
+            else:
+                self.stats.record(production, candidate, elapsed)
+        except Exception as e:
+            logger.warning(f"Shadow evaluation failed: {e}")
+            with self.stats.lock:
+                self.stats.errors += 1
+        finally:
+            with self.stats.lock:
+                self.pending -= 1
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "candidate": self.candidate.describe(),
+            "source": self.source,
+            "sample_rate": self.sample_rate,
+            "running_seconds": time.time() - self.started_at,
+            **self.stats.snapshot()
+        }
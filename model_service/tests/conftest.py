@@ -0,0 +1,86 @@
+"""
+Shared fixtures for the model service tests
+Tiny DistilBERT checkpoints built on the fly, so no test downloads a model
+"""
+
+import os
+import shutil
+import sys
+import time
+from typing import List, Optional
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+TINY_VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + (
+    "hello world meeting invoice job offer sale the a payment due schedule".split()
+)
+
+def make_tiny_model(path: str, num_labels: int, seed: int = 0, labels: Optional[List[str]] = None) -> str:
+    """Save a two-layer DistilBERT classifier and its tokenizer to `path` (with id2label from `labels`)"""
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+
+    torch.manual_seed(seed)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(TINY_VOCAB))
+    tokenizer = DistilBertTokenizerFast(vocab_file=os.path.join(path, "vocab.txt"))
+    tokenizer.model_max_length = 64
+    tokenizer.save_pretrained(path)
+    config = DistilBertConfig(
+        vocab_size=len(TINY_VOCAB), dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+        num_labels=num_labels, max_position_embeddings=128
+    )
+    if labels is not None:
+        config.id2label = dict(enumerate(labels))
+        config.label2id = {label: i for i, label in enumerate(labels)}
+    DistilBertForSequenceClassification(config).save_pretrained(path)
+    return path
+
+@pytest.fixture
+def service_cwd(tmp_path, monkeypatch):
+    """Run in a scratch directory holding a copy of categories.json, so category edits stay local"""
+    shutil.copy(os.path.join(SERVICE_DIR, "categories.json"), tmp_path / "categories.json")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("USER_ADAPTERS_DIR", str(tmp_path / "user_adapters"))
+    return tmp_path
+
+@pytest.fixture
+def tiny_model_dir(service_cwd):
+    """A tiny checkpoint whose label count matches the current categories"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from dynamic_classifier import DynamicCategoryManager
+
+    num_labels = len(DynamicCategoryManager().get_categories())
+    return make_tiny_model(str(service_cwd / "model"), num_labels)
+
+@pytest.fixture
+def tiny_classifier(tiny_model_dir):
+    from dynamic_classifier import DynamicEmailClassifier
+
+    return DynamicEmailClassifier(model_path=tiny_model_dir)
+
+@pytest.fixture
+def app_client(tiny_model_dir, monkeypatch):
+    """TestClient for enhanced_app serving the tiny model, returned once /ready is 200"""
+    pytest.importorskip("fastapi")
+    monkeypatch.setenv("TESTING", "1")
+    import local_models
+    monkeypatch.setattr(local_models, "SERVING_MODEL_DIR", tiny_model_dir)
+    import enhanced_app
+    from fastapi.testclient import TestClient
+
+    # Load this test's model even if an earlier test left the app ready
+    monkeypatch.setitem(enhanced_app.readiness, "status", "starting")
+    with TestClient(enhanced_app.app) as client:
+        deadline = time.monotonic() + 120
+        while client.get("/ready").status_code != 200:
+            assert enhanced_app.readiness["status"] != "failed", enhanced_app.readiness["error"]
+            assert time.monotonic() < deadline, "model service did not become ready"
+            time.sleep(0.05)
+        yield client
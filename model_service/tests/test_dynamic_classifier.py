@@ -0,0 +1,103 @@
+"""
+Category edits on a serving DynamicEmailClassifier
+A resized head is published as a new bundle; the bundle in use is never edited in place
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+
+def test_category_edit_publishes_new_bundle(tiny_classifier):
+    old = tiny_classifier.bundle
+    old_labels = old.model.classifier.out_features
+    tiny_classifier.predict_single("invoice", "payment due")
+    assert tiny_classifier.prediction_cache
+
+    assert tiny_classifier.add_category("Receipts", "Purchase receipts", ["receipt"])
+    new = tiny_classifier.bundle
+
+    assert new is not old and new.version > old.version
+    assert new.model.classifier.out_features == old_labels + 1
+    assert new.model.config.num_labels == old_labels + 1
+    # The bundle in-flight requests hold keeps its head and config
+    assert old.model.classifier.out_features == old_labels
+    assert old.model.config.num_labels == old_labels
+    # Only the head is new; the encoder weights are shared
+    assert new.model.distilbert is old.model.distilbert
+    assert not tiny_classifier.prediction_cache
+
+    result = tiny_classifier.predict_single("invoice", "payment due")
+    assert "error" not in result
+    assert "Receipts" in result["scores"]
+
+def test_remove_category_publishes_new_bundle(tiny_classifier):
+    old = tiny_classifier.bundle
+    assert tiny_classifier.add_category("Receipts", "Purchase receipts", ["receipt"])
+    assert tiny_classifier.remove_category("Receipts")
+    assert tiny_classifier.bundle.version == old.version + 2
+    assert tiny_classifier.bundle.model.classifier.out_features == old.model.classifier.out_features
+    assert tiny_classifier.predict_batch([{"subject": "sale", "body": "offer"}])[0].get("error") is None
+
+class AlwaysAnswers:
+    """First tier that answers every email with full confidence"""
+
+    def decide(self, texts):
+        return [{"label": "Other", "confidence": 1.0, "scores": {"Other": 1.0}} for _ in texts]
+
+def test_explicit_bundle_bypasses_first_tier(tiny_classifier, tiny_model_dir):
+    tiny_classifier.attach_first_tier(AlwaysAnswers())
+    assert tiny_classifier.predict_single("invoice", "payment due")["tier"] == "linear"
+    assert tiny_classifier.cascade_stats.snapshot()["total"] == 1
+
+    candidate = tiny_classifier.load_candidate(tiny_model_dir)
+    result = tiny_classifier.predict_single("invoice", "payment due", bundle=candidate)
+    assert "error" not in result
+    assert "tier" not in result
+    # Shadow and pinned-version calls are not production cascade traffic
+    assert tiny_classifier.cascade_stats.snapshot()["total"] == 1
+
+def test_batch_first_tier_answers_get_rule_layer(tiny_classifier, monkeypatch):
+    tiny_classifier.attach_first_tier(AlwaysAnswers())
+    finalized = []
+    finalize = tiny_classifier._finalize_prediction
+    monkeypatch.setattr(tiny_classifier, "_finalize_prediction",
+                        lambda subject, body, scores: finalized.append(subject) or finalize(subject, body, scores))
+
+    single = tiny_classifier.predict_single("invoice", "payment due")
+    batch = tiny_classifier.predict_batch([{"subject": "invoice", "body": "payment due"}])[0]
+    assert finalized == ["invoice", "invoice"]
+    assert batch == single
+
+EMAILS = [
+    {"subject": "invoice", "body": "payment due"},
+    {"subject": "job offer", "body": "meeting schedule"},
+    {"subject": "sale", "body": "hello world"},
+]
+
+@pytest.fixture
+def sorted_label_classifier(service_cwd):
+    """Classifier on a trainer-style checkpoint: id2label sorted by name, not in categories.json order"""
+    from conftest import make_tiny_model
+    from dynamic_classifier import DynamicCategoryManager, DynamicEmailClassifier
+
+    names = DynamicCategoryManager().get_category_names()
+    labels = sorted(names)
+    assert labels != names
+    return DynamicEmailClassifier(model_path=make_tiny_model(str(service_cwd / "sorted"), len(labels), labels=labels))
+
+def test_batch_matches_single_with_label_mapping(sorted_label_classifier):
+    classifier = sorted_label_classifier
+    batch = classifier.predict_batch(EMAILS)
+    for email, result in zip(EMAILS, batch):
+        single = classifier.predict_single(email["subject"], email["body"])
+        assert "error" not in result
+        assert (result["label"], result["category_id"]) == (single["label"], single["category_id"])
+        assert result["scores"] == pytest.approx(single["scores"])
+
+def test_ensemble_batch_matches_single(sorted_label_classifier):
+    from ensemble_classifier import EnsembleEmailClassifier
+
+    ensemble = EnsembleEmailClassifier(distilbert_model=sorted_label_classifier)
+    batch = ensemble.predict_batch(EMAILS)
+    for email, result in zip(EMAILS, batch):
+        assert result["label"] == ensemble.predict_single(email["subject"], email["body"])["label"]
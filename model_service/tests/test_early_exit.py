@@ -0,0 +1,54 @@
+"""
+Early-exit heads against a changing category set
+Heads trained for one label count must never be run against a classifier with another
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from early_exit import EarlyExitHeads, early_exit_forward, heads_match_model
+
+def save_heads(classifier, model_dir):
+    model = classifier.bundle.model
+    EarlyExitHeads(model.config.dim, model.classifier.out_features, [0]).save(model_dir)
+
+def test_forward_sized_from_final_head(tiny_classifier):
+    model = tiny_classifier.bundle.model
+    heads = EarlyExitHeads(model.config.dim, model.classifier.out_features, [0])
+    input_ids = torch.tensor([[2, 5, 6, 3], [2, 7, 3, 0]])
+    probabilities, layers = early_exit_forward(model, heads, input_ids, (input_ids > 0).long(), 0.0)
+    assert probabilities.shape == (2, model.classifier.out_features)
+    assert layers.tolist() == [2, 2]
+
+def test_mismatched_heads_are_refused(tiny_classifier):
+    model = tiny_classifier.bundle.model
+    heads = EarlyExitHeads(model.config.dim, model.classifier.out_features + 1, [0])
+    assert not heads_match_model(heads, model)
+    input_ids = torch.tensor([[2, 5, 3]])
+    with pytest.raises(ValueError):
+        early_exit_forward(model, heads, input_ids, torch.ones_like(input_ids), 0.5)
+
+def test_mismatched_heads_ignored_at_load(tiny_model_dir):
+    from dynamic_classifier import DynamicEmailClassifier
+
+    EarlyExitHeads(32, 3, [0]).save(tiny_model_dir)
+    classifier = DynamicEmailClassifier(model_path=tiny_model_dir)
+    assert classifier.bundle.exit_heads is None
+
+def test_category_edit_keeps_transformer_predictions(tiny_model_dir):
+    from dynamic_classifier import DynamicEmailClassifier
+
+    classifier = DynamicEmailClassifier(model_path=tiny_model_dir)
+    save_heads(classifier, tiny_model_dir)
+    classifier = DynamicEmailClassifier(model_path=tiny_model_dir)
+    classifier.enable_early_exit(0.5)
+    assert classifier.bundle.exit_heads is not None
+
+    assert classifier.add_category("Receipts", "Purchase receipts", ["receipt"])
+    result = classifier.predict_single("invoice", "payment due")
+    assert "error" not in result
+    assert classifier.predict_batch([{"subject": "sale", "body": "offer"}])[0].get("error") is None
+
+def test_early_exit_off_by_default(tiny_classifier):
+    assert tiny_classifier.early_exit_threshold == 0
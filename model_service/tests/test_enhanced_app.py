@@ -0,0 +1,102 @@
+"""
+Classification endpoints of the enhanced service
+Legacy routes and model-version routing across single, batch and streaming prediction
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+
+EMAIL = {"subject": "invoice", "body": "payment due"}
+
+@pytest.fixture
+def registry_version(app_client, tiny_model_dir):
+    response = app_client.post("/models/registry", json={"version": "candidate", "model_path": tiny_model_dir})
+    assert response.status_code == 200, response.text
+    return "candidate"
+
+def test_categorize_legacy_endpoint(app_client):
+    response = app_client.post("/categorize", json={"content": "payment due for invoice"})
+    assert response.status_code == 200, response.text
+    assert "label" in response.json()
+
+def test_categorize_requires_content(app_client):
+    assert app_client.post("/categorize", json={"text": "x"}).status_code == 400
+
+def test_batch_honours_model_version_header(app_client, registry_version):
+    response = app_client.post(
+        "/predict/batch", json={"emails": [EMAIL, EMAIL]}, headers={"X-Model-Version": registry_version}
+    )
+    assert response.status_code == 200, response.text
+    assert [result["model_version"] for result in response.json()] == [registry_version] * 2
+
+def test_batch_routes_each_email_by_tenant(app_client, registry_version):
+    routed = app_client.post("/models/registry/routes", json={"tenant": "alice", "version": registry_version})
+    assert routed.status_code == 200, routed.text
+    response = app_client.post("/predict/batch", json={"emails": [{**EMAIL, "user_id": "alice"}, {**EMAIL, "user_id": "bob"}]})
+    assert [result["model_version"] for result in response.json()] == [registry_version, None]
+
+    # X-Tenant-Id names the tenant for every email in the request
+    response = app_client.post("/predict", json=EMAIL, headers={"X-Tenant-Id": "alice"})
+    assert response.json()["model_version"] == registry_version
+
+def test_unknown_version_is_404(app_client, monkeypatch):
+    import enhanced_app
+
+    # Only versions registered here; no ModelVersion table lookup
+    monkeypatch.setattr(enhanced_app.model_registry, "resolver", None)
+    response = app_client.post("/predict/batch", json={"emails": [EMAIL]}, headers={"X-Model-Version": "missing"})
+    assert response.status_code == 404
+
+def test_stream_honours_model_version_header(app_client, registry_version):
+    body = "".join(json.dumps({"id": i, **EMAIL}) + "\n" for i in range(3))
+    response = app_client.post("/predict/stream", content=body, headers={"X-Model-Version": registry_version})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [0, 1, 2]
+    assert all(line["model_version"] == registry_version for line in lines)
+
+def test_stream_survives_malformed_lines_and_failed_batches(app_client, monkeypatch):
+    import enhanced_app
+
+    calls = []
+    predict_batch = enhanced_app.classifier.predict_batch
+
+    def failing_second_batch(emails, bundle=None):
+        calls.append(len(emails))
+        if len(calls) == 2:
+            # The classifier's own error path: results without category_id
+            return [{"label": "Other", "confidence": 0.0, "scores": {}, "error": "boom"} for _ in emails]
+        if len(calls) == 3:
+            raise RuntimeError("model crashed")
+        return predict_batch(emails, bundle)
+
+    monkeypatch.setattr(enhanced_app, "STREAM_MICRO_BATCH", 2)
+    monkeypatch.setattr(enhanced_app.classifier, "predict_batch", failing_second_batch)
+    lines = [json.dumps({"id": i, **EMAIL}) for i in range(7)]
+    lines.insert(1, "{not json")
+    response = app_client.post("/predict/stream", content="\n".join(lines) + "\n")
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result.get("id") for result in results] == [0, None, 1, 2, 3, 4, 5, 6]
+    assert "Invalid email" in results[1]["error"]
+    failed = [result["id"] for result in results if "error" in result and result["id"] is not None]
+    # Micro-batches [0, bad], [1, 2], [3, 4], [5, 6]: the middle two fail, the stream carries on
+    assert failed == [1, 2, 3, 4]
+    assert all("label" in result for result in results if result.get("id") in (0, 5, 6))
+
+def test_activate_returns_usable_rollback_version(app_client, registry_version):
+    import enhanced_app
+
+    production = enhanced_app.classifier.bundle
+    activated = app_client.post(f"/models/registry/{registry_version}/activate")
+    assert activated.status_code == 200, activated.text
+    rollback = activated.json()["rollback_version"]
+    assert rollback == f"rollback-v{production.version}"
+    assert enhanced_app.classifier.bundle is not production
+
+    rolled_back = app_client.post(f"/models/registry/{rollback}/activate")
+    assert rolled_back.status_code == 200, rolled_back.text
+    assert enhanced_app.classifier.bundle is production
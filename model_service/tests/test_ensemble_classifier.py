@@ -0,0 +1,58 @@
+"""
+Ensemble fallback when the feature branch fails
+The DistilBERT branch already in flight is reused; the transformer only runs again if that branch failed
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("xgboost")
+
+@pytest.fixture
+def ensemble(tiny_classifier, monkeypatch):
+    from ensemble_classifier import EnsembleEmailClassifier
+
+    ensemble = EnsembleEmailClassifier(distilbert_model=tiny_classifier)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("feature extraction failed")
+
+    monkeypatch.setattr(ensemble.feature_extractor, "extract_features", broken)
+    return ensemble
+
+def count_calls(monkeypatch, target, name):
+    calls = []
+    original = getattr(target, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, counted)
+    return calls
+
+def test_single_fallback_reuses_inflight_branch(ensemble, monkeypatch):
+    calls = count_calls(monkeypatch, ensemble.distilbert_classifier, "predict_single")
+    result = ensemble.predict_single("invoice", "payment due")
+    assert "error" not in result and "label" in result
+    assert len(calls) == 1
+
+def test_batch_fallback_reuses_inflight_branch(ensemble, monkeypatch):
+    calls = count_calls(monkeypatch, ensemble.distilbert_classifier, "predict_batch")
+    results = ensemble.predict_batch([{"subject": "invoice", "body": "payment due"}, {"subject": "sale", "body": "offer"}])
+    assert len(results) == 2 and all("error" not in result for result in results)
+    assert len(calls) == 1
+
+def test_fallback_reruns_when_branch_failed(ensemble, monkeypatch):
+    classifier = ensemble.distilbert_classifier
+    answers = iter([RuntimeError("branch crashed"), None])
+    predict_single = classifier.predict_single
+
+    def flaky(*args, **kwargs):
+        error = next(answers)
+        if error is not None:
+            raise error
+        return predict_single(*args, **kwargs)
+
+    monkeypatch.setattr(classifier, "predict_single", flaky)
+    assert "label" in ensemble.predict_single("invoice", "payment due")
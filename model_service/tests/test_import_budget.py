@@ -0,0 +1,61 @@
+"""
+Import-time budget for the serving entry points
+Importing a serving app must not load the training stack, and must stay within a wall-clock budget
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Generous default for CI runners; tighten locally with SERVING_IMPORT_BUDGET_SECONDS
+IMPORT_BUDGET_SECONDS = float(os.getenv("SERVING_IMPORT_BUDGET_SECONDS", "20"))
+
+# Only needed by training endpoints, which import them on first use
+TRAINING_MODULES = (
+    "distilbert_trainer",
+    "training_pipeline",
+    "data_collection",
+    "train_model",
+    "datasets",
+    "xgboost",
+)
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "loaded": [name for name in {training_modules!r} if name in sys.modules],
+}}))
+"""
+
+def import_in_subprocess(module: str) -> dict:
+    env = dict(os.environ, TESTING="1", HF_HUB_OFFLINE="1", TRANSFORMERS_OFFLINE="1")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, training_modules=TRAINING_MODULES)],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+@pytest.mark.slow
+@pytest.mark.parametrize("module", ["enhanced_app", "app"])
+def test_serving_import_skips_training_stack(module):
+    probe = import_in_subprocess(module)
+    assert probe["loaded"] == [], f"{module} imported training modules at startup: {probe['loaded']}"
+
+@pytest.mark.slow
+def test_enhanced_app_import_within_budget():
+    probe = import_in_subprocess("enhanced_app")
+    assert probe["seconds"] <= IMPORT_BUDGET_SECONDS, (
+        f"Importing enhanced_app took {probe['seconds']:.1f}s (budget {IMPORT_BUDGET_SECONDS:.0f}s)"
+    )
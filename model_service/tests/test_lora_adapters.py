@@ -0,0 +1,87 @@
+"""
+Per-user LoRA adapters on a shared model
+The active adapter is per call, so concurrent forwards for different users do not interfere
+"""
+
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from lora_adapters import UserAdapter, adapter_logits, base_model_fingerprint, inject_lora, safe_user_dir, use_adapter
+
+@pytest.mark.parametrize("user_id", ["..", ".", "", "..."])
+def test_safe_user_dir_rejects_traversal(tmp_path, user_id):
+    with pytest.raises(ValueError):
+        safe_user_dir(str(tmp_path), user_id)
+
+def test_safe_user_dir_sanitizes(tmp_path):
+    assert safe_user_dir(str(tmp_path), "a/b@c.com") == str(tmp_path / "a_b_c.com")
+
+def make_adapter(model, shapes, labels=("Work", "Personal")):
+    adapter = UserAdapter(shapes, model.config.dim, list(labels))
+    with torch.no_grad():
+        for parameter in adapter.lora_b.values():
+            parameter.normal_()
+    return adapter.eval()
+
+def test_adapter_is_scoped_to_calling_thread(tiny_classifier):
+    model = tiny_classifier.bundle.model
+    input_ids = torch.tensor([[2, 5, 6, 3]])
+    mask = torch.ones_like(input_ids)
+    with torch.no_grad():
+        base = model(input_ids=input_ids, attention_mask=mask).logits
+        adapter = make_adapter(model, inject_lora(model))
+        assert torch.allclose(model(input_ids=input_ids, attention_mask=mask).logits, base)
+
+        other_thread = {}
+        with use_adapter(adapter):
+            adapted = model(input_ids=input_ids, attention_mask=mask).logits
+            worker = threading.Thread(
+                target=lambda: other_thread.update(logits=model(input_ids=input_ids, attention_mask=mask).logits)
+            )
+            worker.start()
+            worker.join()
+        assert not torch.allclose(adapted, base)
+        assert torch.allclose(other_thread["logits"], base)
+        assert torch.allclose(model(input_ids=input_ids, attention_mask=mask).logits, base)
+        assert adapter_logits(model, adapter, input_ids, mask).shape == (1, 2)
+
+def test_adapter_predictions_do_not_change_shared_model(tiny_classifier, service_cwd):
+    bundle = tiny_classifier.bundle
+    shared = tiny_classifier.predict_batch([{"subject": "invoice", "body": "payment due"}])[0]
+    adapter = make_adapter(bundle.model, inject_lora(bundle.model))
+    adapter.save(safe_user_dir(tiny_classifier.adapter_registry.adapters_dir, "alice"), bundle.base_fingerprint)
+
+    results = tiny_classifier.predict_batch([
+        {"subject": "invoice", "body": "payment due", "user_id": "alice"},
+        {"subject": "invoice", "body": "payment due"},
+        {"subject": "invoice", "body": "payment due", "user_id": ".."},
+    ])
+    assert results[0]["adapter"] == "alice"
+    assert results[1]["scores"] == pytest.approx(shared["scores"])
+    assert "adapter" not in results[2]
+
+def test_fingerprint_ignores_lora_wrapping(tiny_classifier):
+    model = tiny_classifier.bundle.model
+    before = base_model_fingerprint(model)
+    inject_lora(model)
+    assert base_model_fingerprint(model) == before
+
+def test_adapter_for_another_base_model_is_skipped(tiny_classifier, service_cwd):
+    from conftest import make_tiny_model
+
+    bundle = tiny_classifier.bundle
+    adapter = make_adapter(bundle.model, inject_lora(bundle.model))
+    adapter.save(safe_user_dir(tiny_classifier.adapter_registry.adapters_dir, "alice"), bundle.base_fingerprint)
+    email = {"subject": "invoice", "body": "payment due", "user_id": "alice"}
+    assert tiny_classifier.predict_batch([email])[0]["adapter"] == "alice"
+
+    # Hot-swap to a model with other encoder weights: the adapter on disk no longer applies
+    other = make_tiny_model(str(service_cwd / "other"), bundle.model.classifier.out_features, seed=1)
+    assert tiny_classifier.load_model_from_path(other)
+    assert tiny_classifier.bundle.base_fingerprint != bundle.base_fingerprint
+    assert "adapter" not in tiny_classifier.predict_batch([email])[0]
+    assert "adapter" not in tiny_classifier.predict_single("invoice", "payment due", user_id="alice")
+    assert tiny_classifier.adapter_registry.snapshot()["stale"] == 1
@@ -0,0 +1,48 @@
+"""
+Model registry residency
+The rollback bundle adopted on activation is pinned; older adopted bundles are forgotten once evicted
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from model_registry import ModelRegistry
+
+class FakeBundle:
+    def __init__(self, source: str, size: int = 1024):
+        self.source = source
+        self.model = torch.nn.Linear(size, 1, bias=False)
+        self.exit_heads = None
+
+    def describe(self):
+        return {"source": self.source}
+
+class FakeClassifier:
+    bundle = None
+
+    def load_candidate(self, model_path, tokenizer=None):
+        return FakeBundle(model_path)
+
+def test_rollback_bundle_is_pinned(tmp_path):
+    # Room for two 4 KB bundles
+    registry = ModelRegistry(FakeClassifier(), memory_budget_mb=9 * 1024 / 1024 / 1024)
+    base = FakeBundle("distilbert-base-uncased")
+    registry.adopt("rollback-v1", base)
+    for version in ("a", "b", "c"):
+        registry.register(version, str(tmp_path / version))
+        registry.get(version)
+    assert registry.get("rollback-v1") is base
+    assert registry.snapshot()["pinned"] == "rollback-v1"
+
+def test_evicted_adopted_version_is_forgotten(tmp_path):
+    registry = ModelRegistry(FakeClassifier(), memory_budget_mb=9 * 1024 / 1024 / 1024, resolver=lambda version: None)
+    registry.adopt("rollback-v1", FakeBundle("distilbert-base-uncased"))
+    registry.adopt("rollback-v2", FakeBundle("distilbert-base-uncased"))
+    registry.register("a", str(tmp_path / "a"))
+    registry.get("a")
+
+    # rollback-v1 is no longer pinned and cannot be reloaded from a hub name
+    with pytest.raises(KeyError):
+        registry.get("rollback-v1")
+    assert registry.get("rollback-v2") is not None
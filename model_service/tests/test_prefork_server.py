@@ -0,0 +1,50 @@
+"""
+Pre-fork launcher
+A worker forked after the parent's warm-up must be able to run multi-threaded inference
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip("torch")
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: the pytest process has already used torch's thread pool
+CHILD_PREDICTS = textwrap.dedent("""
+    import os, sys, time
+    sys.path.insert(0, {service_dir!r})
+    import torch
+    # The parent starts with torch's default multi-threaded pool
+    torch.set_num_threads(4)
+    import prefork_server
+
+    app = prefork_server.load_models()
+    pid = os.fork()
+    if pid == 0:
+        torch.set_num_threads(2)
+        result = app.classifier.predict_single("invoice", "payment due")
+        os._exit(0 if "error" not in result else 3)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            sys.exit(os.waitstatus_to_exitcode(status))
+        time.sleep(0.1)
+    os.kill(pid, 9)
+    sys.exit("worker hung on its first prediction")
+""")
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork serving needs os.fork")
+def test_forked_worker_predicts_with_several_threads(tiny_model_dir, service_cwd):
+    env = {**os.environ, "SERVING_MODEL_DIR": tiny_model_dir, "TESTING": "1"}
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_PREDICTS.format(service_dir=SERVICE_DIR)],
+        cwd=service_cwd, env=env, capture_output=True, text=True, timeout=180
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
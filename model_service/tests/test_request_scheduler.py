@@ -0,0 +1,238 @@
+"""
+Request scheduler: fair queuing, priority lanes, deadlines and admission control
+Each test holds the workers with a gated unit so the queue order can be observed
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from request_scheduler import DeadlineExceeded, RequestScheduler
+
+def lanes(interactive_queue: int = 0, bulk_queue: int = 0):
+    return {
+        "interactive": {"priority": 0, "limit": 8, "deadline_ms": 0, "max_queue": interactive_queue},
+        "bulk": {"priority": 2, "limit": 8, "deadline_ms": 0, "max_queue": bulk_queue},
+    }
+
+class Gate:
+    """Blocking unit that holds a worker until opened"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def __call__(self):
+        assert self.event.wait(5), "gate never opened"
+        return "gate"
+
+    def open(self):
+        self.event.set()
+
+async def settle():
+    """Let queued submissions reach the scheduler and dispatched units start"""
+    await asyncio.sleep(0.05)
+
+def test_start_time_fair_ordering_across_tenants():
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        gate, order = Gate(), []
+        held = asyncio.create_task(scheduler.submit("bulk", "heavy", gate))
+        await settle()
+        # 'heavy' queues five units before 'light' submits its first
+        units = [asyncio.create_task(scheduler.submit("bulk", "heavy", order.append, f"heavy-{i}")) for i in range(5)]
+        units.append(asyncio.create_task(scheduler.submit("bulk", "light", order.append, "light-0")))
+        await settle()
+        gate.open()
+        await asyncio.gather(held, *units)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order.index("light-0") == 1
+    assert [name for name in order if name.startswith("heavy")] == [f"heavy-{i}" for i in range(5)]
+
+def test_tenant_weight_shares_lane():
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        scheduler.set_tenant_weight("gold", 3.0)
+        gate, order = Gate(), []
+        held = asyncio.create_task(scheduler.submit("bulk", "x", gate))
+        await settle()
+        units = [asyncio.create_task(scheduler.submit("bulk", tenant, order.append, tenant))
+                 for _ in range(4) for tenant in ("gold", "basic")]
+        await settle()
+        gate.open()
+        await asyncio.gather(held, *units)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[:4].count("gold") == 3
+
+def test_priority_lane_runs_first():
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        gate, order = Gate(), []
+        held = asyncio.create_task(scheduler.submit("bulk", "a", gate))
+        await settle()
+        units = [asyncio.create_task(scheduler.submit("bulk", "a", order.append, "bulk"))]
+        units.append(asyncio.create_task(scheduler.submit("interactive", "a", order.append, "interactive")))
+        await settle()
+        gate.open()
+        await asyncio.gather(held, *units)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
+
+def test_reserved_worker_serves_top_lane_while_bulk_waits():
+    async def scenario():
+        scheduler = RequestScheduler(workers=2, lanes=lanes(), reserved_workers=1)
+        gate, started = Gate(), []
+        held = asyncio.create_task(scheduler.submit("bulk", "a", gate))
+        await settle()
+        # The one shared worker is busy, so more bulk work queues even though a worker is idle
+        second_bulk = asyncio.create_task(scheduler.submit("bulk", "a", started.append, "bulk"))
+        await settle()
+        assert started == []
+        assert scheduler.snapshot()["lanes"]["bulk"]["queued"] == 1
+
+        # ...while the reserved worker answers interactive requests immediately
+        await asyncio.wait_for(scheduler.submit("interactive", "b", started.append, "interactive"), timeout=2)
+        assert started == ["interactive"]
+
+        gate.open()
+        await asyncio.gather(held, second_bulk)
+        return started
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
+
+def test_expired_unit_is_not_run():
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        gate, ran = Gate(), []
+        held = asyncio.create_task(scheduler.submit("bulk", "a", gate))
+        await settle()
+        expiring = asyncio.create_task(
+            scheduler.submit("bulk", "a", ran.append, "late", deadline=time.perf_counter() + 0.01)
+        )
+        await settle()
+        gate.open()
+        await held
+        with pytest.raises(DeadlineExceeded):
+            await expiring
+        return scheduler, ran
+
+    scheduler, ran = asyncio.run(scenario())
+    assert ran == []
+    assert scheduler.snapshot()["lanes"]["bulk"]["expired"] == 1
+
+def test_errors_propagate_to_caller():
+    def fail():
+        raise ValueError("boom")
+
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        with pytest.raises(ValueError):
+            await scheduler.submit("interactive", "a", fail)
+
+    asyncio.run(scenario())
+
+@pytest.fixture
+def app_module(monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("torch")
+    monkeypatch.setenv("TESTING", "1")
+    import enhanced_app
+    return enhanced_app
+
+def test_queue_full_and_overload_action(app_module, monkeypatch):
+    from fastapi import HTTPException
+
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(interactive_queue=2, bulk_queue=2), reserved_workers=0)
+        monkeypatch.setattr(app_module, "scheduler", scheduler)
+        monkeypatch.setattr(app_module, "DEGRADED_MODE_LANES", {"interactive"})
+        assert app_module.overload_action("bulk", None) is None
+
+        gate = Gate()
+        held = asyncio.create_task(scheduler.submit("bulk", "a", gate))
+        await settle()
+        queued = [asyncio.create_task(scheduler.submit(lane, "a", len, [1], cost=2))
+                  for lane in ("interactive", "bulk")]
+        await settle()
+        assert scheduler.queue_full("interactive") and scheduler.queue_full("bulk")
+
+        # Degradable lanes fall back to rules; the others are shed with Retry-After
+        assert app_module.overload_action("interactive", None) == "degrade"
+        with pytest.raises(HTTPException) as shed:
+            app_module.overload_action("bulk", None)
+        assert shed.value.status_code == 503 and "Retry-After" in shed.value.headers
+
+        gate.open()
+        await asyncio.gather(held, *queued)
+        assert not scheduler.queue_full("bulk")
+
+        # A deadline the estimated queue time already misses counts as over budget
+        scheduler.seconds_per_cost = 1.0
+        with pytest.raises(HTTPException):
+            app_module.overload_action("bulk", time.perf_counter() + 0.1)
+        assert app_module.overload_action("bulk", time.perf_counter() + 60) is None
+
+    asyncio.run(scenario())
+
+def test_torch_profile_records_scheduler_threads(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    import profiling
+
+    monkeypatch.setattr(profiling, "PROFILE_OUTPUT_DIR", str(tmp_path))
+    profiler = profiling.TorchRequestProfiler()
+    try:
+        profiler.arm(1)
+    except NotImplementedError:
+        pytest.skip("torch build cannot profile all threads")
+
+    def forward():
+        a = torch.randn(16, 16)
+        return torch.nn.functional.gelu(a @ a)
+
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        await scheduler.submit("interactive", "a", forward)
+
+    asyncio.run(scenario())
+    profiler.request_finished()
+    with open(profiler.result["trace_path"]) as f:
+        trace = f.read()
+    assert "aten::mm" in trace and "aten::gelu" in trace
+
+def test_queue_wait_reaches_stage_histogram_and_request_log():
+    import profiling
+    from service_metrics import STAGE_LATENCY
+
+    def queue_wait_count():
+        return STAGE_LATENCY.summary().get("queue_wait", {}).get("count", 0)
+
+    before = queue_wait_count()
+
+    async def scenario():
+        scheduler = RequestScheduler(workers=1, lanes=lanes(), reserved_workers=0)
+        gate = Gate()
+        held = asyncio.create_task(scheduler.submit("bulk", "a", gate))
+        await settle()
+
+        async def sampled_request():
+            timings = {}
+            profiling._stage_timings.set(timings)
+            await scheduler.submit("bulk", "a", len, [1])
+            return timings
+
+        request = asyncio.create_task(sampled_request())
+        await settle()
+        gate.open()
+        await held
+        return await request
+
+    timings = asyncio.run(scenario())
+    # The unit sat behind the gated one for at least one settle()
+    assert timings["queue_wait"] >= 0.04
+    assert queue_wait_count() == before + 2
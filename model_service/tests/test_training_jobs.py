@@ -0,0 +1,121 @@
+"""
+Training job store and the serving-side runner
+Claiming, cancellation, recovery after a worker crash and the events watch() reports
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from training_jobs import JobStore, TrainingJobRunner
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+@pytest.fixture
+def runner(store, monkeypatch):
+    runner = TrainingJobRunner(store)
+    runner.worker_starts = 0
+
+    def ensure_worker():
+        runner.worker_starts += 1
+
+    monkeypatch.setattr(runner, "ensure_worker", ensure_worker)
+    return runner
+
+def test_claim_takes_oldest_queued_job(store):
+    first = store.submit("distilbert", {"data_file": "a.csv"})
+    second = store.submit("distilbert", {"data_file": "b.csv"})
+
+    claimed = store.claim_next(worker_pid=123)
+    assert claimed["id"] == first["id"]
+    assert (claimed["status"], claimed["worker_pid"], claimed["attempts"]) == ("running", 123, 1)
+    assert claimed["config"] == {"data_file": "a.csv"}
+    assert store.claim_next(worker_pid=123)["id"] == second["id"]
+    assert store.claim_next(worker_pid=123) is None
+
+def test_cancel_queued_job_is_immediate(store):
+    job = store.submit("distilbert", {})
+    cancelled = store.request_cancel(job["id"])
+    assert cancelled["status"] == "cancelled" and cancelled["finished_at"] is not None
+    assert store.claim_next(worker_pid=1) is None
+
+def test_cancel_running_job_is_flagged(store):
+    job = store.submit("distilbert", {})
+    store.claim_next(worker_pid=1)
+
+    flagged = store.request_cancel(job["id"])
+    assert flagged["status"] == "running" and flagged["cancel_requested"]
+    # The worker finds out at its next progress report
+    assert store.update_progress(job["id"], {"stage": "training"})
+    assert store.overdue_cancellations(grace_seconds=60) == []
+    assert [overdue["id"] for overdue in store.overdue_cancellations(grace_seconds=-1)] == [job["id"]]
+
+    store.finish(job["id"], "cancelled")
+    assert store.get(job["id"])["status"] == "cancelled"
+
+def test_recover_interrupted_retries_then_fails(store):
+    job = store.submit("distilbert", {})
+    store.claim_next(worker_pid=1)
+
+    # First interruption: back in the queue
+    store.recover_interrupted(max_attempts=2)
+    requeued = store.get(job["id"])
+    assert (requeued["status"], requeued["worker_pid"]) == ("queued", None)
+
+    # Second interruption reaches the attempt limit
+    assert store.claim_next(worker_pid=2)["attempts"] == 2
+    store.recover_interrupted(max_attempts=2)
+    failed = store.get(job["id"])
+    assert failed["status"] == "failed" and "Worker stopped" in failed["error"]
+
+def test_recover_interrupted_completes_requested_cancel(store):
+    job = store.submit("distilbert", {})
+    store.claim_next(worker_pid=1)
+    store.request_cancel(job["id"])
+    store.recover_interrupted()
+    assert store.get(job["id"])["status"] == "cancelled"
+
+def test_reads_do_not_wait_for_writers(store):
+    job = store.submit("distilbert", {})
+    writer = sqlite3.connect(store.path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        results = {}
+        reader = threading.Thread(target=lambda: results.update(job=store.get(job["id"]), jobs=store.list()))
+        reader.start()
+        reader.join(timeout=5)
+        assert not reader.is_alive(), "read blocked behind the write lock"
+        assert results["job"]["id"] == job["id"] and len(results["jobs"]) == 1
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+def test_poll_reports_state_changes_once(store, runner):
+    job = store.submit("distilbert", {})
+    assert runner.poll() == []
+    assert runner.worker_starts == 1
+
+    store.claim_next(worker_pid=1)
+    assert [event for _, event in runner.poll()] == ["started"]
+    assert runner.poll() == []
+
+    time.sleep(0.01)
+    store.update_progress(job["id"], {"stage": "training", "step": 1})
+    events = runner.poll()
+    assert [event for _, event in events] == ["progress"]
+    assert events[0][0]["progress"]["step"] == 1
+
+    store.finish(job["id"], "succeeded", result={"model_path": "m"})
+    assert [event for _, event in runner.poll()] == ["succeeded"]
+    assert runner.poll() == []
+
+def test_first_poll_skips_already_finished_jobs(store, runner):
+    job = store.submit("distilbert", {})
+    store.claim_next(worker_pid=1)
+    store.finish(job["id"], "failed", error="boom")
+    assert runner.poll() == []
+    assert runner.worker_starts == 0
@@ -0,0 +1,38 @@
+"""
+Evaluation scores what serving returns
+predict_feature_matrix (used by evaluate_model) must agree with the ensemble's predict_single
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("xgboost")
+
+def test_eval_predictions_match_predict_single(service_cwd):
+    from conftest import make_tiny_model
+    from dynamic_classifier import DynamicCategoryManager, DynamicEmailClassifier
+    from ensemble_classifier import EnsembleEmailClassifier
+    from training_pipeline import ModelTrainingPipeline
+
+    # Trainer-style checkpoint: id2label sorted by name, not in categories.json order
+    labels = sorted(DynamicCategoryManager().get_category_names())
+    classifier = DynamicEmailClassifier(model_path=make_tiny_model(str(service_cwd / "model"), len(labels), labels=labels))
+    ensemble = EnsembleEmailClassifier(distilbert_model=classifier)
+
+    texts = [("invoice", "payment due"), ("job offer", "meeting schedule"), ("sale", "hello world the offer")]
+    samples = [
+        {"subject": subject, "body": f"{body} {i}", "from": f"sender{i}@example.com", "trueLabel": label}
+        for i in range(4) for (subject, body), label in zip(texts, labels[:3])
+    ]
+    pipeline = ModelTrainingPipeline(str(service_cwd / "models"))
+    X, y, _ = pipeline.prepare_training_data(samples)
+    ensemble.train_feature_matrix(X, y)
+
+    evaluated = ensemble.predict_feature_matrix(samples, X)
+    for sample, result in zip(samples, evaluated):
+        served = ensemble.predict_single(sample["subject"], sample["body"], {
+            "subject": sample["subject"], "body": sample["body"], "html": "", "from": sample["from"],
+            "to": "", "date": None, "attachments": []
+        })
+        assert result["label"] == served["label"]
+        assert result["confidence"] == pytest.approx(served["confidence"], abs=1e-4)
@@ -0,0 +1,444 @@
+"""
+Out-of-Process Training Jobs
+A persistent SQLite job queue, a low-priority worker process that runs training, and the serving-side runner
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRAINING_JOBS_DB = os.getenv("TRAINING_JOBS_DB", "training_jobs.db")
+# torch/OpenMP threads for the worker; keep below the cores serving needs
+TRAINING_WORKER_THREADS = int(os.getenv("TRAINING_WORKER_THREADS", "2"))
+TRAINING_WORKER_NICE = int(os.getenv("TRAINING_WORKER_NICE", "10"))
+# Comma-separated CPU ids to pin the worker to (empty: no pinning)
+TRAINING_WORKER_CPUS = os.getenv("TRAINING_WORKER_CPUS", "")
+# The worker exits after this long with an empty queue and is restarted on the next submit
+TRAINING_WORKER_IDLE_SECONDS = float(os.getenv("TRAINING_WORKER_IDLE_SECONDS", "300"))
+# A running job that has not stopped this long after cancel is killed with its worker
+TRAINING_CANCEL_GRACE_SECONDS = float(os.getenv("TRAINING_CANCEL_GRACE_SECONDS", "30"))
+# Jobs interrupted by a worker crash or restart are retried up to this many runs in total
+TRAINING_JOB_MAX_ATTEMPTS = int(os.getenv("TRAINING_JOB_MAX_ATTEMPTS", "2"))
+
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    config TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_pid INTEGER,
+    cancel_requested_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    updated_at REAL NOT NULL
+)
+"""
+
+class JobCancelled(Exception):
+    """Raised inside the worker when the running job has been cancelled"""
+
+class JobStore:
+    """
+    Training job queue in a local SQLite file
+
+    Every call opens its own connection, so the serving processes and the
+    worker can share one store. Writes run in IMMEDIATE transactions, which
+    makes claim_next() atomic across processes; reads use deferred ones,
+    which in WAL mode never wait for or block a writer.
+    """
+
+    def __init__(self, path: str = TRAINING_JOBS_DB):
+        self.path = path
+        # WAL is a property of the database file, so setting it once is enough
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        with self._transaction() as conn:
+            conn.execute(SCHEMA)
+
+    @contextmanager
+    def _transaction(self, write: bool = True):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("config", "progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        job["cancel_requested"] = job.pop("cancel_requested_at") is not None
+        return job
+
+    def submit(self, kind: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, config, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(config), now, now)
+            )
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._transaction(write=False) as conn:
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest first"""
+        with self._transaction(write=False) as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim_next(self, worker_pid: int) -> Optional[Dict[str, Any]]:
+        """Move the oldest queued job to running, owned by worker_pid"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, attempts = attempts + 1, "
+                "started_at = ?, updated_at = ? WHERE id = ?",
+                (worker_pid, now, now, row["id"])
+            )
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def update_progress(self, job_id: str, progress: Dict[str, Any]) -> bool:
+        """Record progress; returns True if the job has been cancelled meanwhile"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(progress), time.time(), job_id)
+            )
+            row = conn.execute("SELECT cancel_requested_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row["cancel_requested_at"] is not None
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                (status, json.dumps(result, default=str) if result is not None else None, error, now, now, job_id)
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Queued jobs are cancelled at once; running ones are flagged and stop at the next step"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, now, job_id)
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND cancel_requested_at IS NULL",
+                (now, now, job_id)
+            )
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def overdue_cancellations(self, grace_seconds: float) -> List[Dict[str, Any]]:
+        with self._transaction(write=False) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND cancel_requested_at < ?",
+                (time.time() - grace_seconds,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def recover_interrupted(self, max_attempts: int = TRAINING_JOB_MAX_ATTEMPTS):
+        """Requeue (or fail) jobs left running by a worker that is gone; called by a worker on start"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? "
+                "WHERE status = 'running' AND cancel_requested_at IS NOT NULL",
+                (now, now)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker stopped during training', "
+                "finished_at = ?, updated_at = ? WHERE status = 'running' AND attempts >= ?",
+                (now, now, max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_pid = NULL, updated_at = ? WHERE status = 'running'",
+                (now,)
+            )
+
+# --- Worker process -----------------------------------------------------------
+
+def run_distilbert_job(store: JobStore, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Fine-tune DistilBERT as configured by a DistilBERTTrainingInput; progress goes to the store"""
+    from transformers import TrainerCallback
+    from distilbert_trainer import DistilBERTTrainer
+
+    job_id = job["id"]
+    config = job["config"]
+
+    def report(progress: Dict[str, Any]):
+        if store.update_progress(job_id, progress):
+            raise JobCancelled()
+
+    class ProgressCallback(TrainerCallback):
+        """Throttled step/loss reports; raising from a step callback aborts Trainer.train()"""
+
+        def __init__(self):
+            self.last_report = 0.0
+            self.latest: Dict[str, Any] = {}
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            self.latest.update({k: v for k, v in (logs or {}).items() if isinstance(v, (int, float))})
+
+        def on_step_end(self, args, state, control, **kwargs):
+            now = time.monotonic()
+            if now - self.last_report < PROGRESS_INTERVAL_SECONDS and state.global_step < state.max_steps:
+                return
+            self.last_report = now
+            report({
+                "stage": "training",
+                "step": state.global_step,
+                "max_steps": state.max_steps,
+                "epoch": state.epoch,
+                "fraction": state.global_step / state.max_steps if state.max_steps else None,
+                "metrics": dict(self.latest)
+            })
+
+    report({"stage": "loading_data"})
+    # One directory per job: the serving process may have the previous model memory-mapped
+    output_dir = os.path.join(config.get("output_dir") or "distilbert_models", job_id)
+    trainer = DistilBERTTrainer(output_dir=output_dir, max_length=config.get("max_length", 256))
+    texts, labels, label_mapping = trainer.load_and_preprocess_dataset(config["data_file"])
+    if len(texts) == 0:
+        raise ValueError("No valid training examples found")
+
+    trainer.initialize_model(len(label_mapping))
+    report({"stage": "training", "step": 0, "fraction": 0.0})
+    results = trainer.train_model(
+        texts=texts,
+        labels=labels,
+        validation_split=config.get("validation_split", 0.2),
+        train_batch_size=config.get("batch_size", 16),
+        num_epochs=config.get("num_epochs", 3),
+        learning_rate=config.get("learning_rate", 2e-5),
+        callbacks=[ProgressCallback()]
+    )
+    return {
+        "model_path": results.get("model_path"),
+        "metrics": results.get("eval_results", {}),
+        "training_loss": results.get("training_loss"),
+        "timestamp": results.get("timestamp")
+    }
+
+JOB_HANDLERS: Dict[str, Callable[[JobStore, Dict[str, Any]], Dict[str, Any]]] = {
+    "distilbert": run_distilbert_job,
+}
+
+def _limit_worker_resources(threads: int):
+    """Lower the worker's priority and CPU share so serving threads win under contention"""
+    try:
+        os.nice(TRAINING_WORKER_NICE)
+    except OSError as e:
+        logger.warning(f"Could not lower training worker priority: {e}")
+    if TRAINING_WORKER_CPUS:
+        try:
+            os.sched_setaffinity(0, {int(cpu) for cpu in TRAINING_WORKER_CPUS.split(",")})
+        except (AttributeError, OSError, ValueError) as e:
+            logger.warning(f"Could not pin training worker to CPUs {TRAINING_WORKER_CPUS}: {e}")
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+def run_job(store: JobStore, job: Dict[str, Any]):
+    logger.info(f"Training job {job['id']} ({job['kind']}) started")
+    try:
+        result = JOB_HANDLERS[job["kind"]](store, job)
+    except JobCancelled:
+        store.finish(job["id"], "cancelled")
+        logger.info(f"Training job {job['id']} cancelled")
+    except Exception as e:
+        logger.exception(f"Training job {job['id']} failed")
+        store.finish(job["id"], "failed", error=str(e))
+    else:
+        store.finish(job["id"], "succeeded", result=result)
+        logger.info(f"Training job {job['id']} succeeded")
+
+def _try_worker_lock(db_path: str):
+    """The open, exclusively locked worker lock file, or None if a worker already holds it"""
+    lock_file = open(db_path + ".worker.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def worker_main(db_path: str, threads: int) -> int:
+    """Run queued jobs one at a time until the queue has been empty for the idle timeout"""
+    # Only one worker per store; a second one started concurrently just exits
+    lock_file = _try_worker_lock(db_path)
+    if lock_file is None:
+        return 0
+
+    _limit_worker_resources(threads)
+    store = JobStore(db_path)
+    store.recover_interrupted()
+    logger.info(f"Training worker {os.getpid()} started ({threads} threads)")
+
+    idle_since = time.monotonic()
+    while True:
+        job = store.claim_next(os.getpid())
+        if job is None:
+            if time.monotonic() - idle_since > TRAINING_WORKER_IDLE_SECONDS:
+                logger.info("Training worker idle; exiting")
+                return 0
+            time.sleep(1.0)
+            continue
+        run_job(store, job)
+        idle_since = time.monotonic()
+
+# --- Serving side -------------------------------------------------------------
+
+class TrainingJobRunner:
+    """
+    Submits jobs, keeps a worker process alive while there is work, and reports changes
+
+    The worker is a separate interpreter started with subprocess (not fork),
+    so it never shares the serving process's GIL, event loop or torch thread
+    pool. watch() polls the store and calls on_event(job, event) for every
+    start, progress update and finish; event is one of "started",
+    "progress", "succeeded", "failed" or "cancelled".
+    """
+
+    def __init__(self, store: JobStore, threads: int = TRAINING_WORKER_THREADS):
+        self.store = store
+        self.threads = threads
+        self.process: Optional[subprocess.Popen] = None
+        self.seen: Dict[str, tuple] = {}
+
+    def submit(self, kind: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown training job kind: {kind}")
+        job = self.store.submit(kind, config)
+        self.ensure_worker()
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.request_cancel(job_id)
+
+    def ensure_worker(self):
+        """Start a worker unless one is running (here or started by another serving process)"""
+        if self.process is not None and self.process.poll() is None:
+            return
+        lock_file = _try_worker_lock(os.path.abspath(self.store.path))
+        if lock_file is None:
+            return
+        lock_file.close()
+        thread_limit = str(self.threads)
+        env = dict(
+            os.environ, OMP_NUM_THREADS=thread_limit, MKL_NUM_THREADS=thread_limit,
+            TOKENIZERS_PARALLELISM="false"
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker",
+             "--db", os.path.abspath(self.store.path), "--threads", thread_limit],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+        )
+        logger.info(f"Started training worker {self.process.pid}")
+
+    def _kill_overdue(self):
+        for job in self.store.overdue_cancellations(TRAINING_CANCEL_GRACE_SECONDS):
+            logger.warning(f"Training job {job['id']} ignored cancel; stopping worker {job['worker_pid']}")
+            try:
+                os.kill(job["worker_pid"], signal.SIGKILL)
+            except (ProcessLookupError, TypeError):
+                pass
+            self.store.finish(job["id"], "cancelled", error="Killed after cancel timeout")
+
+    def poll(self) -> List[tuple]:
+        """One pass over the store: enforce cancel timeouts, restart a missing worker, diff job states"""
+        self._kill_overdue()
+        jobs = self.store.list()
+        first_pass = not self.seen
+        events = []
+        needs_worker = False
+        for job in jobs:
+            state = (job["status"], job["updated_at"])
+            previous = self.seen.get(job["id"])
+            self.seen[job["id"]] = state
+            # A running job without a live worker is requeued by the next worker
+            if job["status"] in ("queued", "running"):
+                needs_worker = True
+            if previous == state or (first_pass and job["status"] in FINISHED_STATES):
+                continue
+            if job["status"] == "running":
+                events.append((job, "started" if previous is None or previous[0] != "running" else "progress"))
+            elif job["status"] in FINISHED_STATES:
+                events.append((job, job["status"]))
+        if needs_worker:
+            self.ensure_worker()
+        return events
+
+    async def watch(self, on_event: Callable[[Dict[str, Any], str], Awaitable[None]], interval: float = 1.0):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                for job, event in await loop.run_in_executor(None, self.poll):
+                    await on_event(job, event)
+            except Exception as e:
+                logger.error(f"Training job watcher error: {e}")
+            await asyncio.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sortify training job worker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="Run queued training jobs")
+    worker.add_argument("--db", default=TRAINING_JOBS_DB)
+    worker.add_argument("--threads", type=int, default=TRAINING_WORKER_THREADS)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        return worker_main(args.db, args.threads)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,7 +19,8 @@ warnings.filterwarnings('ignore')
 from dynamic_classifier import DynamicEmailClassifier
 from ensemble_classifier import EnsembleEmailClassifier
 from data_collection import TrainingDataCollector
-from feature_extractor import EmailFeatureExtractor, normalize_features
+from feature_extractor import EmailFeatureExtractor
+from feature_cache import FeatureCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +34,7 @@ class ModelTrainingPipeline:
         self.model_save_dir.mkdir(exist_ok=True)
         
         self.feature_extractor = EmailFeatureExtractor()
+        self.feature_cache = FeatureCache(self.model_save_dir / "feature_cache")
         self.data_collector = TrainingDataCollector()
         
         self.training_history = []
@@ -50,39 +52,13 @@ class ModelTrainingPipeline:
         """
         logger.info(f"Preparing training data from {len(training_samples)} samples")
         
-        X = []
-        y = []
-        
-        for sample in training_samples:
-            try:
-                # Extract features
-                email_data = {
-                    'subject': sample.get('subject', ''),
-                    'body': sample.get('body', ''),
-                    'html': sample.get('html', ''),
-                    'from': sample.get('from', ''),
-                    'to': sample.get('to', ''),
-                    'date': sample.get('date'),
-                    'attachments': sample.get('attachments', [])
-                }
-                
-                features = self.feature_extractor.extract_features(email_data)
-                normalized_features = normalize_features(features)
-                
-                # Convert to feature vector
-                feature_vector = self._features_to_vector(normalized_features)
-                X.append(feature_vector)
-                y.append(sample['trueLabel'])
-                
-            except Exception as e:
-                logger.warning(f"Error processing sample: {e}")
-                continue
-        
-        if not X:
+        labelled = self._labelled(training_samples)
+        if not labelled:
             raise ValueError("No valid training samples found")
         
-        X = np.array(X)
-        y = np.array(y)
+        # Each sample's features are extracted once and reused across training, evaluation and retrains
+        X = self.feature_cache.feature_matrix(labelled)
+        y = np.array([sample['trueLabel'] for sample in labelled])
         
         # Get unique categories
         categories = sorted(list(set(y)))
@@ -93,30 +69,24 @@ class ModelTrainingPipeline:
         
         return X, y, categories
     
-    def _features_to_vector(self, features: Dict[str, Any]) -> List[float]:
-        """Convert feature dictionary to ordered vector"""
-        expected_features = [
-            'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
-            'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
-            'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
-            'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
-            'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
-            'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
-            'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
-            'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
-            'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
-            'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
-            'subject_question_count', 'subject_number_count', 'body_paragraph_count',
-            'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
-            'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header',
-            'sender_domain_hash', 'sender_tld_hash'
-        ]
-        
-        feature_vector = []
-        for feature_name in expected_features:
-            feature_vector.append(features.get(feature_name, 0.0))
+    def _labelled(self, samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Samples that carry a label"""
+        labelled = [sample for sample in samples if sample.get('trueLabel')]
+        if len(labelled) < len(samples):
+            logger.warning(f"Skipping {len(samples) - len(labelled)} samples without trueLabel")
+        return labelled
+    
+    def _split_indices(self, y: np.ndarray, validation_split: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Stratified train/validation row indices (everything in both when there is too little data)"""
+        indices = np.arange(len(y))
+        n_validation = int(len(y) * validation_split)
+        if not 0 < validation_split < 1 or n_validation < 10:
+            logger.warning("Too few samples for a held-out validation set; evaluating on the training data")
+            return indices, indices
         
-        return feature_vector
+        _, counts = np.unique(y, return_counts=True)
+        stratify = y if counts.min() >= 2 and n_validation >= len(counts) else None
+        return train_test_split(indices, test_size=validation_split, stratify=stratify, random_state=42)
     
     def train_ensemble_model(self, training_samples: List[Dict[str, Any]], validation_split: float = 0.2) -> Dict[str, Any]:
         """
@@ -140,17 +110,19 @@ class ModelTrainingPipeline:
             )
             
             # Prepare feature data for feature-based classifier
-            X, y, categories = self.prepare_training_data(training_samples)
+            labelled = self._labelled(training_samples)
+            X, y, categories = self.prepare_training_data(labelled)
+            train_idx, validation_idx = self._split_indices(y, validation_split)
             
-            # Train feature-based classifier
+            # Train feature-based classifier on the cached matrix
             if len(X) > 0:
-                ensemble.train_feature_model(training_samples)
+                ensemble.train_feature_matrix(X[train_idx], y[train_idx])
                 logger.info("Feature-based classifier training completed")
             else:
                 logger.warning("No feature data available, using DistilBERT only")
             
-            # Evaluate model performance
-            metrics = self.evaluate_model(ensemble, training_samples, validation_split)
+            # Evaluate model performance on the held-out rows (features come from the cache)
+            metrics = self.evaluate_model(ensemble, [labelled[i] for i in validation_idx], validation_split)
             
             # Save trained model
             model_path = self.model_save_dir / f"ensemble_model_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -160,7 +132,10 @@ class ModelTrainingPipeline:
             training_record = {
                 'timestamp': datetime.now().isoformat(),
                 'samples_count': len(training_samples),
+                'train_count': int(len(train_idx)),
+                'validation_count': int(len(validation_idx)),
                 'feature_count': X.shape[1] if len(X) > 0 else 0,
+                'feature_cache': self.feature_cache.snapshot(),
                 'categories': categories,
                 'metrics': metrics,
                 'model_path': str(model_path)
@@ -218,40 +193,16 @@ class ModelTrainingPipeline:
                 }
             
             # Prepare test data
-            X, y_true, categories = self.prepare_training_data(test_samples)
+            labelled = self._labelled(test_samples)
+            X, y_true, categories = self.prepare_training_data(labelled)
             
             if len(X) == 0:
                 return {'accuracy': 0.0, 'error': 'No valid test samples'}
             
-            # Get predictions
-            y_pred = []
-            y_scores = []
-            
-            for sample in test_samples:
-                try:
-                    email_data = {
-                        'subject': sample.get('subject', ''),
-                        'body': sample.get('body', ''),
-                        'html': sample.get('html', ''),
-                        'from': sample.get('from', ''),
-                        'to': sample.get('to', ''),
-                        'date': sample.get('date'),
-                        'attachments': sample.get('attachments', [])
-                    }
-                    
-                    result = model.predict_single(
-                        email_data['subject'], 
-                        email_data['body'], 
-                        email_data
-                    )
-                    
-                    y_pred.append(result['label'])
-                    y_scores.append(result.get('ensembleScores', {}).get('combined', result['confidence']))
-                    
-                except Exception as e:
-                    logger.warning(f"Error evaluating sample: {e}")
-                    y_pred.append(sample['trueLabel'])  # Fallback
-                    y_scores.append(0.5)
+            # Batched predictions straight from the cached feature rows
+            results = model.predict_feature_matrix(labelled, X)
+            y_pred = [result['label'] for result in results]
+            y_scores = [result.get('ensembleScores', {}).get('combined', result['confidence']) for result in results]
             
             # Calculate metrics
             accuracy = accuracy_score(y_true, y_pred)